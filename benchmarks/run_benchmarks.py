@@ -0,0 +1,265 @@
+"""Benchmarks of ``hyper_decom`` for stim surface-code and repetition-code circuits.
+
+Each step of the decomposition pipeline is timed separately and its peak
+memory is recorded with ``tracemalloc``. The time to start a Python process
+that imports ``hyper_decom`` is also recorded. The results are stored in a JSON
+file, which can be compared with the one of another version, e.g.
+
+    python benchmarks/run_benchmarks.py --output new.json
+    python benchmarks/run_benchmarks.py --output new.json --compare old.json
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+from importlib.metadata import PackageNotFoundError, version
+
+import stim
+
+from hyper_decom import (
+    decompose_dem,
+    find_valid_decompositions,
+    from_dem_to_stim,
+    from_stim_to_dem,
+)
+
+CODE_TASKS = {
+    "surface_code": "surface_code:rotated_memory_z",
+    "repetition_code": "repetition_code:memory",
+}
+STEPS = [
+    "from_stim_to_dem",
+    "decompose_dem",
+    "decompose_dem_logical_aware",
+    "get_decomposed_dem",
+    "from_dem_to_stim",
+    "find_valid_decompositions",
+]
+
+
+def get_circuit(code: str, distance: int, rounds: int, noise: float) -> stim.Circuit:
+    return stim.Circuit.generated(
+        CODE_TASKS[code],
+        distance=distance,
+        rounds=rounds,
+        after_clifford_depolarization=noise,
+        before_round_data_depolarization=noise,
+        before_measure_flip_probability=noise,
+        after_reset_flip_probability=noise,
+    )
+
+
+def time_steps(
+    stim_dem: stim.DetectorErrorModel, num_valid: int, trace_memory: bool = False
+) -> dict:
+    """Returns the duration in seconds of each step of the pipeline and,
+    if ``trace_memory``, their peak memory in bytes. Tracing the memory
+    slows down the steps, thus both are not measured in the same run."""
+    timings, memory = {}, {}
+
+    def measure(step, func, *args, **kargs):
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        output = func(*args, **kargs)
+        timings[step] = time.perf_counter() - start
+        if trace_memory:
+            memory[step] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return output
+
+    measure("from_stim_to_dem", from_stim_to_dem, stim_dem)
+    # the default mode raises an error if a decomposition has a different
+    # logical effect than its hyperedge, which happens for small distances
+    dem, stats = from_stim_to_dem(stim_dem), {}
+    measure("decompose_dem", decompose_dem, dem, ignore_logical_error=True, stats=stats)
+    dem = from_stim_to_dem(stim_dem)
+    decom_dem = measure(
+        "decompose_dem_logical_aware", decompose_dem, dem, mode="logical-aware"
+    )
+    measure("get_decomposed_dem", decom_dem.get_decomposed_dem)
+    measure("from_dem_to_stim", from_dem_to_stim, decom_dem)
+
+    primitive_dem = decom_dem.get_primitive_graph()
+    hyperfaults = [
+        instr
+        for instr in stim_dem.flattened()
+        if instr.type == "error"
+        and sum(t.is_relative_detector_id() for t in instr.targets_copy()) > 2
+    ][:num_valid]
+    measure(
+        "find_valid_decompositions",
+        find_valid_decompositions,
+        primitive_dem,
+        hyperfaults,
+    )
+
+    info = {
+        "num_detectors": stim_dem.num_detectors,
+        "num_errors": stim_dem.num_errors,
+        "num_hyperedges": stats["num_hyperedges"],
+        "num_valid_checked": len(hyperfaults),
+    }
+    return {"timings": timings, "peak_memory": memory, **info}
+
+
+def run_benchmarks(args: argparse.Namespace) -> dict:
+    results = []
+    cases = itertools.product(args.codes, args.distances, args.rounds, args.noise)
+    for code, distance, rounds, noise in cases:
+        stim_dem = get_circuit(code, distance, rounds, noise).detector_error_model()
+
+        # the minimum over the repetitions is the least noisy estimate
+        runs = [time_steps(stim_dem, args.num_valid) for _ in range(args.repeat)]
+        result = {"code": code, "distance": distance, "rounds": rounds, "noise": noise}
+        result.update({k: v for k, v in runs[0].items() if k.startswith("num_")})
+        result["timings"] = {s: min(run["timings"][s] for run in runs) for s in STEPS}
+        memory_run = time_steps(stim_dem, args.num_valid, trace_memory=True)
+        result["peak_memory"] = memory_run["peak_memory"]
+        results.append(result)
+
+        total = sum(result["timings"].values())
+        print(
+            f"{code} d={distance} r={rounds} p={noise}: {total:.3f} s "
+            f"({result['num_hyperedges']} hyperedges)",
+            flush=True,
+        )
+
+    cold_start = time_cold_start(args.repeat)
+    print(f"import hyper_decom: {cold_start['import_hyper_decom']:.3f} s", flush=True)
+
+    return {
+        "metadata": get_metadata(args),
+        "cold_start": cold_start,
+        "results": results,
+    }
+
+
+def time_cold_start(repeat: int) -> dict:
+    """Returns the duration in seconds of starting a new Python process that
+    imports ``hyper_decom`` and of starting one that does not import it."""
+    timings = {}
+    for name, code in [
+        ("python", "pass"),
+        ("import_hyper_decom", "import hyper_decom"),
+    ]:
+        durations = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], check=True)
+            durations.append(time.perf_counter() - start)
+        timings[name] = min(durations)
+    return timings
+
+
+def get_metadata(args: argparse.Namespace) -> dict:
+    versions = {}
+    for package in ["hyper-decom", "numpy", "scipy", "stim", "pymatching", "ldpc"]:
+        try:
+            versions[package] = version(package)
+        except PackageNotFoundError:
+            versions[package] = None
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": commit,
+        "python": sys.version,
+        "platform": platform.platform(),
+        "versions": versions,
+        "repeat": args.repeat,
+    }
+
+
+def compare(new: dict, old: dict, threshold: float) -> int:
+    """Prints the ratio of the timings between ``new`` and ``old`` and
+    returns the number of steps that are slower than ``threshold``."""
+    num_regressions = 0
+
+    def check(name: str, new_time: float, old_time: float) -> None:
+        nonlocal num_regressions
+        ratio = new_time / max(old_time, 1e-9)
+        flag = ""
+        if ratio > threshold:
+            flag = "  <-- regression"
+            num_regressions += 1
+        print(f"{name}: x{ratio:.2f}{flag}")
+        return
+
+    if "cold_start" in old:
+        name = "import_hyper_decom"
+        check(name, new["cold_start"][name], old["cold_start"][name])
+
+    keys = ["code", "distance", "rounds", "noise"]
+    old_results = {tuple(r[k] for k in keys): r for r in old["results"]}
+    for result in new["results"]:
+        old_result = old_results.get(tuple(result[k] for k in keys))
+        if old_result is None:
+            continue
+        for step in STEPS:
+            if step not in old_result["timings"]:
+                continue
+            name = (
+                f"{result['code']} d={result['distance']} r={result['rounds']} "
+                f"p={result['noise']} {step}"
+            )
+            check(name, result["timings"][step], old_result["timings"][step])
+    return num_regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--codes", nargs="+", choices=list(CODE_TASKS), default=list(CODE_TASKS)
+    )
+    parser.add_argument("--distances", nargs="+", type=int, default=[3, 5, 7])
+    parser.add_argument("--rounds", nargs="+", type=int, default=[3, 10])
+    parser.add_argument("--noise", nargs="+", type=float, default=[0.001, 0.01])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--num-valid",
+        type=int,
+        default=50,
+        help="number of hyperedges checked with find_valid_decompositions",
+    )
+    parser.add_argument("--output", default="benchmarks.json")
+    parser.add_argument("--compare", help="JSON file of a previous run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.5,
+        help="slowdown ratio considered a regression when comparing",
+    )
+    args = parser.parse_args()
+
+    with warnings.catch_warnings():
+        # e.g. warnings about decompositions with a different logical effect
+        warnings.simplefilter("ignore")
+        output = run_benchmarks(args)
+
+    with open(args.output, "w") as file:
+        json.dump(output, file, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as file:
+            old = json.load(file)
+        if compare(output, old, args.threshold) > 0:
+            sys.exit(1)
+
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,29 @@
-from .decomposition import decompose_dem, find_valid_decomposition
-from .stim_tools import from_stim_to_dem, from_dem_to_stim
+from .decomposition import (
+    decompose_dem,
+    decompose_dem_stream,
+    decompose_dem_sweep,
+    decompose_repeated_dem,
+    find_valid_decomposition,
+    find_valid_decompositions,
+)
+from .stim_tools import from_stim_to_dem, from_stim_to_dem_fast, from_dem_to_stim
 from .detector_error_model import DEM
+from .cache import DecompositionCache
+from .disk_cache import DiskCache
+from .evaluation import estimate_logical_error_rates
 
 __all__ = [
     "decompose_dem",
+    "decompose_dem_stream",
+    "decompose_dem_sweep",
+    "decompose_repeated_dem",
     "find_valid_decomposition",
+    "find_valid_decompositions",
     "from_stim_to_dem",
+    "from_stim_to_dem_fast",
     "from_dem_to_stim",
     "DEM",
+    "DecompositionCache",
+    "DiskCache",
+    "estimate_logical_error_rates",
 ]
@@ -0,0 +1,294 @@
+from collections import OrderedDict
+from collections.abc import Hashable, Iterable, Mapping
+
+import numpy as np
+
+from .detector_error_model import DEM, _gather_csr, _pad_csr
+from .util import probs_to_weights
+
+
+class DecompositionCache:
+    """Bounded cache of hyperedge decompositions keyed by their local pattern.
+
+    The pattern of a hyperedge is given by its detectors and the primitive
+    edges around them (with their probabilities), relative to an anchor
+    detector. The relative positions are given by the stim detector
+    coordinates when they exist and by the detector indices otherwise, so
+    that the same pattern in another round or location of the code is a hit.
+    The stored decompositions are validated before being reused.
+
+    When the cache is full, the least recently used pattern is evicted.
+    The number of hits, misses and evictions are stored in ``num_hits``,
+    ``num_misses`` and ``num_evictions``.
+    """
+
+    def __init__(self, max_size: int = 100_000, depth: int = 1) -> None:
+        """Initializes the cache.
+
+        Parameters
+        ----------
+        max_size
+            Maximum number of stored patterns.
+        depth
+            Number of steps in the primitive graph from the detectors of the
+            hyperedge used to build the pattern. Larger depths give less
+            hits, but the reused decompositions are more likely to be the
+            ones that MWPM finds.
+        """
+        if not isinstance(max_size, int) or max_size < 1:
+            raise ValueError(f"'max_size' must be a positive int, not {max_size}.")
+        if not isinstance(depth, int) or depth < 1:
+            raise ValueError(f"'depth' must be a positive int, not {depth}.")
+
+        self.max_size = max_size
+        self.depth = depth
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_evictions = 0
+
+        self._patterns = OrderedDict()
+        return
+
+    def __len__(self) -> int:
+        return len(self._patterns)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._patterns
+
+    def get(self, key: Hashable) -> tuple | None:
+        """Returns the relative decomposition stored for the given pattern,
+        or ``None`` if it is not stored."""
+        value = self._patterns.get(key)
+        if value is not None:
+            self._patterns.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: tuple) -> None:
+        """Stores the relative decomposition of the given pattern,
+        evicting the least recently used pattern if the cache is full."""
+        self._patterns[key] = value
+        self._patterns.move_to_end(key)
+        if len(self._patterns) > self.max_size:
+            self._patterns.popitem(last=False)
+            self.num_evictions += 1
+        return
+
+    def clear(self) -> None:
+        """Removes all the stored patterns, but not the statistics."""
+        self._patterns.clear()
+        return
+
+    def get_stats(self) -> dict[str, int]:
+        """Returns the number of hits, misses, evictions and stored patterns."""
+        return {
+            "num_hits": self.num_hits,
+            "num_misses": self.num_misses,
+            "num_evictions": self.num_evictions,
+            "size": len(self._patterns),
+        }
+
+
+# scale of the positions, which are stored as integers so that
+# the relative positions are exact
+_POSITION_SCALE = 10**6
+
+# scale of the weights, which are stored as integers so that the patterns
+# do not depend on the other weights of the DEM and can be shared between DEMs
+_WEIGHT_SCALE = 10**8
+
+# large odd numbers used to hash the entries of the patterns
+_HASH_MULTIPLIERS = np.random.default_rng(0).integers(1, 2**62, size=64) | 1
+
+
+class _PatternIndex:
+    """Builds the patterns of the hyperedges of a DEM and translates
+    the decompositions from and to relative positions."""
+
+    def __init__(
+        self,
+        primitive_dem: DEM,
+        depth: int = 1,
+        coordinates: Mapping[int, Iterable[float]] | None = None,
+    ) -> None:
+        self._depth = depth
+        arrays = primitive_dem._get_arrays()
+        self._det_ptr, self._det_ind = arrays["det_ptr"], arrays["det_ind"]
+        self._prim_det_to_id = primitive_dem.det_to_id
+        num_dets = int(self._det_ind.max(initial=-1)) + 1
+
+        # the coordinates are only used if all detectors have different ones
+        self._positions = np.arange(num_dets, dtype=np.int64)[:, None]
+        if coordinates:
+            lengths = set(len(c) for c in coordinates.values())
+            if len(lengths) == 1 and lengths != {0} and len(coordinates) >= num_dets:
+                num_dets = max(coordinates) + 1
+                positions = np.zeros((num_dets, lengths.pop()))
+                positions[list(coordinates)] = list(coordinates.values())
+                positions = np.round(positions * _POSITION_SCALE).astype(np.int64)
+                if len(np.unique(positions, axis=0)) == num_dets == len(coordinates):
+                    self._positions = positions
+                else:
+                    num_dets = len(self._positions)
+        self._to_detector = {
+            tuple(p): d for d, p in enumerate(self._positions.tolist())
+        }
+
+        # primitive edges with finite weight, oriented by the position of their
+        # detectors so that the orientation does not depend on the translation.
+        # The boundary is given by -1.
+        lengths = np.diff(self._det_ptr)
+        weights = probs_to_weights(arrays["probs"])
+        edges = np.flatnonzero(np.isfinite(weights) & ((lengths == 1) | (lengths == 2)))
+        ends = _pad_csr(*_gather_csr(self._det_ptr, self._det_ind, edges), 2)
+        is_pair = ends[:, 1] >= 0
+        swap = np.zeros(len(ends), dtype=bool)
+        swap[is_pair] = _lexicographic_greater(
+            self._positions[ends[is_pair, 0]], self._positions[ends[is_pair, 1]]
+        )
+        ends[swap] = ends[swap][:, ::-1]
+        self._ends = ends
+        self._int_weights = np.round(weights[edges] * _WEIGHT_SCALE).astype(np.int64)
+
+        # incident edges of each detector in CSR format
+        nodes = self._ends.ravel()
+        inc_edges = np.repeat(np.arange(len(edges)), 2)[nodes >= 0]
+        nodes = nodes[nodes >= 0]
+        order = np.argsort(nodes, kind="stable")
+        self._inc_ptr = np.zeros(num_dets + 1, dtype=np.int64)
+        np.cumsum(np.bincount(nodes, minlength=num_dets), out=self._inc_ptr[1:])
+        self._inc_ind = inc_edges[order]
+        return
+
+    def get_keys(
+        self, det_ptr: np.ndarray, det_ind: np.ndarray
+    ) -> list[tuple[Hashable, tuple] | None]:
+        """Returns the pattern of each hyperedge, given in CSR format,
+        and the position of its anchor, or ``None`` if some detector
+        does not have a position."""
+        num_hyper = len(det_ptr) - 1
+        num_dets, num_edges = len(self._positions), max(len(self._ends), 1)
+        rows = np.repeat(np.arange(num_hyper), np.diff(det_ptr))
+        invalid = np.zeros(num_hyper, dtype=bool)
+        invalid[rows[det_ind >= num_dets]] = True
+        det_ind = np.where(det_ind < num_dets, det_ind, 0)
+
+        # the anchor is the detector with the lowest position
+        positions = self._positions[det_ind]
+        order = np.lexsort((*positions.T[::-1], rows))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = rows[order][1:] != rows[order][:-1]
+        anchors = np.zeros((num_hyper, positions.shape[1]), dtype=np.int64)
+        anchors[rows[order][first]] = positions[order][first]
+        rel_positions = (positions - anchors[rows])[order]
+
+        # primitive edges up to the given depth from the hyperedges
+        visited = np.sort(rows * num_dets + det_ind)
+        frontier_rows, frontier_nodes = rows, det_ind
+        edge_keys = []
+        for _ in range(self._depth):
+            inc_ptr, inc_edges = _gather_csr(
+                self._inc_ptr, self._inc_ind, frontier_nodes
+            )
+            inc_rows = np.repeat(frontier_rows, np.diff(inc_ptr))
+            edge_keys.append(inc_rows * num_edges + inc_edges)
+            neighs = self._ends[inc_edges].ravel()
+            neigh_rows = np.repeat(inc_rows, 2)[neighs >= 0]
+            new = _unique(neigh_rows * num_dets + neighs[neighs >= 0])
+            new = new[~_isin_sorted(new, visited)]
+            visited = np.sort(np.concatenate([visited, new]))
+            frontier_rows, frontier_nodes = new // num_dets, new % num_dets
+        edge_keys = _unique(np.concatenate(edge_keys))
+        edge_rows, edges = edge_keys // num_edges, edge_keys % num_edges
+
+        # each edge is described by its type, the relative positions
+        # of its detectors and its weight
+        ends = self._ends[edges]
+        is_boundary = ends[:, 1] < 0
+        stops = np.where(is_boundary[:, None], 0, self._positions[ends[:, 1]])
+        entries = np.column_stack(
+            [
+                is_boundary,
+                self._positions[ends[:, 0]] - anchors[edge_rows],
+                stops - np.where(is_boundary[:, None], 0, anchors[edge_rows]),
+                self._int_weights[edges],
+            ]
+        )
+        # the entries are sorted by a hash of their values, as it is faster than
+        # sorting them lexicographically. Equal patterns can only be sorted
+        # differently if two of their entries have the same hash.
+        hashes = entries @ _HASH_MULTIPLIERS[: entries.shape[1]]
+        hash_bits = 63 - num_hyper.bit_length()
+        order = np.argsort((edge_rows << hash_bits) | (hashes & ((1 << hash_bits) - 1)))
+        entries = entries[order]
+        entry_ptr = np.searchsorted(edge_rows[order], np.arange(num_hyper + 1))
+
+        keys = []
+        anchors = anchors.tolist()
+        for k in range(num_hyper):
+            if invalid[k]:
+                keys.append(None)
+                continue
+            key = (
+                rel_positions[det_ptr[k] : det_ptr[k + 1]].tobytes(),
+                entries[entry_ptr[k] : entry_ptr[k + 1]].tobytes(),
+            )
+            keys.append((key, tuple(anchors[k])))
+        return keys
+
+    def to_relative(self, fault_ids: Iterable[int], anchor: tuple) -> tuple:
+        """Returns the positions of the detectors of the given primitive faults
+        relative to the anchor."""
+        rel_edges = []
+        for fault in fault_ids:
+            dets = self._det_ind[self._det_ptr[fault] : self._det_ptr[fault + 1]]
+            rel_positions = (self._positions[dets] - anchor).tolist()
+            rel_edges.append(tuple(map(tuple, rel_positions)))
+        return tuple(rel_edges)
+
+    def from_relative(
+        self, rel_edges: tuple, anchor: tuple, detectors: Iterable[int]
+    ) -> np.ndarray | None:
+        """Returns the primitive faults of the relative decomposition for the
+        given anchor, or ``None`` if they do not exist or do not trigger
+        the given detectors."""
+        fault_ids = []
+        triggered = set()
+        for rel_edge in rel_edges:
+            dets = []
+            for rel_position in rel_edge:
+                position = tuple(p + a for p, a in zip(rel_position, anchor))
+                if (det := self._to_detector.get(position)) is None:
+                    return None
+                dets.append(det)
+            fault_id = self._prim_det_to_id.get(tuple(sorted(dets)))
+            if fault_id is None:
+                return None
+            fault_ids.append(fault_id)
+            triggered.symmetric_difference_update(dets)
+
+        if triggered != set(detectors):
+            return None
+        return np.array(fault_ids, dtype=np.int64)
+
+
+def _lexicographic_greater(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Returns whether each row of ``a`` is lexicographically greater
+    than the corresponding row of ``b``."""
+    diff = a != b
+    first = np.argmax(diff, axis=1)
+    rows = np.arange(len(a))
+    return diff.any(axis=1) & (a[rows, first] > b[rows, first])
+
+
+def _unique(array: np.ndarray) -> np.ndarray:
+    """Returns the sorted unique elements of the array."""
+    array = np.sort(array)
+    is_new = np.ones(len(array), dtype=bool)
+    is_new[1:] = array[1:] != array[:-1]
+    return array[is_new]
+
+
+def _isin_sorted(array: np.ndarray, sorted_array: np.ndarray) -> np.ndarray:
+    """Returns whether each element of ``array`` is in ``sorted_array``."""
+    positions = np.searchsorted(sorted_array, array).clip(max=len(sorted_array) - 1)
+    return sorted_array[positions] == array if len(sorted_array) else array < 0
@@ -0,0 +1,117 @@
+import argparse
+import pathlib
+import sys
+import time
+
+import stim
+
+from .detector_error_model import DEM
+from .stim_tools import from_stim_to_dem_fast, from_dem_to_stim
+
+# output formats and their file suffixes
+FORMATS = {"dem": ".dem", "bin": ".bin"}
+
+
+def get_parser() -> argparse.ArgumentParser:
+    """Returns the parser of the arguments of the ``hyper-decom`` command."""
+    parser = argparse.ArgumentParser(
+        prog="hyper-decom",
+        description="Decomposes the hyperedges of detector error models.",
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="+",
+        type=pathlib.Path,
+        help="stim detector error models ('.dem') or DEMs saved with "
+        "'DEM.save' ('.bin')",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=pathlib.Path,
+        help="output file, or output directory if several inputs are given. "
+        "By default, the outputs are stored next to the inputs "
+        "with the suffix '_decomposed'",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=list(FORMATS),
+        default="dem",
+        help="output format: stim detector error model ('dem') "
+        "or binary file loadable with 'DEM.load' ('bin')",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        help="number of processes used to decompose the hyperedges",
+    )
+    parser.add_argument(
+        "--mode", choices=["mwpm", "logical-aware"], default="mwpm", help="see 'mode'"
+    )
+    parser.add_argument("--local-radius", type=float, help="see 'local_radius'")
+    parser.add_argument(
+        "--ignore-logical-error",
+        action="store_true",
+        help="do not raise an error for decompositions with a different "
+        "logical effect",
+    )
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", help="do not print the progress"
+    )
+    return parser
+
+
+def get_output_paths(
+    inputs: list[pathlib.Path], output: pathlib.Path | None, format: str
+) -> list[pathlib.Path]:
+    """Returns the path of the output file of each input file."""
+    suffix = FORMATS[format]
+    if output is None:
+        return [i.with_name(i.stem + "_decomposed" + suffix) for i in inputs]
+    if len(inputs) == 1 and not output.is_dir():
+        return [output]
+    return [output / (i.stem + suffix) for i in inputs]
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Runs the ``hyper-decom`` command and returns its exit status."""
+    args = get_parser().parse_args(argv)
+
+    outputs = get_output_paths(args.inputs, args.output, args.format)
+    if len(args.inputs) > 1 and args.output is not None:
+        args.output.mkdir(parents=True, exist_ok=True)
+
+    # imported here so that '--help' and the argument errors are fast
+    from .decomposition import decompose_dem
+
+    for input_path, output_path in zip(args.inputs, outputs):
+        start = time.perf_counter()
+        if input_path.suffix == ".bin":
+            dem = DEM.load(input_path, mmap_mode=None)
+        else:
+            dem = from_stim_to_dem_fast(stim.DetectorErrorModel.from_file(input_path))
+
+        decom_dem = decompose_dem(
+            dem,
+            ignore_logical_error=args.ignore_logical_error,
+            workers=args.workers,
+            local_radius=args.local_radius,
+            mode=args.mode,
+        )
+
+        if args.format == "bin":
+            decom_dem.save(output_path)
+        else:
+            from_dem_to_stim(decom_dem).to_file(output_path)
+
+        if not args.quiet:
+            duration = time.perf_counter() - start
+            print(f"{input_path} -> {output_path} ({duration:.2f} s)", file=sys.stderr)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,35 +1,140 @@
-from collections.abc import Iterable
+from __future__ import annotations
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from contextlib import contextmanager
+from concurrent.futures import Executor, ProcessPoolExecutor
+import heapq
+from itertools import repeat
+import os
+import time
+from typing import TYPE_CHECKING
+import uuid
+import warnings
 
-from pymatching import Matching
 import numpy as np
 import stim
 
-from dem_decoders import BP_OSD
+from .stim_tools import (
+    from_dem_to_stim,
+    from_stim_to_dem_fast,
+    get_detectors,
+    get_logicals,
+    has_separator,
+    _from_stim_to_dem_with_ids,
+)
+from .detector_error_model import (
+    DEM,
+    _gather_csr,
+    _group_rows,
+    _pad_csr,
+    _ragged_to_csr,
+)
+from .local_decomposition import LocalDecomposer
+from .cache import DecompositionCache, _PatternIndex
+from .disk_cache import DiskCache
+from .util import DetectorSet, probs_to_weights
 
-from .stim_tools import from_dem_to_stim, from_stim_to_dem, get_detectors, get_logicals
-from .detector_error_model import DEM
+# pymatching, ldpc and scipy are slow to import, thus they are imported
+# on first use so that the conversions with 'stim_tools' start fast
+if TYPE_CHECKING:
+    from pymatching import Matching
+
+# MWPM decoders of the primitive graphs built by the initializer of the
+# process pools created in '_match_in_parallel', which only live in those
+# processes. They are keyed by call, thus they are never shared between calls.
+_WORKER_MATCHING: dict[str, tuple[Matching, DEM]] = {}
+
+# in 'decompose_dem_sweep', the hyperedges affected by the modified primitive
+# faults are only searched if there are fewer modified faults than this fraction
+# of hyperedges. Each search is as slow as decomposing tens of hyperedges.
+_SWEEP_MAX_MODIFIED = 1 / 32
 
 
 def _get_id_from_pymatching_edges(
-    edge_array: Iterable[Iterable[int]], dem: DEM
+    edge_array: Iterable[Iterable[int]],
+    dem: DEM,
+    pair_index: tuple[np.ndarray, np.ndarray] | None = None,
 ) -> list[int]:
-    """Returns the fault ids for the given set of pairs of detectors."""
-    list_ids = []
+    """Returns the fault ids for the given set of pairs of detectors.
+    The index ``pair_index = _get_pair_index(dem)`` can be given
+    to avoid building it in every call."""
+    keys, ids = _get_pair_index(dem) if pair_index is None else pair_index
+    edges = np.asarray(edge_array, dtype=np.int64).reshape(-1, 2)
+    edge_keys = _get_pair_keys(edges)
 
-    for edge in edge_array:
+    positions = np.searchsorted(keys, edge_keys).clip(max=max(len(keys) - 1, 0))
+    missing = (keys[positions] != edge_keys) if len(keys) else edge_keys >= 0
+    if missing.any():
+        edge = edges[np.argmax(missing)]
         dets = tuple(sorted([e for e in edge if e != -1]))  # -1 for boundary edges
-        id_ = dem.det_to_id.get(dets)
+        raise ValueError(f"No edge found in DEM that has detectors={dets}")
+
+    return ids[positions].tolist()
+
+
+def _get_pair_index(dem: DEM) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the sorted keys (see ``_get_pair_keys``) of the faults
+    triggering one or two detectors and their corresponding fault ids."""
+    lengths = np.diff(dem._det_ptr[: dem.num_faults + 1])
+    ids = np.flatnonzero((lengths == 1) | (lengths == 2))
+    pairs = _pad_csr(*_gather_csr(dem._det_ptr, dem._det_ind, ids), width=2)
+    keys = _get_pair_keys(pairs)
+    order = np.argsort(keys)
+    return keys[order], ids[order]
+
+
+def _get_pair_keys(pairs: np.ndarray) -> np.ndarray:
+    """Returns a key for each pair of detectors that does not depend on their
+    order. Boundary edges are given by a detector and -1."""
+    low, high = pairs.min(axis=1), pairs.max(axis=1)
+    low, high = np.where(low < 0, high, low), np.where(low < 0, -1, high)
+    return ((low + 1) << 32) | (high + 1)
+
+
+class _PhaseRecorder:
+    """Records the duration of the phases and the counters of
+    ``decompose_dem`` in ``stats`` and reports the progress."""
 
-        if id_ is None:
-            raise ValueError(f"No edge found in DEM that has detectors={dets}")
+    def __init__(
+        self,
+        stats: dict | None = None,
+        progress: Callable[[str, int, int], None] | None = None,
+    ) -> None:
+        self.stats = {} if stats is None else stats
+        self.stats["timings"] = {}
+        self.progress = progress
+        return
 
-        list_ids.append(id_)
+    @contextmanager
+    def phase(self, name: str, total: int = 1):
+        start = time.perf_counter()
+        yield
+        self.stats["timings"][name] = time.perf_counter() - start
+        if self.progress is not None:
+            self.progress(name, total, total)
+        return
 
-    return list_ids
+    def get_callback(self, name: str) -> Callable[[int, int], None] | None:
+        """Returns the callback to report the progress inside a phase."""
+        if self.progress is None:
+            return None
+        return lambda done, total: self.progress(name, done, total)
 
 
 def decompose_dem(
-    dem: DEM | stim.DetectorErrorModel, ignore_logical_error=False
+    dem: DEM | stim.DetectorErrorModel,
+    ignore_logical_error=False,
+    workers: int | None = None,
+    executor: Executor | None = None,
+    local_radius: float | None = None,
+    stats: dict | None = None,
+    cache: DecompositionCache | None = None,
+    disk_cache: DiskCache | None = None,
+    mode: str = "mwpm",
+    progress: Callable[[str, int, int], None] | None = None,
+    incremental: bool = False,
+    region_size: float | Sequence[float] | None = None,
+    region_margin: float = 2.0,
 ) -> DEM | stim.DetectorErrorModel:
     """Decomposes a detector error model to edges using Algorithm 3 from
     https://doi.org/10.48550/arXiv.2309.15354.
@@ -41,6 +146,94 @@ def decompose_dem(
     ignore_logical_error
         If True, does not raise an error when the found decomposition
         does not have the same logical effect as the undecomposed fault.
+    workers
+        If given, the hyperedges are decomposed in parallel using
+        this number of processes. The output is the same as in serial mode.
+    executor
+        If given, the hyperedges are decomposed in parallel using this
+        executor (e.g. a ``concurrent.futures.ProcessPoolExecutor``) instead
+        of creating a new process pool. The hyperedges are split in ``workers``
+        chunks (by default, the number of CPUs).
+    local_radius
+        If given, each hyperedge is first decomposed by a local
+        minimum-weight pairing of its detectors, using the paths of weight
+        at most ``local_radius`` in the primitive graph, see
+        ``LocalDecomposer``. The global MWPM is only used for the hyperedges
+        without a local solution. Both give minimum-weight decompositions,
+        but they can differ when several decompositions have the same weight.
+    stats
+        If given, this dictionary is updated with the duration in seconds of
+        each phase of the decomposition (``"timings"``, see ``progress``) and
+        with the counters: number of hyperedges to decompose
+        (``"num_hyperedges"``), decomposed locally (``"num_local"``), with
+        the global MWPM (``"num_global"``), found in ``cache``
+        (``"num_cache_hits"``), with BP-OSD (``"num_bposd"``) and whose
+        decomposition has a different logical effect (``"num_failures"``),
+        and whether the result was found in ``disk_cache``
+        (``"disk_cache_hit"``).
+    cache
+        If given, the decompositions are reused for the hyperedges with
+        the same local pattern (e.g. in other rounds), see
+        ``DecompositionCache``. The patterns use the detector coordinates
+        of ``dem`` if it is a ``stim.DetectorErrorModel`` that has them.
+        The same cache can be used for several calls.
+    disk_cache
+        If given, the decomposed detector error model is loaded from this
+        on-disk cache if ``dem`` (with the same ``ignore_logical_error``,
+        ``local_radius``, ``mode``, ``region_size`` and ``region_margin``) has
+        already been decomposed, and stored in it otherwise. If ``dem`` is
+        a ``DEM``, it is decomposed in place in both cases. It is not used
+        with ``cache`` or ``incremental``, as their results depend on the
+        state of the cache and of ``dem``.
+    mode
+        If ``"mwpm"``, the decompositions are the ones found by MWPM.
+        If ``"logical-aware"``, the hyperedges whose MWPM decomposition has
+        a different logical effect are decomposed again with BP-OSD on the
+        primitive graph in which the logical observables are detectors,
+        so that the decomposition has the correct logical effect if one exists.
+        The BP-OSD decoder is built once for all these hyperedges.
+        Their number is given in ``stats["num_bposd"]``.
+    progress
+        If given, it is called as ``progress(phase, done, total)`` at the end of
+        each phase and after each batch of hyperedges decoded with MWPM, where
+        ``done`` and ``total`` are the processed and total number of items
+        of the phase. The phases are ``"disk_cache_load"``, ``"convert_in"``,
+        ``"split"``, ``"weight_2"``, ``"neighborhood"`` (see ``incremental``),
+        ``"matching"`` (construction of the MWPM decoder), ``"mwpm"``,
+        ``"logical_aware"``, ``"add_decomposition"``, ``"convert_out"``
+        and ``"disk_cache_store"``.
+    incremental
+        If True and ``dem`` is a ``DEM`` that has already been decomposed,
+        only the faults in ``dem.dirty_faults`` (i.e. added, reweighted or
+        whose decomposition has been removed since then) and the hyperedges
+        whose decomposition can change because of them are decomposed.
+        These are the hyperedges closer to a modified primitive fault than
+        the weight of their decomposition in the primitive graph. The result
+        is the same as decomposing all the hyperedges again, except when
+        several decompositions have the same weight. The primitive faults
+        are not changed, thus a weight-2 edge stays primitive even if
+        weight-1 faults for its detectors are added.
+    region_size
+        If given, the detector space is tiled in cells of this size (one value
+        for all the coordinates or one per coordinate, ``numpy.inf`` to not
+        split along a coordinate) using the detector coordinates of ``dem``,
+        which must be a ``stim.DetectorErrorModel`` that has them. The region
+        of each cell contains the detectors at distance at most
+        ``2 * region_margin`` from the cell (along each coordinate), and its
+        matching graph the primitive faults whose detectors are in the region.
+        Each hyperedge is decomposed with the graph of the cell containing its
+        center if its detectors are at distance at most ``region_margin`` from
+        the cell, and with the global graph otherwise (or if there is no
+        decomposition inside the region). With ``workers`` or ``executor``,
+        each task only holds the graph of one region, which caps the memory
+        per worker. The decompositions can differ from the global ones if
+        a minimum-weight decomposition leaves the region. The number of
+        regions is given in ``stats["num_regions"]`` and the number of
+        hyperedges decomposed with them in ``stats["num_in_regions"]``.
+        It cannot be used together with ``cache`` or ``local_radius``.
+    region_margin
+        Margin between the hyperedges and the border of the regions,
+        in the units of the detector coordinates, see ``region_size``.
 
     Returns
     -------
@@ -52,18 +245,503 @@ def decompose_dem(
     The algorithm assumes that all the hyperedges in the detector error model
     can be decomposed with existing edges.
     """
+    if cache is not None and not isinstance(cache, DecompositionCache):
+        raise TypeError(
+            f"'cache' must be a DecompositionCache, but {type(cache)} was given."
+        )
+    if mode not in ("mwpm", "logical-aware"):
+        raise ValueError(
+            f"'mode' must be 'mwpm' or 'logical-aware', but {mode} was given."
+        )
+    if disk_cache is not None and not isinstance(disk_cache, DiskCache):
+        raise TypeError(
+            f"'disk_cache' must be a DiskCache, but {type(disk_cache)} was given."
+        )
+    if progress is not None and not callable(progress):
+        raise TypeError(f"'progress' must be callable, but {type(progress)} was given.")
+    if region_size is not None:
+        if not isinstance(dem, stim.DetectorErrorModel):
+            raise ValueError(
+                "'region_size' requires a stim.DetectorErrorModel "
+                "with detector coordinates."
+            )
+        if cache is not None:
+            raise ValueError("'region_size' and 'cache' cannot be used together.")
+        if local_radius is not None:
+            raise ValueError(
+                "'region_size' and 'local_radius' cannot be used together."
+            )
+        if region_margin < 0:
+            raise ValueError(
+                f"'region_margin' must be non-negative, not {region_margin}."
+            )
+
+    recorder = _PhaseRecorder(stats, progress)
+    recorder.stats["disk_cache_hit"] = False
+    recorder.stats["num_cache_hits"] = 0
+
+    if cache is not None or incremental:
+        disk_cache = None
+    if disk_cache is not None:
+        with recorder.phase("disk_cache_load"):
+            options = {"local_radius": local_radius}
+            if region_size is not None:
+                options = {
+                    "region_size": np.asarray(region_size, dtype=float).tolist(),
+                    "region_margin": float(region_margin),
+                }
+            key = disk_cache.get_key(
+                dem, ignore_logical_error=ignore_logical_error, mode=mode, **options
+            )
+            decom_dem = disk_cache.get(key)
+        recorder.stats["disk_cache_hit"] = decom_dem is not None
+        if decom_dem is not None:
+            if isinstance(dem, DEM):
+                # same in-place behaviour as when the DEM is decomposed
+                _copy_decompositions(dem, decom_dem)
+                return dem
+            return decom_dem
+
     convert_to_stim = False
+    coordinates = None
     if isinstance(dem, stim.DetectorErrorModel):
         convert_to_stim = True
-        dem = from_stim_to_dem(dem)
+        with recorder.phase("convert_in"):
+            if cache is not None or region_size is not None:
+                coordinates = dem.get_detector_coordinates()
+            dem = from_stim_to_dem_fast(dem)
 
     # Step 1: split the DEM into primitive and non-primitive faults
+    incremental = incremental and dem.dirty_faults is not None
+    with recorder.phase("split"):
+        if incremental:
+            dirty_faults = dem.dirty_faults
+            weight_2_edges, hyperedges = _get_undecomposed_faults(dem, dirty_faults)
+        else:
+            weight_2_edges, hyperedges = _get_undecomposed_faults(dem)
+    with recorder.phase("weight_2", total=len(weight_2_edges)):
+        _decompose_weight_2_edges(dem, weight_2_edges, ignore_logical_error)
+    if incremental:
+        with recorder.phase("neighborhood"):
+            modified = [i for i in dirty_faults if dem.is_primitive(i)]
+            hyperedges += _get_affected_hyperedges(dem, modified)
+    recorder.stats["num_hyperedges"] = len(hyperedges)
+
+    # Step 2: for every hyperedge run MWPM to obtain the most probable decomposition
+    with recorder.phase("matching"):
+        MWPM_prim, primitive_dem = _get_primitive_matching(dem)
+        local_decomposer = None
+        if local_radius is not None:
+            local_decomposer = LocalDecomposer(primitive_dem, local_radius)
+    solver = dict(
+        MWPM_prim=MWPM_prim,
+        primitive_dem=primitive_dem,
+        local_decomposer=local_decomposer,
+        workers=workers,
+        executor=executor,
+        progress=recorder.get_callback("mwpm"),
+    )
+
+    recorder.stats["num_regions"] = 0
+    recorder.stats["num_in_regions"] = 0
+    with recorder.phase("mwpm", total=len(hyperedges)):
+        if region_size is not None:
+            regions = _get_regions(
+                dem, primitive_dem, hyperedges, coordinates, region_size, region_margin
+            )
+            matchings, num_local, num_global = _find_matchings_in_regions(
+                dem, hyperedges, regions, solver
+            )
+            recorder.stats["num_regions"] = len(regions)
+            recorder.stats["num_in_regions"] = len(hyperedges) - num_local - num_global
+        elif cache is None:
+            matchings, num_local, num_global = _find_matchings(
+                dem, hyperedges, **solver
+            )
+        else:
+            num_hits = cache.num_hits
+            pattern_index = _PatternIndex(primitive_dem, cache.depth, coordinates)
+            matchings, num_local, num_global = _find_matchings_with_cache(
+                dem, hyperedges, cache, pattern_index, solver
+            )
+            recorder.stats["num_cache_hits"] = cache.num_hits - num_hits
+
+    num_bposd = 0
+    if mode == "logical-aware":
+        with recorder.phase("logical_aware"):
+            matchings, num_bposd = _fix_logical_errors(
+                dem, primitive_dem, hyperedges, matchings
+            )
+    recorder.stats["num_local"] = num_local
+    recorder.stats["num_global"] = num_global
+    recorder.stats["num_bposd"] = num_bposd
+
+    with recorder.phase("add_decomposition", total=len(hyperedges)):
+        decompositions = _get_decompositions(dem, hyperedges, matchings)
+        for hyper, decomposition in zip(hyperedges, decompositions):
+            dem.add_decomposition(
+                hyper,
+                decomposition,
+                ignore_logical_error=ignore_logical_error,
+                override=incremental,
+            )
+    # decompositions with a different logical effect are not added
+    recorder.stats["num_failures"] = int(
+        (dem._decom_len[np.array(hyperedges, dtype=np.int64)] == -1).sum()
+    )
+    dem.mark_clean()
+
+    if convert_to_stim:
+        with recorder.phase("convert_out"):
+            dem = from_dem_to_stim(dem)
+
+    if disk_cache is not None:
+        with recorder.phase("disk_cache_store"):
+            disk_cache.put(key, dem)
+
+    return dem
+
+
+def _copy_decompositions(dem: DEM, decom_dem: DEM) -> None:
+    """Sets the primitive faults and decompositions of ``decom_dem``,
+    which has the same faults, in ``dem``."""
+    arrays = decom_dem._get_arrays()
+    num_faults = dem.num_faults
+    dem._primitive[:num_faults] = arrays["primitive"]
+    dem._decomposed[:num_faults] = arrays["decomposed"]
+    dem._decom = np.array(arrays["decom"], dtype=np.int64)
+    dem._decom_len[:num_faults] = arrays["decom_len"]
+    dem._prim_order = arrays["prim_order"].tolist()
+    dem._prim_det_to_id = None
+    dem.mark_clean()
+    return
+
+
+def _find_matchings(
+    dem: DEM,
+    hyperedges: list[int],
+    MWPM_prim: Matching,
+    primitive_dem: DEM,
+    local_decomposer: LocalDecomposer | None = None,
+    workers: int | None = None,
+    executor: Executor | None = None,
+    progress: Callable[[int, int], None] | None = None,
+) -> tuple[list[np.ndarray | None], int, int]:
+    """Returns the primitive faults (ids in ``primitive_dem``) matching each
+    hyperedge, see ``_match_hyperedges``, and the number of hyperedges
+    matched locally and with the global MWPM."""
+    matchings = [None] * len(hyperedges)
+    if local_decomposer is not None:
+        for k, hyper in enumerate(hyperedges):
+            matchings[k] = local_decomposer.decompose(dem.detectors[hyper])
+    global_inds = [k for k, matching in enumerate(matchings) if matching is None]
+    global_hyperedges = [hyperedges[k] for k in global_inds]
+
+    if (workers is not None) or (executor is not None):
+        global_matchings = _match_in_parallel(
+            dem,
+            primitive_dem,
+            global_hyperedges,
+            workers=workers,
+            executor=executor,
+            progress=progress,
+        )
+    else:
+        det_ptr, det_ind = _gather_csr(
+            dem._det_ptr, dem._det_ind, np.array(global_hyperedges, dtype=np.int64)
+        )
+        global_matchings = _match_hyperedges(
+            MWPM_prim, primitive_dem, det_ptr, det_ind, progress=progress
+        )
+
+    for k, matching in zip(global_inds, global_matchings):
+        matchings[k] = matching
+
+    return matchings, len(hyperedges) - len(global_inds), len(global_inds)
+
+
+def _find_matchings_with_cache(
+    dem: DEM,
+    hyperedges: list[int],
+    cache: DecompositionCache,
+    pattern_index: _PatternIndex,
+    solver: dict,
+) -> tuple[list[np.ndarray | None], int, int]:
+    """Returns the same as ``_find_matchings``, but reusing the matchings
+    stored in the cache. Only one hyperedge per new pattern is matched
+    first, so that the rest of hyperedges with that pattern are hits."""
+    patterns = pattern_index.get_keys(
+        *_gather_csr(dem._det_ptr, dem._det_ind, np.array(hyperedges, dtype=np.int64))
+    )
+    matchings = [None] * len(hyperedges)
+
+    def lookup(k: int) -> bool:
+        rel_matching = cache.get(patterns[k][0])
+        if rel_matching is not None:
+            matchings[k] = pattern_index.from_relative(
+                rel_matching, patterns[k][1], dem.detectors[hyperedges[k]]
+            )
+        if matchings[k] is None:
+            cache.num_misses += 1
+            return False
+        cache.num_hits += 1
+        return True
+
+    def solve(inds: list[int]) -> tuple[int, int]:
+        new_matchings, num_local, num_global = _find_matchings(
+            dem, [hyperedges[k] for k in inds], **solver
+        )
+        for k, matching in zip(inds, new_matchings):
+            matchings[k] = matching
+            if matching is not None and patterns[k] is not None:
+                if patterns[k][0] not in cache:
+                    rel_matching = pattern_index.to_relative(matching, patterns[k][1])
+                    cache.put(patterns[k][0], rel_matching)
+        return num_local, num_global
+
+    # first pass: hits and one hyperedge per new pattern
+    new_inds, deferred, new_patterns = [], [], set()
+    for k, pattern in enumerate(patterns):
+        if pattern is None:
+            cache.num_misses += 1
+            new_inds.append(k)
+        elif pattern[0] in new_patterns:
+            deferred.append(k)
+        elif not lookup(k):
+            new_inds.append(k)
+            if pattern[0] not in cache:
+                new_patterns.add(pattern[0])
+    num_local, num_global = solve(new_inds)
+
+    # second pass: hyperedges with the new patterns
+    new_inds = [k for k in deferred if not lookup(k)]
+    num_local_2, num_global_2 = solve(new_inds)
+
+    return matchings, num_local + num_local_2, num_global + num_global_2
+
+
+def _get_regions(
+    dem: DEM,
+    primitive_dem: DEM,
+    hyperedges: list[int],
+    coordinates: dict[int, list[float]],
+    region_size: float | Sequence[float],
+    region_margin: float,
+) -> list[tuple[tuple[np.ndarray, ...], np.ndarray, np.ndarray, tuple]]:
+    """Returns the regions of the detector space (see ``decompose_dem``).
+
+    Each region is given by the CSR arrays of its primitive graph, in which
+    the detectors are relabelled by their position in the sorted detectors of
+    the region, the ids in ``primitive_dem`` of its faults, the indices in
+    ``hyperedges`` of the hyperedges assigned to it and the CSR arrays
+    of their (relabelled) detectors.
+    """
+    num_dets = max(dem.num_detectors, max(coordinates, default=-1) + 1)
+    num_coords = min((len(c) for c in coordinates.values()), default=0)
+    if num_coords == 0:
+        raise ValueError("'dem' does not have detector coordinates.")
+    positions = np.full((num_dets, num_coords), np.nan)
+    for det, coords in coordinates.items():
+        positions[det] = coords[:num_coords]
+
+    size = np.broadcast_to(np.asarray(region_size, dtype=np.float64), (num_coords,))
+    if not (size > 0).all():
+        raise ValueError(f"'region_size' must be positive, not {region_size}.")
+    step = np.where(np.isinf(size), 0, size)
+    origin = np.nanmin(positions, axis=0)
+
+    # bounding box of the detectors of each hyperedge, whose center gives its cell
+    ids = np.array(hyperedges, dtype=np.int64)
+    det_ptr, det_ind = _gather_csr(dem._det_ptr, dem._det_ind, ids)
+    valid = np.diff(det_ptr) > 0
+    starts = det_ptr[:-1][valid]
+    low = np.full((len(ids), num_coords), np.nan)
+    high = np.full((len(ids), num_coords), np.nan)
+    low[valid] = np.minimum.reduceat(positions[det_ind], starts, axis=0)
+    high[valid] = np.maximum.reduceat(positions[det_ind], starts, axis=0)
+    with np.errstate(invalid="ignore"):
+        cells = np.where(step > 0, np.floor(((low + high) / 2 - origin) / size), 0)
+        start = origin + cells * step
+        inside = (low >= start - region_margin) & (high <= start + size + region_margin)
+    assigned = np.flatnonzero(inside.all(axis=1))
+    if len(assigned) == 0:
+        return []
+
+    prim_ptr, prim_ind = primitive_dem._det_ptr, primitive_dem._det_ind
+    num_prims = primitive_dem.num_faults
+    prim_rows = np.repeat(np.arange(num_prims), np.diff(prim_ptr))
+    group, first = _group_rows(cells[assigned].astype(np.int64))
+    regions = []
+    for region, hyper in enumerate(assigned[first]):
+        # primitive faults whose detectors are in the region
+        region_start = start[hyper] - 2 * region_margin
+        region_end = start[hyper] + size + 2 * region_margin
+        with np.errstate(invalid="ignore"):
+            inside = ((positions >= region_start) & (positions <= region_end)).all(1)
+        num_outside = np.bincount(
+            prim_rows, weights=~inside[prim_ind], minlength=num_prims
+        )
+        rows = np.flatnonzero((num_outside == 0) & (np.diff(prim_ptr) > 0))
+        if len(rows) == 0:
+            # all its hyperedges are decomposed with the global graph
+            continue
+        graph_ptr, graph_ind = _gather_csr(prim_ptr, prim_ind, rows)
+        region_dets = np.sort(graph_ind)
+        region_dets = region_dets[np.r_[True, region_dets[1:] != region_dets[:-1]]]
+
+        # hyperedges with detectors without primitive faults in the region
+        # are decomposed with the global graph
+        inds = assigned[group == region]
+        hyper_ptr, hyper_ind = _gather_csr(det_ptr, det_ind, inds)
+        local_ind = np.searchsorted(region_dets, hyper_ind)
+        found = region_dets[np.minimum(local_ind, len(region_dets) - 1)] == hyper_ind
+        num_missing = np.bincount(
+            np.repeat(np.arange(len(inds)), np.diff(hyper_ptr)),
+            weights=~found,
+            minlength=len(inds),
+        )
+        complete = np.flatnonzero(num_missing == 0)
+        if len(complete) == 0:
+            continue
+
+        graph = (
+            primitive_dem._probs[rows],
+            graph_ptr,
+            np.searchsorted(region_dets, graph_ind),
+            np.zeros(len(rows) + 1, dtype=np.int64),
+            np.zeros(0, dtype=np.int64),
+        )
+        chunk = _gather_csr(hyper_ptr, local_ind, complete)
+        regions.append((graph, rows, inds[complete], chunk))
+
+    return regions
+
+
+def _find_matchings_in_regions(
+    dem: DEM,
+    hyperedges: list[int],
+    regions: list[tuple[tuple[np.ndarray, ...], np.ndarray, np.ndarray, tuple]],
+    solver: dict,
+) -> tuple[list[np.ndarray | None], int, int]:
+    """Returns the primitive faults (ids in ``primitive_dem``) matching each
+    hyperedge using the graphs of the ``regions`` (see ``_get_regions``), and
+    the number of hyperedges matched locally and with the global MWPM
+    (see ``_find_matchings``), which is used for the other hyperedges.
+
+    With ``workers`` or ``executor``, the graph of each region is shipped
+    with its hyperedges, so that the workers do not hold the global graph.
+    """
+    workers, executor = solver["workers"], solver["executor"]
+    graphs = [region[0] for region in regions]
+    chunks = [region[3] for region in regions]
+    if executor is not None:
+        results = executor.map(_match_region, graphs, chunks)
+    elif workers is not None:
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError(f"'workers' must be a positive int, not {workers}.")
+        pool = ProcessPoolExecutor(workers)
+        results = pool.map(_match_region, graphs, chunks)
+    else:
+        results = map(_match_region, graphs, chunks)
+
+    matchings = [None] * len(hyperedges)
+    done = 0
+    try:
+        for (_, rows, inds, _), region_matchings in zip(regions, results):
+            for k, matching in zip(inds, region_matchings):
+                if matching is not None:
+                    matchings[k] = rows[matching]
+            done += len(inds)
+            if solver["progress"] is not None:
+                solver["progress"](done, len(hyperedges))
+    finally:
+        if executor is None and workers is not None:
+            pool.shutdown()
+
+    # the global graph is used in the main process
+    global_inds = [k for k, matching in enumerate(matchings) if matching is None]
+    global_solver = dict(solver, workers=None, executor=None, progress=None)
+    global_matchings, num_local, num_global = _find_matchings(
+        dem, [hyperedges[k] for k in global_inds], **global_solver
+    )
+    for k, matching in zip(global_inds, global_matchings):
+        matchings[k] = matching
+
+    return matchings, num_local, num_global
+
+
+def _match_region(
+    graph: tuple[np.ndarray, ...], chunk: tuple[np.ndarray, np.ndarray]
+) -> list[np.ndarray | None]:
+    """Returns the primitive faults (ids in the graph of the region) used by
+    MWPM for each hyperedge in the chunk, given by the CSR arrays of their
+    detectors relabelled to the region."""
+    MWPM_region, region_dem = _build_matching(graph)
+    return _match_hyperedges(MWPM_region, region_dem, *chunk)
+
+
+def _fix_logical_errors(
+    dem: DEM,
+    primitive_dem: DEM,
+    hyperedges: list[int],
+    matchings: list[np.ndarray | None],
+) -> tuple[list[np.ndarray | None], int]:
+    """Returns the matchings in which the ones with a different logical effect
+    than their hyperedge are replaced by the decomposition found by BP-OSD
+    in the logical-augmented primitive graph, if it exists.
+    It also returns the number of hyperedges decoded with BP-OSD."""
+    log_ptr, log_ind = dem._log_ptr, dem._log_ind
+
+    wrong = []
+    for k, (hyper, matching) in enumerate(zip(hyperedges, matchings)):
+        if matching is None:
+            continue
+        # all the faults of the primitive graph are primitive
+        logs = [primitive_dem._get_prim_sets(i)[1] for i in matching.tolist()]
+        logs.append(log_ind[log_ptr[hyper] : log_ptr[hyper + 1]])
+        if DetectorSet.xor_many(logs):
+            wrong.append(k)
+    if len(wrong) == 0:
+        return matchings, 0
+
+    num_dets = primitive_dem.num_detectors
+    augmented_dem = primitive_dem.get_logical_augmented_dem(num_dets)
+    syndromes = [
+        dem.detectors[hyperedges[k]]
+        + tuple(l + num_dets for l in dem.logicals[hyperedges[k]])
+        for k in wrong
+    ]
+    matchings = list(matchings)
+    for k, fault_inds in zip(wrong, _decode_with_bposd(augmented_dem, syndromes)):
+        if fault_inds is not None:
+            matchings[k] = np.array(fault_inds, dtype=np.int64)
+
+    return matchings, len(wrong)
+
+
+def _split_faults(dem: DEM, ignore_logical_error: bool = False) -> list[int]:
+    """Sets the primitive faults of the DEM and decomposes the weight-2 edges
+    that can be decomposed into weight-1 edges.
+    Returns the ids of the hyperedges that need to be decomposed."""
+    weight_2_edges, hyperedges = _get_undecomposed_faults(dem)
+    _decompose_weight_2_edges(dem, weight_2_edges, ignore_logical_error)
+    return hyperedges
+
+
+def _get_undecomposed_faults(
+    dem: DEM, ids: Iterable[int] | None = None
+) -> tuple[list[int], list[int]]:
+    """Sets the weight-1 faults of the DEM (or of the given ``ids``) as
+    primitive and returns the ids of the weight-2 edges and of the hyperedges
+    without a decomposition."""
     # Some hyperedges may already have a decomposition.
-    # Some weight-2 edges have a decomposition into weight-1 edges.
     weight_2_edges = []
     hyperedges = []
 
-    for id_, dets in dem.detectors.items():
+    faults = dem.detectors.items()
+    if ids is not None:
+        faults = ((id_, dem.detectors[id_]) for id_ in ids)
+    for id_, dets in faults:
         if len(dets) == 1:
             dem.set_as_primitive(id_)
             continue
@@ -74,6 +752,14 @@ def decompose_dem(
             else:
                 hyperedges.append(id_)
 
+    return weight_2_edges, hyperedges
+
+
+def _decompose_weight_2_edges(
+    dem: DEM, weight_2_edges: list[int], ignore_logical_error: bool = False
+) -> None:
+    """Decomposes the given weight-2 edges into weight-1 edges when possible,
+    and sets them as primitive otherwise."""
     for edge in weight_2_edges:
         detectors = dem.detectors[edge]
         id1 = dem.prim_det_to_id.get((detectors[0],))
@@ -86,44 +772,878 @@ def decompose_dem(
         else:
             dem.set_as_primitive(edge)
 
-    # Step 2: for every hyperedge run MWPM to obtain the most probable decomposition
-    primtive_dem = dem.get_primitive_graph()
-    stim_primitive_dem = from_dem_to_stim(primtive_dem)
-    MWPM_prim = Matching(stim_primitive_dem)
+    return
+
+
+def _get_affected_hyperedges(dem: DEM, modified: list[int]) -> list[int]:
+    """Returns the decomposed hyperedges whose decomposition can change
+    because the given primitive faults have been added or reweighted.
+
+    A decomposition that uses a modified edge ``(u, v)`` contains a path from
+    a detector of the hyperedge to ``u``, the edge and a path from ``v`` to
+    another detector of the hyperedge or to the boundary. If the weight of
+    the shortest such paths is larger than the weight of the current
+    decomposition (with the new weights), the current decomposition is still
+    a minimum-weight one. Thus, only the hyperedges close to the modified
+    faults are returned. The distances are computed with Dijkstra's algorithm
+    up to the largest weight of the decompositions.
+    """
+    num_faults = dem.num_faults
+    weights = probs_to_weights(dem._probs[:num_faults])
+    primitive = dem._primitive[:num_faults]
+    decom = dem._decom[:num_faults]
+    decom_len = dem._decom_len[:num_faults]
+    candidates = dem._decomposed[:num_faults] & ~primitive & (dem._get_weights() > 2)
+    if (weights[primitive] < 0).any():
+        # faults with probability larger than 1/2 have negative weights
+        return np.flatnonzero(candidates).tolist()
+
+    costs = np.where(decom >= 0, weights[decom], 0).sum(axis=1)
+    affected = candidates & ~np.isfinite(costs)
+    bound = costs[candidates & np.isfinite(costs)].max(initial=0)
+    # the decompositions with a different logical effect are not stored
+    costs[decom_len < 0] = bound
+
+    ptr, ind = dem._get_detector_index()
+    for fault in modified:
+        dets = dem._get_detectors(fault)
+        radius = bound - weights[fault]
+        if radius < 0:
+            continue
+        # distance from each endpoint to the closest detector of each
+        # hyperedge and to the boundary
+        dists, boundary_dists = [], []
+        for det in dets:
+            det_dists, boundary_dist = _get_distances(dem, det, radius, weights)
+            hyper_dists = {}
+            for node, dist in det_dists.items():
+                faults = ind[ptr[node] : ptr[node + 1]]
+                for hyper in faults[candidates[faults]].tolist():
+                    hyper_dists[hyper] = min(dist, hyper_dists.get(hyper, np.inf))
+            dists.append(hyper_dists)
+            boundary_dists.append(boundary_dist)
+
+        for hyper in set().union(*dists):
+            if len(dets) == 1:
+                dist = dists[0][hyper]
+            else:
+                dist_1 = dists[0].get(hyper, np.inf)
+                dist_2 = dists[1].get(hyper, np.inf)
+                dist = min(
+                    dist_1 + min(dist_2, boundary_dists[1]),
+                    dist_2 + min(dist_1, boundary_dists[0]),
+                )
+            if weights[fault] + dist <= costs[hyper]:
+                affected[hyper] = True
+
+    return np.flatnonzero(affected).tolist()
 
-    if MWPM_prim.num_detectors != Matching(from_dem_to_stim(dem)).num_detectors:
+
+def _get_distances(
+    dem: DEM, source: int, radius: float, weights: np.ndarray
+) -> tuple[dict[int, float], float]:
+    """Returns the distance in the primitive graph from ``source`` to the
+    detectors at distance at most ``radius`` and to the boundary
+    (``numpy.inf`` if it is farther than ``radius``)."""
+    ptr, ind = dem._get_detector_index()
+    det_ptr, det_ind = dem._det_ptr, dem._det_ind
+    primitive = dem._primitive
+    distances = {}
+    boundary_dist = np.inf
+    queue = [(0.0, source)]
+    while queue:
+        dist, det = heapq.heappop(queue)
+        if det in distances:
+            continue
+        distances[det] = dist
+        for fault in ind[ptr[det] : ptr[det + 1]].tolist():
+            if not primitive[fault]:
+                continue
+            new_dist = dist + weights[fault]
+            if new_dist > radius:
+                continue
+            fault_dets = det_ind[det_ptr[fault] : det_ptr[fault + 1]].tolist()
+            if len(fault_dets) == 1:
+                boundary_dist = min(boundary_dist, new_dist)
+                continue
+            neigh = fault_dets[1] if fault_dets[0] == det else fault_dets[0]
+            if neigh not in distances:
+                heapq.heappush(queue, (new_dist, neigh))
+
+    return distances, boundary_dist
+
+
+def _get_primitive_matching(dem: DEM) -> tuple[Matching, DEM]:
+    """Returns the MWPM decoder for the primitive faults of the DEM, in which
+    the observables are the fault ids in the DEM of the primitive faults,
+    see ``DEM.primitive_matching``, and the DEM of the primitive faults."""
+    if not dem.primitives_cover_detectors():
         raise ValueError("Primitive faults do not span all detectors.")
 
-    for hyper in hyperedges:
-        det_ids = np.array(dem.detectors[hyper])
-        det_vec = np.zeros(MWPM_prim.num_detectors, dtype=bool)
-        det_vec[det_ids] = 1
+    MWPM_prim = dem.primitive_matching(label_faults=True)
+    primitive_dem = dem.get_primitive_graph()
+    return MWPM_prim, primitive_dem
+
+
+def _decompose_with_mwpm(
+    MWPM_prim: Matching, primitive_dem: DEM, dem: DEM, hyperedges: list[int]
+) -> list[list[int]]:
+    """Returns the decomposition of the given hyperedges found by MWPM,
+    with the fault ids sorted."""
+    det_ptr, det_ind = _gather_csr(
+        dem._det_ptr, dem._det_ind, np.array(hyperedges, dtype=np.int64)
+    )
+    matchings = _match_hyperedges(MWPM_prim, primitive_dem, det_ptr, det_ind)
+    return _get_decompositions(dem, hyperedges, matchings)
+
+
+def _get_decompositions(
+    dem: DEM, hyperedges: list[int], matchings: list[np.ndarray | None]
+) -> list[list[int]]:
+    """Returns the decompositions from the primitive faults found by MWPM
+    for each hyperedge, given by their position in ``dem.primitives``."""
+    primitives = np.array(dem.primitives, dtype=np.int64)
+    decompositions = []
+    for hyper, matching in zip(hyperedges, matchings):
+        if matching is None:
+            det_ids = np.array(dem.detectors[hyper])
+            raise ValueError(
+                f"No decomposition found for id={hyper} with " f"detectors={det_ids}."
+            )
+        decompositions.append(np.sort(primitives[matching]).tolist())
+    return decompositions
+
+
+def _match_hyperedges(
+    MWPM_prim: Matching,
+    primitive_dem: DEM,
+    det_ptr: np.ndarray,
+    det_ind: np.ndarray,
+    batch_size: int = 1024,
+    progress: Callable[[int, int], None] | None = None,
+    max_bytes: int = 2**24,
+) -> list[np.ndarray | None]:
+    """Returns the primitive faults (ids in ``primitive_dem``) used by MWPM
+    to match the detectors of each hyperedge, given in CSR format,
+    or ``None`` if no perfect matching exists.
+
+    The syndromes of the hyperedges are bit-packed and decoded in batches.
+    The primitive faults are the predicted observables of ``MWPM_prim``,
+    see ``DEM.primitive_matching``. If given, ``progress(done, total)`` is called
+    after each batch.
+
+    Each shot of a batch takes ``ceil(num_detectors / 8)`` bytes and its
+    predictions ``ceil(num_primitives / 8)`` bytes, as there is one observable
+    per primitive fault. The number of shots per batch is reduced so that
+    a batch takes at most ``max_bytes`` (but it has at least one shot),
+    thus the memory does not grow with ``batch_size`` for large DEMs.
+    """
+    num_hyper = len(det_ptr) - 1
+    num_bytes = (MWPM_prim.num_detectors + 7) // 8
+    num_pred_bytes = (MWPM_prim.num_fault_ids + 7) // 8
+    batch_size = max(1, min(batch_size, max_bytes // (num_bytes + num_pred_bytes)))
+    rows = np.repeat(np.arange(num_hyper), np.diff(det_ptr))
+    pair_index = None
+
+    matchings = []
+    for start in range(0, num_hyper, batch_size):
+        end = min(start + batch_size, num_hyper)
+        dets = det_ind[det_ptr[start] : det_ptr[end]]
+        shots = np.zeros((end - start, num_bytes), dtype=np.uint8)
+        np.bitwise_or.at(
+            shots,
+            (rows[det_ptr[start] : det_ptr[end]] - start, dets // 8),
+            (1 << (dets % 8)).astype(np.uint8),
+        )
 
         try:
-            edges = MWPM_prim.decode_to_edges_array(det_vec)
+            predictions = MWPM_prim.decode_batch(
+                shots, bit_packed_shots=True, bit_packed_predictions=True
+            )
         except ValueError as error:
-            if "No perfect matching could be found." in error.args[0]:
+            if "No perfect matching could be found." not in error.args[0]:
+                raise error
+            # find the hyperedges without a perfect matching
+            if pair_index is None:
+                pair_index = _get_pair_index(primitive_dem)
+            for shot in shots:
+                syndrome = np.unpackbits(
+                    shot, count=MWPM_prim.num_detectors, bitorder="little"
+                )
+                matchings.append(
+                    _match_syndrome(MWPM_prim, syndrome, primitive_dem, pair_index)
+                )
+            if progress is not None:
+                progress(end, num_hyper)
+            continue
+
+        # unpack only the non-zero bytes, as only a few edges are used per shot
+        shot_ids, byte_ids = np.nonzero(predictions)
+        bits = np.unpackbits(
+            predictions[shot_ids, byte_ids][:, None], axis=1, bitorder="little"
+        )
+        rows_bits, bit_ids = np.nonzero(bits)
+        shot_ids = shot_ids[rows_bits]
+        fault_ids = 8 * byte_ids[rows_bits] + bit_ids
+        splits = np.searchsorted(shot_ids, np.arange(1, end - start))
+        matchings += np.split(fault_ids, splits)
+        if progress is not None:
+            progress(end, num_hyper)
+
+    return matchings
+
+
+def _match_syndrome(
+    MWPM_prim: Matching,
+    syndrome: np.ndarray,
+    primitive_dem: DEM,
+    pair_index: tuple[np.ndarray, np.ndarray],
+) -> np.ndarray | None:
+    """Returns the primitive faults (ids in ``primitive_dem``) used by MWPM
+    to match the given syndrome, or ``None`` if no perfect matching exists."""
+    try:
+        edges = MWPM_prim.decode_to_edges_array(syndrome)
+    except ValueError as error:
+        if "No perfect matching could be found." in error.args[0]:
+            return None
+        raise error
+
+    # edges used twice cancel out, as in the predicted observables
+    fault_ids = _get_id_from_pymatching_edges(edges, primitive_dem, pair_index)
+    fault_ids, counts = np.unique(fault_ids, return_counts=True)
+    return fault_ids[counts % 2 == 1]
+
+
+def _match_in_parallel(
+    dem: DEM,
+    primitive_dem: DEM,
+    hyperedges: list[int],
+    workers: int | None = None,
+    executor: Executor | None = None,
+    progress: Callable[[int, int], None] | None = None,
+) -> list[np.ndarray | None]:
+    """Returns the primitive faults (ids in ``primitive_dem``) used by MWPM
+    to match the given hyperedges, computed in parallel.
+
+    The hyperedges are split in chunks that are decoded by the workers.
+    The primitive graph is shipped as the arrays of ``DEM``. The workers of
+    the process pool created here build its MWPM decoder once per process.
+    With ``executor``, the graph is shipped with each chunk and the decoder is
+    built for each chunk, so that no state is shared between the calls that
+    use the same executor (e.g. a ``ThreadPoolExecutor``). The matchings
+    are the same as in serial mode. If given, ``progress(done, total)``
+    is called after each chunk.
+    """
+    if workers is not None and (not isinstance(workers, int) or workers < 1):
+        raise ValueError(f"'workers' must be a positive int, not {workers}.")
+    if executor is not None and not isinstance(executor, Executor):
+        raise TypeError(
+            f"'executor' must be a concurrent.futures.Executor, not {type(executor)}."
+        )
+    if len(hyperedges) == 0:
+        return []
+
+    arrays = primitive_dem._get_arrays()
+    graph = tuple(
+        arrays[k] for k in ["probs", "det_ptr", "det_ind", "log_ptr", "log_ind"]
+    )
+    key = uuid.uuid4().hex
+
+    # several chunks per worker to balance the load
+    num_chunks = 4 * (workers or os.cpu_count() or 1)
+    ids = np.array(hyperedges, dtype=np.int64)
+    chunks = [
+        _gather_csr(dem._det_ptr, dem._det_ind, chunk)
+        for chunk in np.array_split(ids, max(min(num_chunks, len(ids)), 1))
+    ]
+
+    matchings = []
+
+    def collect(results: Iterable[list[np.ndarray | None]]) -> None:
+        for result in results:
+            matchings.extend(result)
+            if progress is not None:
+                progress(len(matchings), len(hyperedges))
+        return
+
+    if executor is None:
+        # the primitive graph is shipped once to each process
+        pool = ProcessPoolExecutor(
+            workers, initializer=_init_worker, initargs=(key, graph)
+        )
+        with pool:
+            collect(pool.map(_match_chunk, repeat(key), repeat(None), chunks))
+    else:
+        collect(executor.map(_match_chunk, repeat(key), repeat(graph), chunks))
+
+    return matchings
+
+
+def _init_worker(key: str, graph: tuple[np.ndarray, ...]) -> None:
+    """Builds the MWPM decoder of the primitive graph in a worker process."""
+    _WORKER_MATCHING[key] = _build_matching(graph)
+    return
+
+
+def _build_matching(graph: tuple[np.ndarray, ...]) -> tuple[Matching, DEM]:
+    """Returns the MWPM decoder and the DEM of the primitive graph
+    given by the arrays of ``DEM``."""
+    primitive_dem = DEM.from_arrays(*graph)
+    primitive_dem.set_as_primitives(range(primitive_dem.num_faults))
+    return primitive_dem.primitive_matching(label_faults=True), primitive_dem
+
+
+def _match_chunk(
+    key: str,
+    graph: tuple[np.ndarray, ...] | None,
+    chunk: tuple[np.ndarray, np.ndarray],
+) -> list[np.ndarray | None]:
+    """Returns the primitive faults used by MWPM for each hyperedge
+    in the chunk, given by the CSR arrays of their detectors. The decoder
+    is built from ``graph`` if it is given."""
+    if graph is not None:
+        MWPM_prim, primitive_dem = _build_matching(graph)
+    else:
+        MWPM_prim, primitive_dem = _WORKER_MATCHING[key]
+    return _match_hyperedges(MWPM_prim, primitive_dem, *chunk)
+
+
+def decompose_repeated_dem(
+    stim_dem: stim.DetectorErrorModel,
+    ignore_logical_error: bool = False,
+    num_boundary_periods: int = 2,
+) -> stim.DetectorErrorModel:
+    """Decomposes a stim detector error model keeping its ``repeat`` blocks,
+    so that the time and memory do not depend on the number of repetitions.
+
+    Each ``repeat`` block is truncated to ``2 * num_boundary_periods + 1``
+    periods and decomposed with ``decompose_dem``. In the output, the first
+    and last ``num_boundary_periods`` periods are unrolled with their own
+    decompositions and the remaining periods are kept in a ``repeat`` block
+    with the decompositions of the middle period of the truncated block.
+
+    Parameters
+    ----------
+    stim_dem
+        Detector error model to decompose.
+    ignore_logical_error
+        If True, does not raise an error when the found decomposition
+        does not have the same logical effect as the undecomposed fault.
+    num_boundary_periods
+        Number of periods at each side of a ``repeat`` block that are
+        decomposed separately from the bulk of the block.
+
+    Returns
+    -------
+    decom_dem
+        Decomposed detector error model with the same instructions as
+        ``stim_dem``, but with the decompositions in the error instructions.
+
+    Notes
+    -----
+    The decomposition of the bulk periods is the same as the one from
+    ``decompose_dem`` if the decomposition of a hyperedge only depends on
+    the faults at most ``num_boundary_periods`` periods away from it.
+    If a decomposition cannot be expressed inside the body of the ``repeat``
+    block (e.g. it uses detectors of the previous period), the block is unrolled.
+    """
+    if not isinstance(stim_dem, stim.DetectorErrorModel):
+        raise TypeError(f"'stim_dem' is not a stim DEM, but a {type(stim_dem)}.")
+    if not isinstance(num_boundary_periods, int):
+        raise TypeError(
+            "'num_boundary_periods' must be an int, "
+            f"but {type(num_boundary_periods)} was given."
+        )
+    if num_boundary_periods < 1:
+        raise ValueError(
+            f"'num_boundary_periods' must be positive, not {num_boundary_periods}."
+        )
+
+    # list of (repetitions, instructions), with the nested blocks unrolled
+    items = []
+    for instr in stim_dem:
+        if isinstance(instr, stim.DemRepeatBlock):
+            items.append((instr.repeat_count, _unroll_repeat_blocks(instr.body_copy())))
+        elif items and items[-1][0] == 1:
+            items[-1][1].append(instr)
+        else:
+            items.append((1, [instr]))
+
+    num_periods = 2 * num_boundary_periods + 1
+    tiled = set(k for k, (count, _) in enumerate(items) if count > num_periods)
+
+    while True:
+        # decompose the truncated DEM
+        truncated = stim.DetectorErrorModel()
+        errors, offsets = {}, []
+        offset = 0
+        for k, (count, body) in enumerate(items):
+            for period in range(num_periods if k in tiled else count):
+                for j, instr in enumerate(body):
+                    truncated.append(instr)
+                    if instr.type == "error":
+                        errors[k, period, j] = len(offsets)
+                        offsets.append(offset)
+                    elif instr.type == "shift_detectors":
+                        offset += instr.targets_copy()[0]
+
+        dem, ids = _from_stim_to_dem_with_ids(truncated)
+        dem = decompose_dem(dem, ignore_logical_error=ignore_logical_error)
+
+        # write the decompositions in the error instructions
+        decomposed_instrs = {}
+        untileable = set()
+        for (k, period, j), error in errors.items():
+            instr = items[k][1][j]
+            decomposition = dem.decompositions.get(int(ids[error]))
+            if decomposition is None:
+                decomposed_instrs[k, period, j] = instr
+                continue
+
+            targets = _get_relative_targets(dem, decomposition, offsets[error])
+            if targets is None:
+                untileable.add(k)
+                continue
+            decomposed_instrs[k, period, j] = stim.DemInstruction(
+                "error", args=instr.args_copy(), targets=targets, tag=instr.tag
+            )
+
+        if untileable - tiled:
+            # some decompositions cannot be expressed with relative detectors
+            return decompose_dem(stim_dem.flattened(), ignore_logical_error)
+        if untileable:
+            tiled -= untileable
+            continue
+
+        decom_dem = stim.DetectorErrorModel()
+        for k, (count, body) in enumerate(items):
+            if k not in tiled:
+                for period in range(count):
+                    for j, instr in enumerate(body):
+                        decom_dem.append(decomposed_instrs.get((k, period, j), instr))
+                continue
+
+            block = stim.DetectorErrorModel()
+            for j, instr in enumerate(body):
+                block.append(decomposed_instrs.get((k, num_boundary_periods, j), instr))
+            for period in range(num_periods):
+                if period == num_boundary_periods:
+                    decom_dem.append(
+                        stim.DemRepeatBlock(count - num_periods + 1, block)
+                    )
+                    continue
+                for j, instr in enumerate(body):
+                    decom_dem.append(decomposed_instrs.get((k, period, j), instr))
+
+        return decom_dem
+
+
+def _get_relative_targets(
+    dem: DEM, decomposition: tuple[int, ...], offset: int
+) -> list[stim.DemTarget] | None:
+    """Returns the stim targets of the given decomposition with the detectors
+    relative to ``offset``, or ``None`` if a detector is below ``offset``."""
+    targets = []
+    for k, id_ in enumerate(decomposition):
+        dets = [d - offset for d in dem.detectors[id_]]
+        if any(d < 0 for d in dets):
+            return None
+        targets += [stim.target_relative_detector_id(d) for d in dets]
+        targets += [stim.target_logical_observable_id(l) for l in dem.logicals[id_]]
+        # add "^" separator except for the last element
+        if k != len(decomposition) - 1:
+            targets.append(stim.target_separator())
+    return targets
+
+
+def _unroll_repeat_blocks(stim_dem: stim.DetectorErrorModel) -> list:
+    """Returns the instructions of ``stim_dem`` with the ``repeat`` blocks
+    unrolled. Contrary to ``stim_dem.flattened()``, it keeps the
+    ``shift_detectors`` instructions."""
+    instrs = []
+    for instr in stim_dem:
+        if isinstance(instr, stim.DemRepeatBlock):
+            instrs += _unroll_repeat_blocks(instr.body_copy()) * instr.repeat_count
+        else:
+            instrs.append(instr)
+    return instrs
+
+
+def decompose_dem_stream(
+    faults: stim.DetectorErrorModel | Iterable[tuple[float, Iterable, Iterable]],
+    window: int = 2,
+    detectors_per_round: int | None = None,
+    ignore_logical_error: bool = False,
+    stats: dict | None = None,
+) -> Iterator[tuple[float, tuple, tuple, tuple | None]]:
+    """Decomposes a stream of faults in detector-time order, keeping in memory
+    only the faults inside a window of rounds.
+
+    The round of a detector is ``detector // detectors_per_round`` and a fault
+    belongs to the round of its last detector. The hyperedges and weight-2
+    edges of round ``r`` are decomposed as in ``decompose_dem`` but using only
+    the faults whose detectors are in rounds ``r - window`` to ``r + window``.
+    They are decomposed once the stream reaches round ``r + 2 * window + 1``,
+    thus the faults can be out of order by at most ``window`` rounds.
+
+    Parameters
+    ----------
+    faults
+        Stim detector error model (its ``repeat`` blocks are not unrolled
+        in memory) or iterable of ``(prob, detectors, logicals)``. As in
+        ``from_stim_to_dem``, the stim errors without decomposition that
+        trigger at most two detectors are primitive faults. The decompositions
+        of the stim errors are not kept.
+    window
+        Number of rounds before and after the round of a fault that are
+        used to decompose it.
+    detectors_per_round
+        Number of detectors in each round. It is only optional if ``faults``
+        is a stim detector error model with a ``repeat`` block, for which
+        it is obtained from the detector and time shifts of the block.
+    ignore_logical_error
+        If True, does not raise an error when the found decomposition
+        does not have the same logical effect as the undecomposed fault.
+    stats
+        If given, this dictionary is updated with the number of windows
+        (``"num_windows"``) and the maximum number of faults kept in memory
+        (``"max_faults_in_memory"``), which does not depend on the number
+        of rounds.
+
+    Yields
+    ------
+    prob
+        Probability of the fault.
+    detectors
+        Detectors triggered by the fault.
+    logicals
+        Logical observables flipped by the fault.
+    decomposition
+        Tuple of ``(detectors, logicals)`` of the faults in which it is
+        decomposed, or ``None`` if it is not decomposed (e.g. primitive faults).
+
+    Notes
+    -----
+    The faults are yielded in the same order as they are given. The
+    decompositions are the same as the ones from ``decompose_dem`` if the
+    decomposition of a hyperedge only depends on the faults at most
+    ``window`` rounds away from it.
+    """
+    if isinstance(faults, stim.DetectorErrorModel):
+        if detectors_per_round is None:
+            detectors_per_round = _get_detectors_per_round(faults)
+        faults = _iter_stim_faults(faults)
+    elif isinstance(faults, Iterable):
+        faults = ((prob, dets, logs, False) for prob, dets, logs in faults)
+    else:
+        raise TypeError(
+            "'faults' must be a stim DEM or an iterable, "
+            f"but {type(faults)} was given."
+        )
+    if not isinstance(window, int) or window < 0:
+        raise ValueError(f"'window' must be a non-negative int, not {window}.")
+    if not isinstance(detectors_per_round, int) or detectors_per_round < 1:
+        raise ValueError(
+            "'detectors_per_round' must be a positive int, "
+            f"not {detectors_per_round}."
+        )
+
+    stats = stats if stats is not None else {}
+    stats["num_windows"] = 0
+    stats["max_faults_in_memory"] = 0
+    return _decompose_stream(
+        faults, window, detectors_per_round, ignore_logical_error, stats
+    )
+
+
+def _decompose_stream(
+    faults: Iterable[tuple[float, Iterable, Iterable, bool]],
+    window: int,
+    detectors_per_round: int,
+    ignore_logical_error: bool,
+    stats: dict,
+) -> Iterator[tuple[float, tuple, tuple, tuple | None]]:
+    """Generator of ``decompose_dem_stream``, which is a separate function
+    so that the inputs are checked when calling ``decompose_dem_stream``.
+    The last element of each fault is whether it is set as primitive."""
+    # faults of each round (by their last detector) that can be used in a window
+    # and queue of the faults to yield, as
+    # [prob, dets, logs, round, decomposition, primitive]
+    rounds = {}
+    queue = deque()
+    num_faults = 0
+    last_round = -1  # last round whose faults have been decomposed
+    current_round = -1  # largest round of the first detector of the faults
+
+    def decompose_until(stop_round: int) -> Iterator[tuple]:
+        nonlocal last_round, num_faults
+        while last_round < stop_round:
+            last_round += 1
+            if any(len(r[1]) >= 2 for r in rounds.get(last_round, [])):
+                _decompose_window(
+                    rounds,
+                    last_round,
+                    window,
+                    detectors_per_round,
+                    ignore_logical_error,
+                )
+                stats["num_windows"] += 1
+            # the faults of the older rounds are not used in the next windows
+            num_faults -= len(rounds.pop(last_round - window, []))
+            while queue and queue[0][3] <= last_round:
+                prob, dets, logs, _, decomposition, _ = queue.popleft()
+                yield prob, dets, logs, decomposition
+
+    for prob, dets, logs, primitive in faults:
+        dets, logs = tuple(sorted(dets)), tuple(sorted(logs))
+        if not dets:
+            # it does not take part in any decomposition
+            queue.append([prob, dets, logs, -1, None, primitive])
+            yield from decompose_until(last_round)
+            continue
+
+        first_round = dets[0] // detectors_per_round
+        record = [prob, dets, logs, dets[-1] // detectors_per_round, None, primitive]
+        if last_round >= 0 and first_round <= last_round + window:
+            raise ValueError(
+                f"The fault with detectors={dets} is more than 'window' rounds "
+                "out of detector-time order."
+            )
+        if record[3] - first_round > window:
+            raise ValueError(
+                f"The fault with detectors={dets} spans more than 'window' rounds."
+            )
+        rounds.setdefault(record[3], []).append(record)
+        queue.append(record)
+        num_faults += 1
+        stats["max_faults_in_memory"] = max(stats["max_faults_in_memory"], num_faults)
+
+        if first_round > current_round:
+            current_round = first_round
+            yield from decompose_until(current_round - 2 * window - 1)
+
+    yield from decompose_until(max(rounds, default=last_round))
+    return
+
+
+def _decompose_window(
+    rounds: dict[int, list[list]],
+    round_: int,
+    window: int,
+    detectors_per_round: int,
+    ignore_logical_error: bool,
+) -> None:
+    """Decomposes the weight-2 edges and hyperedges of the given round
+    using the faults inside the window, see ``decompose_dem_stream``.
+    The decompositions are stored in the records of ``rounds``."""
+    first_round = round_ - window
+    offset = first_round * detectors_per_round
+    records = [
+        record
+        for r in range(first_round, round_ + window + 1)
+        for record in rounds.get(r, [])
+        if record[1][0] >= offset
+    ]
+
+    # the detectors are relabelled so that the size of the DEM only depends
+    # on the size of the window
+    dem = DEM()
+    ids = dem.add_faults(
+        [r[0] for r in records],
+        [[d - offset for d in r[1]] for r in records],
+        [r[2] for r in records],
+    ).tolist()
+    dem.set_as_primitives([ids[k] for k, r in enumerate(records) if r[5]])
+    weight_2_edges, hyperedges = _get_undecomposed_faults(dem)
+    _decompose_weight_2_edges(dem, weight_2_edges, ignore_logical_error)
+
+    owned = set(ids[k] for k, r in enumerate(records) if r[3] == round_)
+    hyperedges = [h for h in hyperedges if h in owned]
+    if hyperedges:
+        primitive_dem = dem.get_primitive_graph()
+        MWPM_prim = primitive_dem.primitive_matching(label_faults=True)
+        for hyper in hyperedges:
+            if max(dem.detectors[hyper]) >= MWPM_prim.num_detectors:
                 raise ValueError(
-                    f"No decomposition found for id={hyper} with "
-                    f"detectors={det_ids}."
+                    "No decomposition found for the fault with detectors="
+                    f"{tuple(d + offset for d in dem.detectors[hyper])}."
                 )
-            raise error
+        decompositions = _decompose_with_mwpm(MWPM_prim, primitive_dem, dem, hyperedges)
+        for hyper, decomposition in zip(hyperedges, decompositions):
+            dem.add_decomposition(
+                hyper, decomposition, ignore_logical_error=ignore_logical_error
+            )
+
+    for k, record in enumerate(records):
+        if record[3] != round_ or ids[k] not in dem.decompositions:
+            continue
+        record[4] = tuple(
+            (tuple(d + offset for d in dem.detectors[i]), dem.logicals[i])
+            for i in dem.decompositions[ids[k]]
+        )
+    return
+
+
+def _iter_stim_faults(
+    stim_dem: stim.DetectorErrorModel, offset: int = 0
+) -> Iterator[tuple[float, tuple[int, ...], tuple[int, ...], bool]]:
+    """Yields the probability, detectors, logicals and whether it is primitive
+    (as in ``from_stim_to_dem``) of the errors of the stim detector error model
+    without unrolling its ``repeat`` blocks in memory.
+    Returns the detector offset after the model."""
+    for instr in stim_dem:
+        if isinstance(instr, stim.DemRepeatBlock):
+            body = instr.body_copy()
+            for _ in range(instr.repeat_count):
+                offset = yield from _iter_stim_faults(body, offset)
+        elif instr.type == "error":
+            dets = tuple(d + offset for d in get_detectors(instr))
+            primitive = len(dets) <= 2 and not has_separator(instr)
+            yield instr.args_copy()[0], dets, get_logicals(instr), primitive
+        elif instr.type == "shift_detectors":
+            offset += instr.targets_copy()[0]
+    return offset
+
 
-        decomposition = _get_id_from_pymatching_edges(edges, dem)
+def _get_detectors_per_round(stim_dem: stim.DetectorErrorModel) -> int:
+    """Returns the number of detectors per round of the first ``repeat``
+    block of the stim detector error model, given by its detector shift
+    divided by its time shift (the last coordinate)."""
+    for instr in stim_dem:
+        if not isinstance(instr, stim.DemRepeatBlock):
+            continue
+        num_dets, num_rounds = 0, 0
+        for body_instr in instr.body_copy():
+            if isinstance(body_instr, stim.DemRepeatBlock):
+                continue
+            if body_instr.type == "shift_detectors":
+                num_dets += body_instr.targets_copy()[0]
+                args = body_instr.args_copy()
+                num_rounds += round(args[-1]) if args else 0
+        if num_dets == 0:
+            continue
+        if num_rounds > 0 and num_dets % num_rounds == 0:
+            return num_dets // num_rounds
+        return num_dets
+
+    raise ValueError(
+        "'detectors_per_round' must be given for stim DEMs without 'repeat' blocks."
+    )
+
+
+def decompose_dem_sweep(
+    dem: DEM | stim.DetectorErrorModel,
+    probs: np.ndarray,
+    ignore_logical_error: bool = False,
+    check_stability: bool = False,
+    stats: dict | None = None,
+) -> tuple[DEM, np.ndarray]:
+    """Decomposes a detector error model once and applies the decomposition
+    to several probability vectors (e.g. from a noise sweep) at once.
+
+    Parameters
+    ----------
+    dem
+        Detector error model to decompose. Its probabilities are used
+        to obtain the decomposition of the hyperedges.
+    probs
+        Probabilities of the faults in ``dem`` for each point of the sweep,
+        with shape ``(num_faults,)`` or ``(num_sweeps, num_faults)``.
+        The order of the faults is the one in ``from_stim_to_dem_fast(dem)``.
+    ignore_logical_error
+        If True, does not raise an error when the found decomposition
+        does not have the same logical effect as the undecomposed fault.
+    check_stability
+        If True, the hyperedges whose MWPM choice could change at a point of
+        the sweep are decomposed again with its probabilities, and the ones
+        with a different choice use it for that point. These are the hyperedges
+        closer to a primitive fault with a different probability than the weight
+        of their decomposition (see ``incremental`` in ``decompose_dem``), or
+        all of them if many primitive faults change (e.g. when rescaling all
+        the probabilities). Thus, the output is the same as running
+        ``decompose_dem`` for each point, except when several decompositions
+        have the same weight. If a new
+        choice has a different logical effect than its hyperedge, an error
+        is raised, or, if ``ignore_logical_error``, a warning is given and
+        the hyperedge keeps its decomposition.
+    stats
+        If given, with ``check_stability``, it is filled with the number of
+        hyperedges decomposed again (``"num_affected"``) and the ids of the ones
+        with a different choice (``"unstable_hyperedges"``) for each point.
+
+    Returns
+    -------
+    decom_dem
+        Decomposed detector error model.
+    decomposed_probs
+        Probabilities of the faults in ``decom_dem.get_decomposed_dem()`` for
+        each point of the sweep, with shape ``(num_primitives,)`` or
+        ``(num_sweeps, num_primitives)``. The corresponding matching-graph
+        weights are given by ``util.probs_to_weights``.
+    """
+    if isinstance(dem, stim.DetectorErrorModel):
+        dem = from_stim_to_dem_fast(dem)
+
+    hyperedges = _split_faults(dem, ignore_logical_error=ignore_logical_error)
+    MWPM_prim, primitive_dem = _get_primitive_matching(dem)
+    decompositions = _decompose_with_mwpm(MWPM_prim, primitive_dem, dem, hyperedges)
+    for hyper, decomposition in zip(hyperedges, decompositions):
         dem.add_decomposition(
-            hyper,
-            decomposition,
-            ignore_logical_error=ignore_logical_error,
+            hyper, decomposition, ignore_logical_error=ignore_logical_error
         )
 
-    if convert_to_stim:
-        dem = from_dem_to_stim(dem)
+    decomposed_probs = dem.get_decomposed_probs(probs)
+    if not check_stability:
+        return dem, decomposed_probs
 
-    return dem
+    sweep_probs = np.asarray(probs, dtype=np.float64).reshape(-1, dem.num_faults)
+    sweep_decomposed_probs = decomposed_probs.reshape(len(sweep_probs), -1)
+    stats = {} if stats is None else stats
+    stats["num_affected"], stats["unstable_hyperedges"] = [], []
+    primitive = dem._primitive[: dem.num_faults]
+    for k, new_probs in enumerate(sweep_probs):
+        new_dem = dem.with_probs(new_probs)
+        modified = np.flatnonzero(
+            primitive & (new_probs != dem._probs[: dem.num_faults])
+        )
+        if len(modified) <= _SWEEP_MAX_MODIFIED * len(hyperedges):
+            affected = _get_affected_hyperedges(new_dem, modified.tolist())
+        else:
+            affected = list(hyperedges)
+        stats["num_affected"].append(len(affected))
+        stats["unstable_hyperedges"].append([])
+        if len(affected) == 0:
+            continue
+
+        MWPM_prim, primitive_dem = _get_primitive_matching(new_dem)
+        decompositions = _decompose_with_mwpm(
+            MWPM_prim, primitive_dem, new_dem, affected
+        )
+        for hyper, decomposition in zip(affected, decompositions):
+            if decomposition == sorted(dem.decompositions.get(hyper, ())):
+                continue
+            logs = [new_dem.logicals[i] for i in decomposition]
+            if DetectorSet.xor_many(logs + [new_dem.logicals[hyper]]):
+                message = (
+                    f"The decomposition of fault id={hyper} changes at point {k} "
+                    f"of the sweep to {decomposition}, which has a different "
+                    "logical effect than the fault."
+                )
+                if not ignore_logical_error:
+                    raise ValueError(message)
+                warnings.warn(message + " The previous decomposition is kept.")
+                continue
+            stats["unstable_hyperedges"][k].append(hyper)
+            new_dem.add_decomposition(hyper, decomposition, override=True)
+
+        if len(stats["unstable_hyperedges"][k]) != 0:
+            sweep_decomposed_probs[k] = new_dem.get_decomposed_probs()
+
+    return dem, decomposed_probs
 
 
 def find_valid_decomposition(
-    primitive_dem: stim.DetectorErrorModel, hyperfault: stim.DemInstruction
+    primitive_dem: stim.DetectorErrorModel | DEM, hyperfault: stim.DemInstruction
 ) -> None | tuple[int]:
     """Returns if a possible correct decomposition can be found for
     the given hyperfault. A 'correct decomposition' is when the logical
@@ -141,52 +1661,142 @@ def find_valid_decomposition(
     ``None`` if no correct decomposition has been found and
     ``fault_inds`` of the correct decomposition otherwise.
     """
-    if not isinstance(primitive_dem, stim.DetectorErrorModel):
+    return find_valid_decompositions(primitive_dem, [hyperfault])[0]
+
+
+def find_valid_decompositions(
+    primitive_dem: stim.DetectorErrorModel | DEM,
+    hyperfaults: Iterable[stim.DemInstruction],
+) -> list[None | tuple[int]]:
+    """Returns the output of ``find_valid_decomposition`` for each of
+    the given hyperfaults.
+
+    The logical-augmented primitive DEM and the BP-OSD decoder are built
+    only once, and the hyperfaults with the same syndrome are decoded once.
+
+    Parameters
+    ----------
+    primtive_dem
+        DEM to be used to decompose the hyperfaults.
+    hyperfaults
+        Hyperfaults to be decomposed.
+
+    Returns
+    -------
+    List with ``None`` for the hyperfaults for which no correct decomposition
+    has been found and with the ``fault_inds`` of the correct decomposition
+    for the rest.
+    """
+    if not isinstance(primitive_dem, (stim.DetectorErrorModel, DEM)):
         raise TypeError(
-            "'primitive_dem' must be a stim.DetectorErrorModel,"
+            "'primitive_dem' must be a stim.DetectorErrorModel or DEM,"
             f" but type{primitive_dem} was given."
         )
-    if not isinstance(hyperfault, stim.DemInstruction):
-        raise TypeError(
-            "'hyperfault' must be a stim.DemInstruction,"
-            f" but type{hyperfault} was given."
-        )
-    if hyperfault.type != "error":
-        raise TypeError(
-            f"'hyperfault' must be an error, but {hyperfault.type} was given."
-        )
+    hyperfaults = list(hyperfaults)
+    for hyperfault in hyperfaults:
+        if not isinstance(hyperfault, stim.DemInstruction):
+            raise TypeError(
+                "'hyperfault' must be a stim.DemInstruction,"
+                f" but type{hyperfault} was given."
+            )
+        if hyperfault.type != "error":
+            raise TypeError(
+                f"'hyperfault' must be an error, but {hyperfault.type} was given."
+            )
 
     # Transform logicals into detectors
-    num_dets = primitive_dem.num_detectors
-    new_primitive_dem = stim.DetectorErrorModel()
-    for dem_instr in primitive_dem.flattened():
-        if dem_instr.type != "error":
+    if isinstance(primitive_dem, stim.DetectorErrorModel):
+        num_dets = primitive_dem.num_detectors
+        probs, dets = [], []
+        for dem_instr in primitive_dem.flattened():
+            if dem_instr.type != "error":
+                continue
+            logs = tuple(l + num_dets for l in get_logicals(dem_instr))
+            dets.append(get_detectors(dem_instr) + logs)
+            probs.append(dem_instr.args_copy()[0])
+        new_primitive_dem = DEM()
+        ids = new_primitive_dem.add_faults(probs, dets, [[]] * len(dets))
+        # instructions with the same detectors and logicals are merged in
+        # a single fault, which is mapped back to its first instruction
+        _, instr_inds = np.unique(ids, return_index=True)
+    else:
+        num_dets = primitive_dem.num_detectors
+        new_primitive_dem = primitive_dem.get_logical_augmented_dem(num_dets)
+        instr_inds = None
+    check_matrix = new_primitive_dem.check_matrix()
+
+    # Prepare the detector vectors of the hyperedges
+    num_rows = check_matrix.shape[0]
+    syndromes = []
+    for hyperfault in hyperfaults:
+        dets = get_detectors(hyperfault)
+        logs = tuple(l + num_dets for l in get_logicals(hyperfault))
+        if any(d >= num_dets for d in dets) or any(l >= num_rows for l in logs):
+            # the primitive faults do not trigger some of the detectors
+            syndromes.append(None)
             continue
+        syndromes.append(dets + logs)
 
-        dets = get_detectors(dem_instr)
-        logs = tuple(l + num_dets for l in get_logicals(dem_instr))
-        prob = dem_instr.args_copy()
+    fault_inds = _decode_with_bposd(new_primitive_dem, syndromes)
+    if instr_inds is not None:
+        fault_inds = [
+            None if inds is None else tuple(sorted(instr_inds[list(inds)].tolist()))
+            for inds in fault_inds
+        ]
+    return fault_inds
 
-        new_instr = stim.DemInstruction(
-            type="error",
-            args=prob,
-            targets=list(map(stim.target_relative_detector_id, dets + logs)),
-        )
-        new_primitive_dem.append(new_instr)
 
-    # Prepare hyperedge detector vector
-    dets = get_detectors(hyperfault)
-    logs = tuple(l + num_dets for l in get_logicals(hyperfault))
-    det_ids = np.array(dets + logs)
-    det_vec = np.zeros(new_primitive_dem.num_detectors, dtype=bool)
-    det_vec[det_ids] = 1
+def _decode_with_bposd(
+    augmented_dem: DEM, syndromes: list[tuple[int, ...] | None]
+) -> list[None | tuple[int]]:
+    """Returns the faults of ``augmented_dem`` found by BP-OSD for each of
+    the given syndromes, or ``None`` if they do not trigger the syndrome
+    or if the syndrome is ``None``. The decoder is built once and
+    the syndromes that appear several times are decoded once."""
+    from ldpc.bposd_decoder import BpOsdDecoder
+    import scipy.sparse as sparse
 
-    # Try to find decomposition
-    bp_osd = BP_OSD(new_primitive_dem)
-    error_mech = bp_osd.decode_to_faults_array(det_vec)
-    if (bp_osd.check_matrix @ error_mech != det_vec).any():
-        return None
+    check_matrix = augmented_dem.check_matrix()
+    num_rows = check_matrix.shape[0]
+    unique_syndromes, inverse = {}, []
+    for syndrome in syndromes:
+        if syndrome is None or any(d >= num_rows for d in syndrome):
+            inverse.append(None)
+            continue
+        det_ids = tuple(sorted(set(syndrome)))
+        inverse.append(unique_syndromes.setdefault(det_ids, len(unique_syndromes)))
+    syn_ptr, syn_ind = _ragged_to_csr(unique_syndromes)
+    syn_matrix = sparse.csr_matrix(
+        (np.ones(len(syn_ind), dtype=np.int64), syn_ind, syn_ptr),
+        shape=(len(unique_syndromes), num_rows),
+    )
+
+    # Try to find the decompositions
+    error_ptr = np.zeros(len(unique_syndromes) + 1, dtype=np.int64)
+    error_ind = []
+    if len(unique_syndromes):
+        bp_osd = BpOsdDecoder(check_matrix, channel_probs=augmented_dem.priors())
+        for k, row in enumerate(syn_matrix):
+            error_ind.append(np.flatnonzero(bp_osd.decode(row.toarray()[0])))
+            error_ptr[k + 1] = error_ptr[k] + len(error_ind[-1])
+    error_ind = np.concatenate(error_ind) if error_ind else np.zeros(0, dtype=int)
+    error_matrix = sparse.csr_matrix(
+        (np.ones(len(error_ind), dtype=np.int64), error_ind, error_ptr),
+        shape=(len(unique_syndromes), check_matrix.shape[1]),
+    )
 
-    fault_inds = np.where(error_mech)[0]
+    # check that the decompositions trigger the syndromes, in batch
+    residual = (error_matrix @ check_matrix.T).tocsr()
+    residual.data %= 2
+    residual = residual - syn_matrix
+    residual.eliminate_zeros()
+    correct = np.diff(residual.indptr) == 0
+
+    fault_inds = []
+    for k in inverse:
+        if k is None or not correct[k]:
+            fault_inds.append(None)
+            continue
+        fault_inds.append(tuple(error_ind[error_ptr[k] : error_ptr[k + 1]]))
 
-    return tuple(fault_inds)
+    return fault_inds
@@ -1,23 +1,401 @@
 from __future__ import annotations
-from collections.abc import Iterable
+from collections.abc import Iterable, Iterator, Mapping, Callable, Sized
+from itertools import chain
+import json
+import pathlib
+import struct
+from typing import TYPE_CHECKING
 import warnings
 
-from .util import xor_lists, xor_two_probs
+import numpy as np
+
+if TYPE_CHECKING:
+    from pymatching import Matching
+    import scipy.sparse as sparse
+
+from .util import (
+    DetectorSet,
+    xor_lists,
+    xor_two_probs,
+    scatter_xor_probs,
+    probs_to_weights,
+)
+
+
+# binary format of 'DEM.save': magic bytes, version and length of the JSON header,
+# JSON header and the arrays, each of them aligned to '_FILE_ALIGNMENT' bytes
+_FILE_MAGIC = b"HYPDECOM"
+_FILE_VERSION = 1
+_FILE_ALIGNMENT = 64
+
+
+def _align(num_bytes: int) -> int:
+    return -(-num_bytes // _FILE_ALIGNMENT) * _FILE_ALIGNMENT
+
+
+def _enlarge(array: np.ndarray, size: int, fill: int | float = 0) -> np.ndarray:
+    """Returns ``array`` with its first axis enlarged to at least ``size``.
+    The capacity is doubled to amortize the cost of consecutive appends."""
+    if len(array) >= size:
+        return array
+    new_size = max(size, 2 * len(array), 16)
+    new_array = np.full((new_size,) + array.shape[1:], fill, dtype=array.dtype)
+    new_array[: len(array)] = array
+    return new_array
+
+
+def _gather_csr(
+    ptr: np.ndarray, ind: np.ndarray, rows: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the CSR arrays (``ptr``, ``ind``) of the given ``rows``."""
+    starts = ptr[rows]
+    lengths = ptr[rows + 1] - starts
+    new_ptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_ptr[1:])
+    positions = np.repeat(starts - new_ptr[:-1], lengths) + np.arange(new_ptr[-1])
+    return new_ptr, ind[positions]
+
+
+def _ragged_to_csr(ragged: Iterable[Iterable[int]]) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the CSR arrays (``ptr``, ``ind``) of a ragged list of integers."""
+    ragged = [r if isinstance(r, Sized) else tuple(r) for r in ragged]
+    ptr = np.zeros(len(ragged) + 1, dtype=np.int64)
+    np.cumsum([len(r) for r in ragged], out=ptr[1:])
+    ind = np.fromiter(chain.from_iterable(ragged), dtype=np.int64, count=ptr[-1])
+    return ptr, ind
+
+
+def _sort_csr_rows(ptr: np.ndarray, ind: np.ndarray) -> np.ndarray:
+    """Returns ``ind`` with the elements of each row sorted."""
+    unsorted = np.diff(ind) < 0
+    boundaries = ptr[(ptr > 0) & (ptr < len(ind))]
+    unsorted[boundaries - 1] = False
+    if not unsorted.any():
+        return ind
+
+    sentinel = np.iinfo(np.int64).max
+    matrix = _pad_csr(ptr, ind)
+    matrix[matrix == -1] = sentinel
+    matrix.sort(axis=1)
+    return matrix[matrix != sentinel]
+
+
+def _csr_to_tuples(ptr: np.ndarray, ind: np.ndarray) -> list[tuple[int, ...]]:
+    """Returns the rows of the CSR arrays as a list of tuples."""
+    lengths = np.diff(ptr)
+    order = np.argsort(lengths, kind="stable")
+    tuples = []
+    for length in np.unique(lengths).tolist():
+        rows = order[np.searchsorted(lengths[order], length, side="left") :][
+            : np.count_nonzero(lengths == length)
+        ]
+        cols = ptr[rows][:, None] + np.arange(length)
+        tuples += map(tuple, ind[cols].tolist())
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+    return [tuples[i] for i in position.tolist()]
+
+
+def _group_rows(matrix: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the group of each row of ``matrix``, where groups are labelled
+    by order of appearance, and the first row of each group."""
+    base = int(matrix.max(initial=0)) + 2
+    if base ** matrix.shape[1] < 2**63:
+        # encode each row in a single integer, which is faster to sort
+        keys = (matrix + 1) @ (base ** np.arange(matrix.shape[1] - 1, -1, -1))
+        order = np.argsort(keys, kind="stable")
+    else:
+        order = np.lexsort(matrix.T[::-1])
+    sorted_matrix = matrix[order]
+    is_new = np.ones(len(matrix), dtype=bool)
+    is_new[1:] = (sorted_matrix[1:] != sorted_matrix[:-1]).any(axis=1)
+    # the sorting is stable, thus the first row of each group has the lowest index
+    first = np.sort(order[is_new])
+    labels = np.empty(len(matrix), dtype=np.int64)
+    labels[order] = np.cumsum(is_new) - 1
+    relabel = np.empty(len(first), dtype=np.int64)
+    relabel[labels[first]] = np.arange(len(first))
+    return relabel[labels], first
+
+
+def _pad_csr(ptr: np.ndarray, ind: np.ndarray, width: int = 1) -> np.ndarray:
+    """Returns the rows of the CSR arrays as a dense matrix padded with -1
+    that has at least ``width`` columns."""
+    lengths = np.diff(ptr)
+    width = max(int(lengths.max(initial=0)), width)
+    matrix = np.full((len(lengths), width), -1, dtype=np.int64)
+    cols = np.arange(len(ind)) - np.repeat(ptr[:-1], lengths)
+    matrix[np.repeat(np.arange(len(lengths)), lengths), cols] = ind
+    return matrix
+
+
+class _FaultView(Mapping):
+    """Read-only dictionary-like view of a column of ``DEM``."""
+
+    def __init__(
+        self,
+        getter: Callable[[int], object],
+        keys: Callable[[], Iterable[int]],
+        contains: Callable[[int], bool],
+    ) -> None:
+        self._getter = getter
+        self._keys = keys
+        self._contains = contains
+        return
+
+    def __getitem__(self, id_: int) -> object:
+        if not self._contains(id_):
+            raise KeyError(id_)
+        return self._getter(id_)
+
+    def __contains__(self, id_: object) -> bool:
+        return self._contains(id_)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._keys())
+
+    def __len__(self) -> int:
+        return len(self._keys())
+
+    def __repr__(self) -> str:
+        return repr(dict(self.items()))
 
 
 class DEM:
+    """Detector error model stored in a columnar format.
+
+    The faults are stored in NumPy arrays: the probabilities, the detectors
+    and logicals in CSR format (``ptr`` and ``ind`` arrays), a boolean mask
+    for the primitive and decomposed faults and a dense table (padded with -1)
+    for the decompositions. The attributes ``ids``, ``probs``, ``detectors``,
+    ``logicals``, ``decompositions``, ``primitives`` and ``decomposed`` are
+    views of these arrays.
+    """
+
     def __init__(self) -> None:
-        self.ids: list[int] = []
-        self.probs: dict[int, float | int] = {}
-        self.detectors: dict[int, tuple[int, ...]] = {}
-        self.det_to_id: dict[tuple[int, ...], int] = {}
-        self.logicals: dict[int, tuple[int, ...]] = {}
-        self.decompositions: dict[int, tuple[int, ...]] = {}
-        self.primitives: list[int] = []
-        self.prim_det_to_id: dict[tuple[int, ...], int] = {}
-        self.decomposed: dict[int, bool] = {}
+        self._num_faults = 0
+        self._probs = np.zeros(0, dtype=np.float64)
+        self._det_ptr = np.zeros(1, dtype=np.int64)
+        self._det_ind = np.zeros(0, dtype=np.int64)
+        self._log_ptr = np.zeros(1, dtype=np.int64)
+        self._log_ind = np.zeros(0, dtype=np.int64)
+        self._primitive = np.zeros(0, dtype=bool)
+        self._decomposed = np.zeros(0, dtype=bool)
+        self._decom = np.full((0, 2), -1, dtype=np.int64)
+        self._decom_len = np.full(0, -1, dtype=np.int64)
+        self._prim_order: list[int] = []
+        self._matrices: tuple[sparse.csc_matrix, sparse.csc_matrix] | None = None
+
+        # indices from the detectors to the fault ids, built on first use
+        self._det_to_id: dict[tuple[int, ...], int] | None = None
+        self._prim_det_to_id: dict[tuple[int, ...], int] | None = None
+        # index from each detector to the ids of the faults triggering it
+        # in CSR format, built on first use
+        self._det_index: tuple[np.ndarray, np.ndarray] | None = None
+        # detectors and logicals of the primitive faults used in decompositions,
+        # built on first use
+        self._prim_sets: dict[int, tuple[DetectorSet, DetectorSet]] = {}
+
+        # faults modified since the last call to 'mark_clean' (None if unknown)
+        self._dirty: set[int] | None = None
         return
 
+    @property
+    def num_faults(self) -> int:
+        """Number of faults in the DEM."""
+        return self._num_faults
+
+    @property
+    def det_to_id(self) -> dict[tuple[int, ...], int]:
+        """Index from the (sorted) detectors to the fault id, built on first use."""
+        if self._det_to_id is None:
+            keys = _csr_to_tuples(self._det_ptr[: self._num_faults + 1], self._det_ind)
+            self._det_to_id = dict(zip(keys, range(self._num_faults)))
+        return self._det_to_id
+
+    @property
+    def prim_det_to_id(self) -> dict[tuple[int, ...], int]:
+        """Index from the detectors to the fault id of the primitive faults,
+        built on first use."""
+        if self._prim_det_to_id is None:
+            rows = np.array(self._prim_order, dtype=np.int64)
+            keys = _csr_to_tuples(*_gather_csr(self._det_ptr, self._det_ind, rows))
+            self._prim_det_to_id = dict(zip(keys, self._prim_order))
+        return self._prim_det_to_id
+
+    @property
+    def dirty_faults(self) -> list[int] | None:
+        """Ids of the faults added, reweighted or whose decomposition has been
+        removed since the last call to ``mark_clean`` (e.g. by ``decompose_dem``),
+        or ``None`` if ``mark_clean`` has never been called."""
+        return None if self._dirty is None else sorted(self._dirty)
+
+    def mark_clean(self) -> None:
+        """Flags all the faults as not modified, see ``dirty_faults``."""
+        self._dirty = set()
+        return
+
+    @property
+    def ids(self) -> range:
+        return range(self._num_faults)
+
+    @property
+    def probs(self) -> Mapping[int, float]:
+        return _FaultView(self._get_prob, lambda: self.ids, self._has_id)
+
+    @property
+    def detectors(self) -> Mapping[int, tuple[int, ...]]:
+        return _FaultView(self._get_detectors, lambda: self.ids, self._has_id)
+
+    @property
+    def logicals(self) -> Mapping[int, tuple[int, ...]]:
+        return _FaultView(self._get_logicals, lambda: self.ids, self._has_id)
+
+    @property
+    def decompositions(self) -> Mapping[int, tuple[int, ...]]:
+        return _FaultView(
+            self._get_decomposition,
+            lambda: np.flatnonzero(self._decom_len[: self._num_faults] >= 0).tolist(),
+            lambda id_: self._has_id(id_) and self._decom_len[id_] >= 0,
+        )
+
+    @property
+    def decomposed(self) -> Mapping[int, bool]:
+        return _FaultView(
+            lambda id_: bool(self._decomposed[id_]), lambda: self.ids, self._has_id
+        )
+
+    @property
+    def primitives(self) -> list[int]:
+        return list(self._prim_order)
+
+    @property
+    def num_detectors(self) -> int:
+        """Number of detectors, i.e. the largest detector id plus one."""
+        return int(self._det_ind[: self._det_ptr[self._num_faults]].max(initial=-1)) + 1
+
+    @property
+    def num_observables(self) -> int:
+        """Number of logical observables, i.e. the largest logical id plus one."""
+        return int(self._log_ind[: self._log_ptr[self._num_faults]].max(initial=-1)) + 1
+
+    def check_matrix(self) -> sparse.csc_matrix:
+        """Returns the detector check matrix, whose element ``(d, i)`` is 1
+        if fault ``i`` triggers detector ``d``. It has shape
+        ``(num_detectors, num_faults)``.
+
+        The matrix shares memory with the DEM, it is cached and it is rebuilt
+        only when faults are added. It must not be modified.
+        """
+        return self._get_matrices()[0]
+
+    def observables_matrix(self) -> sparse.csc_matrix:
+        """Returns the observables matrix, whose element ``(l, i)`` is 1
+        if fault ``i`` flips logical observable ``l``. It has shape
+        ``(num_observables, num_faults)``.
+
+        The matrix shares memory with the DEM, it is cached and it is rebuilt
+        only when faults are added. It must not be modified.
+        """
+        return self._get_matrices()[1]
+
+    def priors(self) -> np.ndarray:
+        """Returns a read-only view of the probabilities of the faults,
+        following the same order as the columns of ``check_matrix``."""
+        priors = self._probs[: self._num_faults].view()
+        priors.flags.writeable = False
+        return priors
+
+    def _get_matrices(self) -> tuple[sparse.csc_matrix, sparse.csc_matrix]:
+        if self._matrices is not None:
+            return self._matrices
+
+        # imported here because scipy is slow to import
+        import scipy.sparse as sparse
+
+        matrices = []
+        for ptr, ind, num_rows in [
+            (self._det_ptr, self._det_ind, self.num_detectors),
+            (self._log_ptr, self._log_ind, self.num_observables),
+        ]:
+            ptr = ptr[: self._num_faults + 1]
+            ind = ind[: ptr[-1]]
+            # the arrays are assigned directly because the constructor of
+            # 'csc_matrix' would copy them to downcast the indices to int32
+            matrix = sparse.csc_matrix((num_rows, self._num_faults), dtype=np.uint8)
+            matrix.data = np.ones(len(ind), dtype=np.uint8)
+            matrix.indices, matrix.indptr = ind, ptr
+            matrices.append(matrix)
+
+        self._matrices = tuple(matrices)
+        return self._matrices
+
+    def _has_id(self, id_: object) -> bool:
+        return isinstance(id_, (int, np.integer)) and 0 <= id_ < self._num_faults
+
+    def _get_prob(self, id_: int) -> float:
+        return float(self._probs[id_])
+
+    def _get_detectors(self, id_: int) -> tuple[int, ...]:
+        return tuple(
+            self._det_ind[self._det_ptr[id_] : self._det_ptr[id_ + 1]].tolist()
+        )
+
+    def _get_logicals(self, id_: int) -> tuple[int, ...]:
+        return tuple(
+            self._log_ind[self._log_ptr[id_] : self._log_ptr[id_ + 1]].tolist()
+        )
+
+    def _get_prim_sets(self, id_: int) -> tuple[DetectorSet, DetectorSet]:
+        """Returns the detectors and logicals of a primitive fault."""
+        prim_sets = self._prim_sets.get(id_)
+        if prim_sets is None:
+            prim_sets = (
+                DetectorSet(self._det_ind[self._det_ptr[id_] : self._det_ptr[id_ + 1]]),
+                DetectorSet(self._log_ind[self._log_ptr[id_] : self._log_ptr[id_ + 1]]),
+            )
+            self._prim_sets[id_] = prim_sets
+        return prim_sets
+
+    def _get_decomposition(self, id_: int) -> tuple[int, ...]:
+        return tuple(self._decom[id_, : self._decom_len[id_]].tolist())
+
+    def _get_weights(self) -> np.ndarray:
+        """Returns the number of detectors triggered by each fault."""
+        return np.diff(self._det_ptr[: self._num_faults + 1])
+
+    def _append(self, prob: float, dets: tuple[int, ...], logs: tuple[int, ...]) -> int:
+        """Appends a new fault without performing any check."""
+        id_ = self._num_faults
+        num_dets, num_logs = self._det_ptr[id_], self._log_ptr[id_]
+
+        self._probs = _enlarge(self._probs, id_ + 1)
+        self._det_ptr = _enlarge(self._det_ptr, id_ + 2)
+        self._log_ptr = _enlarge(self._log_ptr, id_ + 2)
+        self._det_ind = _enlarge(self._det_ind, num_dets + len(dets))
+        self._log_ind = _enlarge(self._log_ind, num_logs + len(logs))
+        self._primitive = _enlarge(self._primitive, id_ + 1)
+        self._decomposed = _enlarge(self._decomposed, id_ + 1)
+        self._decom = _enlarge(self._decom, id_ + 1, fill=-1)
+        self._decom_len = _enlarge(self._decom_len, id_ + 1, fill=-1)
+
+        self._matrices = None
+        self._probs[id_] = prob
+        self._det_ind[num_dets : num_dets + len(dets)] = dets
+        self._det_ptr[id_ + 1] = num_dets + len(dets)
+        self._log_ind[num_logs : num_logs + len(logs)] = logs
+        self._log_ptr[id_ + 1] = num_logs + len(logs)
+        self._primitive[id_] = False
+        self._decomposed[id_] = False
+        self._decom_len[id_] = -1
+
+        self.det_to_id[dets] = id_
+        self._det_index = None
+        if self._dirty is not None:
+            self._dirty.add(id_)
+        self._num_faults += 1
+        return id_
+
     def add_fault(self, prob: float | int, dets: Iterable, logs: Iterable) -> int:
         """Adds a fault (or error mechanism) to the DEM.
 
@@ -49,24 +427,417 @@ class DEM:
 
         # check existance of same faults
         if (same_id := self.det_to_id.get(dets)) is not None:
-            if self.logicals[same_id] != logs:
+            if self._get_logicals(same_id) != logs:
                 raise ValueError(
                     "A fault in this DEM triggers the same detectors "
                     f"but has different logical effect, id={same_id}"
                 )
             else:
-                self.probs[same_id] = xor_two_probs(self.probs[same_id], prob)
+                self._probs[same_id] = xor_two_probs(self._probs[same_id], prob)
+                if self._dirty is not None:
+                    self._dirty.add(same_id)
                 return same_id
 
         # create new fault with a new id
-        id_ = len(self.ids)
-        self.ids.append(id_)
-        self.probs[id_] = prob
-        self.detectors[id_] = dets
-        self.logicals[id_] = logs
-        self.det_to_id[dets] = id_
-        self.decomposed[id_] = False
-        return id_
+        return self._append(prob, dets, logs)
+
+    def add_faults(
+        self,
+        probs: Iterable[float],
+        dets: Iterable[Iterable[int]],
+        logs: Iterable[Iterable[int]],
+    ) -> np.ndarray:
+        """Adds several faults (or error mechanisms) to the DEM at once.
+        The result is the same as calling ``add_fault`` for each fault.
+
+        Parameters
+        ----------
+        probs
+            Probabilities of the faults.
+        dets
+            Detectors triggered by each fault.
+        logs
+            Logical observables flipped by each fault.
+
+        Returns
+        -------
+        ids
+            Fault id of each of the given faults.
+        """
+        det_ptr, det_ind = _ragged_to_csr(dets)
+        log_ptr, log_ind = _ragged_to_csr(logs)
+        return self._add_faults_csr(probs, det_ptr, det_ind, log_ptr, log_ind)
+
+    def set_probs(self, ids: Iterable[int], probs: Iterable[float]) -> None:
+        """Sets the probabilities of the given faults, e.g. after
+        recalibrating some noise channels. The faults keep their decompositions.
+
+        Parameters
+        ----------
+        ids
+            Fault ids.
+        probs
+            New probability of each fault.
+        """
+        ids = self._get_ids_array(ids)
+        probs = np.fromiter(probs, dtype=np.float64)
+        if probs.shape != ids.shape:
+            raise ValueError(
+                f"'probs' must have {len(ids)} elements, not {len(probs)}."
+            )
+        if ((probs > 1) | (probs < 0) | np.isnan(probs)).any():
+            bad_prob = probs[~((probs <= 1) & (probs >= 0))][0]
+            raise ValueError(f"Probabilities must be inside [0,1], not {bad_prob}.")
+
+        self._probs[ids] = probs
+        if self._dirty is not None:
+            self._dirty.update(ids.tolist())
+        return
+
+    def remove_faults(self, ids: Iterable[int]) -> np.ndarray:
+        """Removes the given faults from the DEM. The other faults keep their
+        order, but their ids change. The decompositions that contain
+        a removed fault are removed.
+
+        Parameters
+        ----------
+        ids
+            Fault ids.
+
+        Returns
+        -------
+        new_ids
+            New id of each fault of the DEM before the removal,
+            or -1 if it has been removed.
+        """
+        ids = self._get_ids_array(ids)
+        num_faults = self._num_faults
+        keep = np.ones(num_faults, dtype=bool)
+        keep[ids] = False
+        rows = np.flatnonzero(keep)
+        new_ids = np.full(num_faults, -1, dtype=np.int64)
+        new_ids[rows] = np.arange(len(rows))
+
+        decom = self._decom[:num_faults]
+        valid = decom >= 0
+        new_decom = np.where(valid, new_ids[np.where(valid, decom, 0)], -1)
+        broken = (valid & (new_decom == -1)).any(axis=1)
+        new_decom[broken] = -1
+        decom_len = np.where(broken, -1, self._decom_len[:num_faults])
+        decomposed = self._decomposed[:num_faults] & ~broken
+
+        self._probs = self._probs[rows]
+        self._det_ptr, self._det_ind = _gather_csr(self._det_ptr, self._det_ind, rows)
+        self._log_ptr, self._log_ind = _gather_csr(self._log_ptr, self._log_ind, rows)
+        self._primitive = self._primitive[rows]
+        self._decomposed = decomposed[rows]
+        self._decom = new_decom[rows]
+        self._decom_len = decom_len[rows]
+        prim_order = new_ids[np.array(self._prim_order, dtype=np.int64)]
+        self._prim_order = prim_order[prim_order >= 0].tolist()
+        self._num_faults = len(rows)
+
+        self._matrices = None
+        self._det_to_id = None
+        self._prim_det_to_id = None
+        self._det_index = None
+        self._prim_sets = {}
+        if self._dirty is not None:
+            dirty = np.fromiter(self._dirty, dtype=np.int64, count=len(self._dirty))
+            dirty = np.concatenate([new_ids[dirty], new_ids[broken]])
+            self._dirty = set(dirty[dirty >= 0].tolist())
+
+        return new_ids
+
+    def _get_ids_array(self, ids: Iterable[int]) -> np.ndarray:
+        """Returns the given fault ids as an array, checking that they exist."""
+        if not isinstance(ids, np.ndarray):
+            ids = np.fromiter(ids, dtype=np.int64)
+        if ids.ndim != 1 or not np.issubdtype(ids.dtype, np.integer):
+            raise TypeError(f"'ids' must be a 1D array of integers.")
+        if ((ids < 0) | (ids >= self._num_faults)).any():
+            bad_id = ids[(ids < 0) | (ids >= self._num_faults)][0]
+            raise ValueError(f"'id={bad_id}' is not an id from this DEM.")
+        return ids.astype(np.int64)
+
+    @classmethod
+    def from_arrays(
+        cls,
+        probs: np.ndarray,
+        det_ptr: np.ndarray,
+        det_ind: np.ndarray,
+        log_ptr: np.ndarray,
+        log_ind: np.ndarray,
+    ) -> DEM:
+        """Returns a DEM built from the faults given in CSR format,
+        i.e. the detectors of fault ``i`` are ``det_ind[det_ptr[i]:det_ptr[i+1]]``.
+        Faults triggering the same detectors are merged as in ``add_fault``.
+
+        Parameters
+        ----------
+        probs
+            Probabilities of the faults.
+        det_ptr, det_ind
+            Detectors triggered by each fault in CSR format.
+        log_ptr, log_ind
+            Logical observables flipped by each fault in CSR format.
+
+        Returns
+        -------
+        dem
+            Detector error model with the given faults.
+        """
+        dem = cls()
+        dem._add_faults_csr(probs, det_ptr, det_ind, log_ptr, log_ind)
+        return dem
+
+    def _add_faults_csr(
+        self,
+        probs: np.ndarray,
+        det_ptr: np.ndarray,
+        det_ind: np.ndarray,
+        log_ptr: np.ndarray,
+        log_ind: np.ndarray,
+    ) -> np.ndarray:
+        """Adds the faults given in CSR format and returns their ids."""
+        probs = np.asarray(probs, dtype=np.float64)
+        det_ptr, det_ind = np.asarray(det_ptr), np.asarray(det_ind)
+        log_ptr, log_ind = np.asarray(log_ptr), np.asarray(log_ind)
+        num_faults = len(probs)
+
+        if probs.ndim != 1:
+            raise ValueError(f"'probs' must be a 1D array, not {probs.ndim}D.")
+        if ((probs > 1) | (probs < 0) | np.isnan(probs)).any():
+            bad_prob = probs[~((probs <= 1) & (probs >= 0))][0]
+            raise ValueError(f"Probabilities must be inside [0,1], not {bad_prob}.")
+        for name, ptr, ind in [("det", det_ptr, det_ind), ("log", log_ptr, log_ind)]:
+            if (
+                len(ptr) != num_faults + 1
+                or ptr[0] != 0
+                or ptr[-1] != len(ind)
+                or (np.diff(ptr) < 0).any()
+            ):
+                raise ValueError(
+                    f"'{name}_ptr' is not a valid CSR pointer for {num_faults} faults."
+                )
+        if num_faults == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        # prepare the detectors and logs
+        det_ptr, log_ptr = det_ptr.astype(np.int64), log_ptr.astype(np.int64)
+        det_ind = _sort_csr_rows(det_ptr, det_ind.astype(np.int64))
+        log_ind = _sort_csr_rows(log_ptr, log_ind.astype(np.int64))
+        log_matrix = _pad_csr(log_ptr, log_ind)
+
+        # group the faults with the same detectors (in order of appearance)
+        group, first = _group_rows(_pad_csr(det_ptr, det_ind))
+
+        # check existance of same faults
+        ids = np.full(len(first), -1, dtype=np.int64)
+        if self._num_faults != 0:
+            keys = _csr_to_tuples(*_gather_csr(det_ptr, det_ind, first))
+            ids[:] = [self.det_to_id.get(k, -1) for k in keys]
+        existing = ids >= 0
+        ids[~existing] = self._num_faults + np.arange(np.sum(~existing))
+
+        mismatch = (log_matrix != log_matrix[first[group]]).any(axis=1)
+        if existing.any():
+            old_ptr, old_ind = _gather_csr(self._log_ptr, self._log_ind, ids[existing])
+            width = max(log_matrix.shape[1], int(np.diff(old_ptr).max(initial=0)))
+            old_matrix = _pad_csr(old_ptr, old_ind, width=width)
+            new_matrix = np.full((len(old_matrix), width), -1, dtype=np.int64)
+            new_matrix[:, : log_matrix.shape[1]] = log_matrix[first[existing]]
+            mismatch_old = np.zeros(len(first), dtype=bool)
+            mismatch_old[existing] = (old_matrix != new_matrix).any(axis=1)
+            mismatch |= mismatch_old[group]
+        if mismatch.any():
+            same_id = ids[group[np.argmax(mismatch)]]
+            raise ValueError(
+                "A fault in this DEM triggers the same detectors "
+                f"but has different logical effect, id={same_id}"
+            )
+
+        # merge the probabilities of the same faults, keeping the same order
+        # of operations as in 'add_fault' (note that 'xor_two_probs(0, p) = p')
+        group_probs = np.zeros(len(first), dtype=np.float64)
+        group_probs[existing] = self._probs[ids[existing]]
+        group_probs = scatter_xor_probs(group_probs, group, probs)
+
+        # update existing faults and create new faults with new ids
+        self._probs[ids[existing]] = group_probs[existing]
+        if self._dirty is not None:
+            self._dirty.update(ids[existing].tolist())
+        new_faults = first[~existing]
+        new_det_ptr, new_det_ind = _gather_csr(det_ptr, det_ind, new_faults)
+        new_log_ptr, new_log_ind = _gather_csr(log_ptr, log_ind, new_faults)
+        self._extend(
+            group_probs[~existing],
+            new_det_ptr,
+            new_det_ind,
+            new_log_ptr,
+            new_log_ind,
+        )
+
+        return ids[group]
+
+    def _extend(
+        self,
+        probs: np.ndarray,
+        det_ptr: np.ndarray,
+        det_ind: np.ndarray,
+        log_ptr: np.ndarray,
+        log_ind: np.ndarray,
+    ) -> None:
+        """Appends new faults given in CSR format without performing any check."""
+        start = self._num_faults
+        end = start + len(probs)
+        num_dets, num_logs = self._det_ptr[start], self._log_ptr[start]
+
+        self._probs = _enlarge(self._probs, end)
+        self._det_ptr = _enlarge(self._det_ptr, end + 1)
+        self._log_ptr = _enlarge(self._log_ptr, end + 1)
+        self._det_ind = _enlarge(self._det_ind, num_dets + len(det_ind))
+        self._log_ind = _enlarge(self._log_ind, num_logs + len(log_ind))
+        self._primitive = _enlarge(self._primitive, end)
+        self._decomposed = _enlarge(self._decomposed, end)
+        self._decom = _enlarge(self._decom, end, fill=-1)
+        self._decom_len = _enlarge(self._decom_len, end, fill=-1)
+
+        self._matrices = None
+        self._probs[start:end] = probs
+        self._det_ind[num_dets : num_dets + len(det_ind)] = det_ind
+        self._det_ptr[start + 1 : end + 1] = num_dets + det_ptr[1:]
+        self._log_ind[num_logs : num_logs + len(log_ind)] = log_ind
+        self._log_ptr[start + 1 : end + 1] = num_logs + log_ptr[1:]
+        self._primitive[start:end] = False
+        self._decomposed[start:end] = False
+        self._decom_len[start:end] = -1
+
+        if self._det_to_id is not None:
+            keys = _csr_to_tuples(det_ptr, det_ind)
+            self._det_to_id.update(zip(keys, range(start, end)))
+        self._det_index = None
+        if self._dirty is not None:
+            self._dirty.update(range(start, end))
+        self._num_faults = end
+        return
+
+    def save(self, file_name: str | pathlib.Path) -> None:
+        """Stores the DEM in a binary file that can be loaded with ``DEM.load``.
+
+        The file contains a versioned header and the fault arrays
+        (probabilities, detectors and logicals in CSR format, primitive and
+        decomposed flags and the decomposition table).
+
+        Parameters
+        ----------
+        file_name
+            Name of the file.
+        """
+        arrays = self._get_arrays()
+        header = {"num_faults": self._num_faults, "arrays": []}
+        offset = 0
+        for name, array in arrays.items():
+            header["arrays"].append(
+                {
+                    "name": name,
+                    "dtype": array.dtype.str,
+                    "shape": list(array.shape),
+                    "offset": offset,
+                }
+            )
+            offset += _align(array.nbytes)
+        header = json.dumps(header).encode("utf-8")
+
+        with open(file_name, "wb") as file:
+            file.write(_FILE_MAGIC)
+            file.write(struct.pack("<II", _FILE_VERSION, len(header)))
+            file.write(header)
+            file.write(b"\0" * (_align(file.tell()) - file.tell()))
+            for array in arrays.values():
+                file.write(np.ascontiguousarray(array).data)
+                file.write(b"\0" * (_align(array.nbytes) - array.nbytes))
+
+        return
+
+    @classmethod
+    def load(cls, file_name: str | pathlib.Path, mmap_mode: str | None = "r") -> DEM:
+        """Loads a DEM stored with ``DEM.save``.
+
+        Parameters
+        ----------
+        file_name
+            Name of the file.
+        mmap_mode
+            If not ``None``, the arrays are memory-mapped from the file
+            with the given mode (see ``numpy.memmap``), so that several
+            processes can share the same DEM. With ``"r"``, the DEM is
+            read-only. With ``"c"``, the DEM can be modified and the changes
+            are not written to the file. If ``None``, the arrays are read
+            into memory.
+
+        Returns
+        -------
+        dem
+            Loaded detector error model.
+        """
+        with open(file_name, "rb") as file:
+            magic = file.read(len(_FILE_MAGIC))
+            if magic != _FILE_MAGIC:
+                raise ValueError(f"'{file_name}' is not a file created by 'DEM.save'.")
+            version, header_length = struct.unpack("<II", file.read(8))
+            if version != _FILE_VERSION:
+                raise ValueError(
+                    f"File format version {version} is not supported, "
+                    f"only version {_FILE_VERSION} is."
+                )
+            header = json.loads(file.read(header_length).decode("utf-8"))
+            data_start = _align(file.tell())
+
+            if mmap_mode is None:
+                file.seek(0)
+                buffer = np.frombuffer(file.read(), dtype=np.uint8)
+            else:
+                buffer = np.memmap(file, dtype=np.uint8, mode=mmap_mode)
+
+        arrays = {}
+        for info in header["arrays"]:
+            dtype = np.dtype(info["dtype"])
+            start = data_start + info["offset"]
+            num_bytes = int(np.prod(info["shape"])) * dtype.itemsize
+            array = buffer[start : start + num_bytes].view(dtype)
+            arrays[info["name"]] = array.reshape(info["shape"])
+
+        dem = cls()
+        dem._num_faults = header["num_faults"]
+        dem._probs = arrays["probs"]
+        dem._det_ptr = arrays["det_ptr"]
+        dem._det_ind = arrays["det_ind"]
+        dem._log_ptr = arrays["log_ptr"]
+        dem._log_ind = arrays["log_ind"]
+        dem._primitive = arrays["primitive"]
+        dem._decomposed = arrays["decomposed"]
+        dem._decom = arrays["decom"]
+        dem._decom_len = arrays["decom_len"]
+        dem._prim_order = arrays["prim_order"].tolist()
+        return dem
+
+    def _get_arrays(self) -> dict[str, np.ndarray]:
+        """Returns the arrays storing the faults, without the extra capacity."""
+        num_faults = self._num_faults
+        width = max(int(self._decom_len[:num_faults].max(initial=0)), 1)
+        return {
+            "probs": self._probs[:num_faults],
+            "det_ptr": self._det_ptr[: num_faults + 1],
+            "det_ind": self._det_ind[: self._det_ptr[num_faults]],
+            "log_ptr": self._log_ptr[: num_faults + 1],
+            "log_ind": self._log_ind[: self._log_ptr[num_faults]],
+            "primitive": self._primitive[:num_faults],
+            "decomposed": self._decomposed[:num_faults],
+            "decom": self._decom[:num_faults, :width],
+            "decom_len": self._decom_len[:num_faults],
+            "prim_order": np.array(self._prim_order, dtype=np.int64),
+        }
 
     def set_as_primitive(self, id_: int) -> None:
         """Flags a fault (or error mechanism) as primitive, meaning that
@@ -77,22 +848,50 @@ class DEM:
         id_
             Fault id.
         """
-        if id_ not in self.ids:
+        if not self._has_id(id_):
             raise ValueError(f"'id={id_}' is not an id from this DEM.")
-        if len(self.detectors[id_]) > 2:
+        if self._det_ptr[id_ + 1] - self._det_ptr[id_] > 2:
+            raise ValueError(f"Primitive faults must have weight-2 or less.")
+
+        if not self._primitive[id_]:
+            self._primitive[id_] = True
+            self._prim_order.append(int(id_))
+            if self._prim_det_to_id is not None:
+                self._prim_det_to_id[self._get_detectors(id_)] = int(id_)
+            self._decomposed[id_] = True
+
+        return
+
+    def set_as_primitives(self, ids: Iterable[int]) -> None:
+        """Flags several faults as primitive at once.
+        The result is the same as calling ``set_as_primitive`` for each fault.
+
+        Parameters
+        ----------
+        ids
+            Fault ids.
+        """
+        ids = self._get_ids_array(ids)
+        if ((self._det_ptr[ids + 1] - self._det_ptr[ids]) > 2).any():
             raise ValueError(f"Primitive faults must have weight-2 or less.")
 
-        if id_ not in self.primitives:
-            self.primitives.append(id_)
-            detectors = self.detectors[id_]
-            self.prim_det_to_id[detectors] = id_
-            self.decomposed[id_] = True
+        # keep the order of the first appearance of the new primitive faults
+        ids = ids[~self._primitive[ids]].astype(np.int64)
+        _, first = np.unique(ids, return_index=True)
+        ids = ids[np.sort(first)]
+
+        self._primitive[ids] = True
+        self._decomposed[ids] = True
+        self._prim_order += ids.tolist()
+        if self._prim_det_to_id is not None:
+            keys = _csr_to_tuples(*_gather_csr(self._det_ptr, self._det_ind, ids))
+            self._prim_det_to_id.update(zip(keys, ids.tolist()))
 
         return
 
     def is_primitive(self, id_: int) -> bool:
         """Returns if fault is primitive."""
-        return id_ in self.primitives
+        return self._has_id(id_) and bool(self._primitive[id_])
 
     def add_decomposition(
         self,
@@ -116,9 +915,9 @@ class DEM:
             If True, sets the given decomposition even if the speficied fault
             already had a decomposition.
         """
-        if id_ not in self.ids:
+        if not self._has_id(id_):
             raise ValueError(f"'id={id_}' is not an id from this DEM.")
-        if self.decomposed[id_] and (not override):
+        if self._decomposed[id_] and (not override):
             raise ValueError(
                 f"'id={id_}' already has a decomposition (use 'override')."
             )
@@ -126,98 +925,351 @@ class DEM:
             raise TypeError(
                 f"'decomposition' must be iterable, but {type(decomposition)} was given."
             )
-        if any([not self.is_primitive(i) for i in decomposition]):
+        decomposition = tuple(decomposition)
+        # the faults in '_prim_sets' are primitive
+        prim_sets = self._prim_sets
+        if not all([i in prim_sets or self.is_primitive(i) for i in decomposition]):
             raise ValueError(
                 "All elements in the decomposition must be primitive faults, "
                 f"but {decomposition} were given."
             )
-        if self.is_primitive(id_):
+        if self._primitive[id_]:
             raise ValueError(f"Cannot add decomposition to primitive fault id={id_}.")
 
-        h_dets = self.detectors[id_]
-        h_logs = self.logicals[id_]
-        e_dets = tuple(self.detectors[i] for i in decomposition)
-        e_logs = tuple(self.logicals[i] for i in decomposition)
-
-        if xor_lists(*e_dets) != h_dets:
+        # the hyperedge and its decomposition cancel out if they are equivalent
+        prim_sets = [self._get_prim_sets(i) for i in decomposition]
+        h_dets = self._det_ind[self._det_ptr[id_] : self._det_ptr[id_ + 1]]
+        if DetectorSet.xor_many([h_dets] + [dets for dets, _ in prim_sets]):
+            e_dets = [dets.to_tuple() for dets, _ in prim_sets]
             raise ValueError(
                 "Decomposition has different detectors than hyperedge"
-                f"\nhyperedge({id_})={h_dets}\ndecomposition({decomposition})={xor_lists(*e_dets)}"
+                f"\nhyperedge({id_})={self._get_detectors(id_)}"
+                f"\ndecomposition({decomposition})={xor_lists(*e_dets)}"
             )
 
-        if xor_lists(*e_logs) != h_logs:
+        h_logs = self._log_ind[self._log_ptr[id_] : self._log_ptr[id_ + 1]]
+        if DetectorSet.xor_many([h_logs] + [logs for _, logs in prim_sets]):
             if not ignore_logical_error:
+                e_logs = [logs.to_tuple() for _, logs in prim_sets]
                 raise ValueError(
                     "Decomposition has a different logical effect than hyperedge"
-                    f"\nhyperedge({id_})={h_logs}\ndecomposition({decomposition})={xor_lists(*e_logs)}"
+                    f"\nhyperedge({id_})={self._get_logicals(id_)}"
+                    f"\ndecomposition({decomposition})={xor_lists(*e_logs)}"
                 )
 
             warnings.warn(
                 f"The logical effect of fault id={id_} is different "
                 f"than its decomposition: {decomposition}"
             )
-            self.decomposed[id_] = True
+            self._decom_len[id_] = -1
+            self._decomposed[id_] = True
             return
 
         # add decomposition
-        self.decompositions[id_] = tuple(decomposition)
-        self.decomposed[id_] = True
+        if len(decomposition) > self._decom.shape[1]:
+            width = max(len(decomposition), 2 * self._decom.shape[1])
+            table = np.full((len(self._decom), width), -1, dtype=np.int64)
+            table[:, : self._decom.shape[1]] = self._decom
+            self._decom = table
+        self._decom[id_] = -1
+        self._decom[id_, : len(decomposition)] = decomposition
+        self._decom_len[id_] = len(decomposition)
+        self._decomposed[id_] = True
         return
 
     def get_primitive_graph(self) -> DEM:
         """Returns a DEM containing only the primitive faults with
         their corresponding probabilities."""
+        rows = np.array(self._prim_order, dtype=np.int64)
+        num_faults = len(rows)
+
         dem = DEM()
-        for id_ in self.primitives:
-            new_id = dem.add_fault(
-                self.probs[id_], self.detectors[id_], self.logicals[id_]
-            )
-            dem.set_as_primitive(new_id)
+        dem._num_faults = num_faults
+        dem._probs = self._probs[rows]
+        dem._det_ptr, dem._det_ind = _gather_csr(self._det_ptr, self._det_ind, rows)
+        dem._log_ptr, dem._log_ind = _gather_csr(self._log_ptr, self._log_ind, rows)
+        dem._primitive = np.ones(num_faults, dtype=bool)
+        dem._decomposed = np.ones(num_faults, dtype=bool)
+        dem._decom = np.full((num_faults, 2), -1, dtype=np.int64)
+        dem._decom_len = np.full(num_faults, -1, dtype=np.int64)
+        dem._prim_order = list(range(num_faults))
         return dem
 
-    def get_decomposed_dem(self) -> DEM:
+    def get_logical_augmented_dem(self, num_detectors: int | None = None) -> DEM:
+        """Returns a DEM with the same faults but in which the logical
+        observables have been transformed to detectors, i.e. logical ``l``
+        corresponds to detector ``num_detectors + l``.
+
+        Parameters
+        ----------
+        num_detectors
+            Offset for the ids of the logical observables.
+            By default, it is ``self.num_detectors``.
+        """
+        if num_detectors is None:
+            num_detectors = self.num_detectors
+
+        det_ptr = self._det_ptr[: self._num_faults + 1]
+        log_ptr = self._log_ptr[: self._num_faults + 1]
+        det_lengths, log_lengths = np.diff(det_ptr), np.diff(log_ptr)
+        ptr = det_ptr + log_ptr
+
+        ind = np.empty(ptr[-1], dtype=np.int64)
+        det_pos = np.repeat(ptr[:-1] - det_ptr[:-1], det_lengths)
+        ind[det_pos + np.arange(det_ptr[-1])] = self._det_ind[: det_ptr[-1]]
+        log_pos = np.repeat(ptr[:-1] + det_lengths - log_ptr[:-1], log_lengths)
+        ind[log_pos + np.arange(log_ptr[-1])] = (
+            self._log_ind[: log_ptr[-1]] + num_detectors
+        )
+
+        return DEM.from_arrays(
+            self._probs[: self._num_faults],
+            ptr,
+            ind,
+            np.zeros(self._num_faults + 1, dtype=np.int64),
+            np.zeros(0, dtype=np.int64),
+        )
+
+    def get_decomposed_dem(self, probs: np.ndarray | None = None) -> DEM:
         """Returns a DEM containing only the primitive faults with their
-        probabilities updated from the hyperedges."""
+        probabilities updated from the hyperedges.
+
+        Parameters
+        ----------
+        probs
+            Probabilities of the faults of this DEM to use instead of
+            the stored ones, with shape ``(num_faults,)``.
+        """
+        if (probs is not None) and np.ndim(probs) != 1:
+            raise ValueError(f"'probs' must be a 1D array, not {np.ndim(probs)}D.")
+
+        dem = self.get_primitive_graph()
+        dem._probs = self.get_decomposed_probs(probs)
+        return dem
+
+    def get_decomposed_probs(self, probs: np.ndarray | None = None) -> np.ndarray:
+        """Returns the probabilities of the faults in ``get_decomposed_dem``,
+        i.e. of the primitive faults (following the order in ``primitives``)
+        updated from the hyperedges.
+
+        Parameters
+        ----------
+        probs
+            Probabilities of the faults of this DEM to use instead of
+            the stored ones. It can have shape ``(num_faults,)`` or
+            ``(num_sweeps, num_faults)`` to process several probability
+            vectors with the same decompositions at once.
+
+        Returns
+        -------
+        decomposed_probs
+            Array of shape ``(len(primitives),)`` or ``(num_sweeps, len(primitives))``.
+        """
         if len(self.get_undecomposed_faults()) != 0:
             raise ValueError(
                 "There are some undecomposed hyperedges (use 'get_undecomposed_faults')."
             )
+        if probs is None:
+            probs = self._probs[: self._num_faults]
+        probs = np.asarray(probs, dtype=np.float64)
+        if probs.ndim not in [1, 2] or probs.shape[-1] != self._num_faults:
+            raise ValueError(
+                "'probs' must have shape (num_faults,) or (num_sweeps, num_faults), "
+                f"but {probs.shape} was given."
+            )
+        if ((probs > 1) | (probs < 0)).any():
+            raise ValueError("Probabilities must be inside [0,1].")
 
-        dem = self.get_primitive_graph()
-        for id_ in self.ids:
-            if id_ in self.primitives:
-                continue
+        hyperedges = np.flatnonzero(~self._primitive[: self._num_faults])
+        lengths = self._decom_len[hyperedges]
+        if (lengths < 0).any():
+            id_ = hyperedges[np.argmax(lengths < 0)]
+            raise ValueError(f"Fault id={id_} does not have a decomposition.")
+
+        # the faults in the primitive graph follow the order of 'self.primitives'
+        prim_inds = np.full(self._num_faults, -1, dtype=np.int64)
+        prim_inds[self._prim_order] = np.arange(len(self._prim_order))
+
+        # scatter the probability of each hyperedge to its decomposition
+        # following the same order as adding them one by one
+        table = self._decom[hyperedges]
+        mask = np.arange(table.shape[1]) < lengths[:, None]
+        targets = prim_inds[table[mask]]
+        values = np.repeat(probs[..., hyperedges], lengths, axis=-1)
+
+        prim_probs = probs[..., self._prim_order]
+        return scatter_xor_probs(prim_probs, targets, values)
+
+    def to_matching(self) -> Matching:
+        """Returns the MWPM decoder of the decomposed DEM, i.e. the same as
+        ``Matching(from_dem_to_stim(dem.get_decomposed_dem()))``, but built
+        directly from the arrays of the DEM."""
+        rows = np.array(self._prim_order, dtype=np.int64)
+        return _get_matching(
+            self.get_decomposed_probs(),
+            *_gather_csr(self._det_ptr, self._det_ind, rows),
+            *_gather_csr(self._log_ptr, self._log_ind, rows),
+            num_detectors=self.num_detectors,
+            num_observables=self.num_observables,
+        )
+
+    def primitive_matching(self, label_faults: bool = False) -> Matching:
+        """Returns the MWPM decoder of the primitive faults with their
+        probabilities, built directly from the arrays of the DEM.
+
+        Parameters
+        ----------
+        label_faults
+            If True, the observable of each edge is the position of its fault
+            in ``primitives`` (i.e. its id in ``get_primitive_graph``) instead
+            of its logical observables, so that the faults used in the matching
+            are given by the predicted observables.
+        """
+        rows = np.array(self._prim_order, dtype=np.int64)
+        if label_faults:
+            log_ptr, log_ind = np.arange(len(rows) + 1), np.arange(len(rows))
+            num_observables = len(rows)
+        else:
+            log_ptr, log_ind = _gather_csr(self._log_ptr, self._log_ind, rows)
+            num_observables = self.num_observables
+        return _get_matching(
+            self._probs[rows],
+            *_gather_csr(self._det_ptr, self._det_ind, rows),
+            log_ptr,
+            log_ind,
+            num_detectors=self.num_detectors,
+            num_observables=num_observables,
+        )
+
+    def primitives_cover_detectors(self) -> bool:
+        """Returns if every detector triggered by a fault of the DEM
+        is triggered by a primitive fault."""
+        rows = np.array(self._prim_order, dtype=np.int64)
+        _, prim_dets = _gather_csr(self._det_ptr, self._det_ind, rows)
+        covered = np.zeros(self.num_detectors, dtype=bool)
+        covered[prim_dets] = True
+        return bool(covered[self._det_ind[: self._det_ptr[self._num_faults]]].all())
 
-            for i in self.decompositions[id_]:
-                prob = self.probs[id_]
-                dets = self.detectors[i]
-                logs = self.logicals[i]
-                dem.add_fault(prob, dets, logs)
+    def get_faults_of_detectors(self, dets: Iterable[int]) -> np.ndarray:
+        """Returns the (sorted) ids of the faults that trigger any of the given
+        detectors. The index from the detectors to the faults is built on
+        first use and rebuilt only when faults are added or removed."""
+        ptr, ind = self._get_detector_index()
+        dets = np.fromiter(dets, dtype=np.int64)
+        dets = dets[(dets >= 0) & (dets < len(ptr) - 1)]
+        faults = np.sort(_gather_csr(ptr, ind, dets)[1])
+        return faults[np.r_[True, faults[1:] != faults[:-1]][: len(faults)]]
 
+    def _get_detector_index(self) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the CSR arrays (``ptr``, ``ind``) of the faults
+        triggering each detector."""
+        if self._det_index is not None:
+            return self._det_index
+
+        det_ptr = self._det_ptr[: self._num_faults + 1]
+        det_ind = self._det_ind[: det_ptr[-1]]
+        faults = np.repeat(np.arange(self._num_faults), np.diff(det_ptr))
+        order = np.argsort(det_ind, kind="stable")
+        ptr = np.zeros(self.num_detectors + 1, dtype=np.int64)
+        np.cumsum(np.bincount(det_ind, minlength=len(ptr) - 1), out=ptr[1:])
+        self._det_index = (ptr, faults[order])
+        return self._det_index
+
+    def with_probs(self, probs: np.ndarray) -> DEM:
+        """Returns a copy of the DEM (including the primitive faults and
+        decompositions) in which the faults have the given probabilities.
+
+        Parameters
+        ----------
+        probs
+            Probabilities of the faults, with shape ``(num_faults,)``.
+        """
+        probs = np.array(probs, dtype=np.float64)
+        if probs.shape != (self._num_faults,):
+            raise ValueError(
+                f"'probs' must have shape ({self._num_faults},), not {probs.shape}."
+            )
+        if ((probs > 1) | (probs < 0)).any():
+            raise ValueError("Probabilities must be inside [0,1].")
+
+        num_dets = self._det_ptr[self._num_faults]
+        num_logs = self._log_ptr[self._num_faults]
+        dem = DEM()
+        dem._num_faults = self._num_faults
+        dem._probs = probs
+        dem._det_ptr = self._det_ptr[: self._num_faults + 1].copy()
+        dem._det_ind = self._det_ind[:num_dets].copy()
+        dem._log_ptr = self._log_ptr[: self._num_faults + 1].copy()
+        dem._log_ind = self._log_ind[:num_logs].copy()
+        dem._primitive = self._primitive[: self._num_faults].copy()
+        dem._decomposed = self._decomposed[: self._num_faults].copy()
+        dem._decom = self._decom[: self._num_faults].copy()
+        dem._decom_len = self._decom_len[: self._num_faults].copy()
+        dem._prim_order = list(self._prim_order)
         return dem
 
     def get_undecomposed_faults(self) -> list[int]:
         """Returns a list of faults ids for the undecomposed faults."""
-        faults = [k for k, v in self.decomposed.items() if not v]
-        return faults
+        return np.flatnonzero(~self._decomposed[: self._num_faults]).tolist()
 
     def is_matching_graph(self):
         """Returns if the decomposed DEM is a matching graph."""
-        for id_ in self.get_undecomposed_faults():
-            if len(self.detectors[id_]) > 2:
-                return False
-        return True
+        undecomposed = ~self._decomposed[: self._num_faults]
+        return not (undecomposed & (self._get_weights() > 2)).any()
 
     def get_info_fault(self, id_: int) -> dict[str, object]:
         """Returns a dictionary with all the data corresponding to the given fault."""
         data = {
             "id": id_,
-            "detectors": self.detectors[id_],
-            "logicals": self.logicals[id_],
-            "prob": self.probs[id_],
-            "is_primitive": id_ in self.primitives,
+            "detectors": self._get_detectors(id_),
+            "logicals": self._get_logicals(id_),
+            "prob": self._get_prob(id_),
+            "is_primitive": self.is_primitive(id_),
             "decomposition": (
-                self.decompositions[id_] if id_ in self.decompositions else None
+                self._get_decomposition(id_) if self._decom_len[id_] >= 0 else None
             ),
         }
         return data
+
+
+def _get_matching(
+    probs: np.ndarray,
+    det_ptr: np.ndarray,
+    det_ind: np.ndarray,
+    log_ptr: np.ndarray,
+    log_ind: np.ndarray,
+    num_detectors: int,
+    num_observables: int,
+) -> Matching:
+    """Returns the MWPM decoder whose edges are the given faults, with their
+    detectors and observables in CSR format. The faults with zero probability
+    or without detectors are not added, as when loading a stim DEM."""
+    # imported here because pymatching and scipy are slow to import
+    from pymatching import Matching
+    import scipy.sparse as sparse
+
+    lengths = np.diff(det_ptr)
+    if (lengths > 2).any():
+        raise ValueError(
+            "The faults of a matching graph must trigger at most two detectors."
+        )
+
+    weights = probs_to_weights(probs)
+    cols = np.flatnonzero(np.isfinite(weights) & (lengths > 0))
+    det_ptr, det_ind = _gather_csr(det_ptr, det_ind, cols)
+    log_ptr, log_ind = _gather_csr(log_ptr, log_ind, cols)
+    check_matrix = sparse.csc_matrix(
+        (np.ones(len(det_ind), dtype=np.uint8), det_ind, det_ptr),
+        shape=(num_detectors, len(cols)),
+    )
+    faults_matrix = sparse.csc_matrix(
+        (np.ones(len(log_ind), dtype=np.uint8), log_ind, log_ptr),
+        shape=(num_observables, len(cols)),
+    )
+    return Matching.from_check_matrix(
+        check_matrix,
+        weights=weights[cols],
+        error_probabilities=np.asarray(probs, dtype=np.float64)[cols],
+        faults_matrix=faults_matrix,
+        use_virtual_boundary_node=True,
+    )
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import pathlib
+import time
+import uuid
+
+import numpy as np
+import stim
+
+from .detector_error_model import DEM
+
+# changing the version invalidates all the stored results
+_CACHE_VERSION = 1
+_SUFFIXES = {".bin": DEM, ".dem": stim.DetectorErrorModel}
+# temporary files older than this (in seconds) are from interrupted writes
+_TMP_LIFETIME = 3600
+
+
+class DiskCache:
+    """Persistent cache of decomposed detector error models stored in
+    a directory, see ``decompose_dem``.
+
+    The results are stored in files named by a stable hash of the input
+    detector error model and the options that change the decomposition.
+    The files are written to a temporary file and then renamed, so that
+    several processes of the same machine can read and write the same cache.
+    When the size of the stored files exceeds ``max_bytes``, the least
+    recently used ones are deleted.
+
+    The number of hits, misses and evictions of this instance are stored
+    in ``num_hits``, ``num_misses`` and ``num_evictions``.
+    """
+
+    def __init__(self, directory: str | pathlib.Path, max_bytes: int = 2**30) -> None:
+        """Initializes the cache.
+
+        Parameters
+        ----------
+        directory
+            Directory in which to store the results. It is created
+            if it does not exist.
+        max_bytes
+            Maximum size of the stored results in bytes.
+        """
+        if not isinstance(directory, (str, pathlib.Path)):
+            raise TypeError(
+                "'directory' must be a str or pathlib.Path, "
+                f"but {type(directory)} was given."
+            )
+        if not isinstance(max_bytes, int) or max_bytes < 1:
+            raise ValueError(f"'max_bytes' must be a positive int, not {max_bytes}.")
+
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_evictions = 0
+        return
+
+    def get_key(self, dem: DEM | stim.DetectorErrorModel, **options) -> str:
+        """Returns the key of the given detector error model and options,
+        which is a hash of their contents."""
+        hasher = hashlib.sha256()
+        header = {"version": _CACHE_VERSION, "options": options}
+        if isinstance(dem, stim.DetectorErrorModel):
+            header["type"] = "stim"
+            hasher.update(json.dumps(header, sort_keys=True).encode("utf-8"))
+            hasher.update(str(dem).encode("utf-8"))
+        elif isinstance(dem, DEM):
+            header["type"] = "DEM"
+            hasher.update(json.dumps(header, sort_keys=True).encode("utf-8"))
+            for name, array in dem._get_arrays().items():
+                hasher.update(f"{name}:{array.dtype.str}:{array.shape}".encode())
+                hasher.update(np.ascontiguousarray(array).tobytes())
+        else:
+            raise TypeError(
+                "'dem' must be a DEM or stim.DetectorErrorModel, "
+                f"but {type(dem)} was given."
+            )
+        return hasher.hexdigest()
+
+    def get(self, key: str) -> DEM | stim.DetectorErrorModel | None:
+        """Returns the result stored for the given key, or ``None``
+        if it is not stored."""
+        for suffix, dem_type in _SUFFIXES.items():
+            path = self.directory / (key + suffix)
+            try:
+                if dem_type is DEM:
+                    value = DEM.load(path, mmap_mode=None)
+                else:
+                    value = stim.DetectorErrorModel.from_file(path)
+            except (FileNotFoundError, ValueError):
+                # the file may have been evicted by another process
+                continue
+
+            try:
+                os.utime(path)  # to keep track of the least recently used files
+            except OSError:
+                pass
+            self.num_hits += 1
+            return value
+
+        self.num_misses += 1
+        return None
+
+    def put(self, key: str, value: DEM | stim.DetectorErrorModel) -> None:
+        """Stores the result for the given key and evicts the least recently
+        used results if the size of the cache exceeds ``max_bytes``."""
+        if isinstance(value, DEM):
+            suffix = ".bin"
+        elif isinstance(value, stim.DetectorErrorModel):
+            suffix = ".dem"
+        else:
+            raise TypeError(
+                "'value' must be a DEM or stim.DetectorErrorModel, "
+                f"but {type(value)} was given."
+            )
+
+        tmp_path = self.directory / f".{key}.{uuid.uuid4().hex}.tmp"
+        try:
+            if suffix == ".bin":
+                value.save(tmp_path)
+            else:
+                value.to_file(tmp_path)
+            # the renaming is atomic, thus readers never see a partial file
+            os.replace(tmp_path, self.directory / (key + suffix))
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+        self._evict(keep=key + suffix)
+        return
+
+    def clear(self) -> None:
+        """Deletes all the stored results."""
+        for path, _, _ in self._get_files():
+            _remove(path)
+        return
+
+    def get_stats(self) -> dict[str, int]:
+        """Returns the number of hits, misses and evictions of this instance
+        and the number and size of the stored results."""
+        files = self._get_files()
+        return {
+            "num_hits": self.num_hits,
+            "num_misses": self.num_misses,
+            "num_evictions": self.num_evictions,
+            "size": len(files),
+            "num_bytes": sum(size for _, size, _ in files),
+        }
+
+    def _get_files(self) -> list[tuple[pathlib.Path, int, float]]:
+        """Returns the path, size and modification time of the stored results,
+        and removes the temporary files of interrupted writes."""
+        files = []
+        for entry in os.scandir(self.directory):
+            path = pathlib.Path(entry.path)
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if path.suffix == ".tmp" and time.time() - stat.st_mtime > _TMP_LIFETIME:
+                _remove(path)
+            elif path.suffix in _SUFFIXES and not path.name.startswith("."):
+                files.append((path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _evict(self, keep: str) -> None:
+        """Deletes the least recently used results, except ``keep``,
+        until the size of the cache is at most ``max_bytes``."""
+        files = sorted(self._get_files(), key=lambda f: f[2])
+        num_bytes = sum(size for _, size, _ in files)
+        for path, size, _ in files:
+            if num_bytes <= self.max_bytes:
+                break
+            if path.name == keep:
+                continue
+            if _remove(path):
+                self.num_evictions += 1
+            num_bytes -= size
+        return
+
+
+def _remove(path: pathlib.Path) -> bool:
+    """Removes the file and returns whether it existed."""
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        return False
+    return True
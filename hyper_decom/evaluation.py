@@ -0,0 +1,307 @@
+from __future__ import annotations
+from collections.abc import Callable, Mapping
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    ProcessPoolExecutor,
+    wait,
+)
+import math
+import os
+from statistics import NormalDist
+from typing import TYPE_CHECKING
+import uuid
+
+import numpy as np
+import stim
+
+from .detector_error_model import DEM, _gather_csr, _get_matching
+
+if TYPE_CHECKING:
+    from pymatching import Matching
+
+# samplers and MWPM decoders built by the initializer of the process pools
+# created in 'estimate_logical_error_rates', keyed by call
+_WORKER_EVALUATORS: dict[str, tuple[stim.Circuit, list[Matching]]] = {}
+
+
+def estimate_logical_error_rates(
+    circuit: stim.Circuit,
+    strategies: Mapping[str, DEM | stim.DetectorErrorModel | Callable],
+    max_shots: int = 1_000_000,
+    max_errors: int | None = None,
+    rel_precision: float | None = None,
+    confidence: float = 0.95,
+    chunk_size: int = 10_000,
+    workers: int | None = None,
+    executor: Executor | None = None,
+    seed: int | None = None,
+    progress: Callable[[dict[str, dict]], None] | None = None,
+) -> dict[str, dict]:
+    """Estimates the logical error rate of MWPM for each decomposition strategy
+    by sampling the circuit.
+
+    The shots are sampled and decoded in bit-packed chunks, so that they
+    are not stored in memory. Each chunk is decoded with the MWPM decoders of
+    all the strategies, which are built once per process (once per chunk
+    with ``executor``).
+
+    Parameters
+    ----------
+    circuit
+        Stim circuit to sample.
+    strategies
+        Dictionary of the decomposition strategies to compare. Each strategy is
+        a decomposed ``DEM``, a stim detector error model with decompositions
+        (e.g. from ``circuit.detector_error_model(decompose_errors=True)``) or
+        a function that takes the detector error model of the circuit and
+        returns one of them (e.g. ``decompose_dem``).
+    max_shots
+        Maximum number of shots.
+    max_errors
+        If given, the sampling stops when all the strategies have at least
+        this number of logical errors.
+    rel_precision
+        If given, the sampling stops when the half width of the confidence
+        interval of all the strategies is at most ``rel_precision`` times
+        their logical error rate.
+    confidence
+        Confidence level of the confidence intervals (Wilson score interval).
+    chunk_size
+        Number of shots of each chunk.
+    workers
+        If given, the chunks are sampled and decoded in parallel using
+        this number of processes.
+    executor
+        If given, the chunks are sampled and decoded in parallel using this
+        executor (e.g. a ``concurrent.futures.ProcessPoolExecutor``) instead
+        of creating a new process pool.
+    seed
+        Seed of the samplers. The seed of each chunk is derived from it, thus
+        the results do not depend on ``workers`` if ``max_shots`` is reached.
+    progress
+        If given, it is called with the current results after each chunk.
+
+    Returns
+    -------
+    results
+        Dictionary with the number of shots (``"num_shots"``), the number of
+        logical errors (``"num_errors"``), the logical error rate
+        (``"logical_error_rate"``) and its confidence interval
+        (``"confidence_interval"``) of each strategy.
+    """
+    if not isinstance(circuit, stim.Circuit):
+        raise TypeError(
+            f"'circuit' must be a stim.Circuit, but {type(circuit)} was given."
+        )
+    if not isinstance(strategies, Mapping) or len(strategies) == 0:
+        raise TypeError("'strategies' must be a non-empty dictionary.")
+    if not isinstance(max_shots, int) or max_shots < 1:
+        raise ValueError(f"'max_shots' must be a positive int, not {max_shots}.")
+    if not isinstance(chunk_size, int) or chunk_size < 1:
+        raise ValueError(f"'chunk_size' must be a positive int, not {chunk_size}.")
+    if not 0 < confidence < 1:
+        raise ValueError(f"'confidence' must be inside (0, 1), not {confidence}.")
+    if workers is not None and (not isinstance(workers, int) or workers < 1):
+        raise ValueError(f"'workers' must be a positive int, not {workers}.")
+    if executor is not None and not isinstance(executor, Executor):
+        raise TypeError(
+            f"'executor' must be a concurrent.futures.Executor, not {type(executor)}."
+        )
+
+    names = list(strategies)
+    dem = None
+    graphs = []
+    for strategy in strategies.values():
+        if callable(strategy):
+            if dem is None:
+                dem = circuit.detector_error_model()
+            strategy = strategy(dem)
+        graphs.append(_get_graph(strategy))
+    payload = (str(circuit), graphs)
+    key = uuid.uuid4().hex
+
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    results = {
+        name: {
+            "num_shots": 0,
+            "num_errors": 0,
+            "logical_error_rate": 0.0,
+            "confidence_interval": (0.0, 1.0),
+        }
+        for name in names
+    }
+
+    def update(num_shots: int, num_errors: list[int]) -> bool:
+        """Adds the counts of a chunk and returns if the sampling can stop."""
+        for name, errors in zip(names, num_errors):
+            result = results[name]
+            result["num_shots"] += num_shots
+            result["num_errors"] += errors
+            result["logical_error_rate"] = result["num_errors"] / result["num_shots"]
+            result["confidence_interval"] = _wilson_interval(
+                result["num_errors"], result["num_shots"], z
+            )
+        if progress is not None:
+            progress({name: dict(result) for name, result in results.items()})
+
+        stop = False
+        if max_errors is not None:
+            stop |= all(r["num_errors"] >= max_errors for r in results.values())
+        if rel_precision is not None:
+            stop |= all(
+                r["num_errors"] > 0
+                and (r["confidence_interval"][1] - r["confidence_interval"][0]) / 2
+                <= rel_precision * r["logical_error_rate"]
+                for r in results.values()
+            )
+        return stop
+
+    # each chunk has its own seed so that the samples do not depend on
+    # which process samples them
+    num_chunks = math.ceil(max_shots / chunk_size)
+    seeds = np.random.SeedSequence(seed).generate_state(num_chunks, dtype=np.uint64)
+    chunks = (
+        (int(seeds[k]), min(chunk_size, max_shots - k * chunk_size))
+        for k in range(num_chunks)
+    )
+
+    if workers is None and executor is None:
+        evaluator = _build_evaluator(payload)
+        for chunk_seed, num_shots in chunks:
+            if update(*_count_errors(evaluator, chunk_seed, num_shots)):
+                break
+        return results
+
+    if executor is None:
+        # the circuit and decoders are shipped once to each process
+        pool = ProcessPoolExecutor(
+            workers, initializer=_init_worker, initargs=(key, payload)
+        )
+        shipped = None
+    else:
+        # the circuit and decoders are built for each chunk, so that
+        # no state is shared between the calls using the same executor
+        pool, shipped = executor, payload
+
+    # a few chunks per worker are submitted at a time, so that the sampling
+    # can stop early and the pending results do not use memory
+    num_pending = 2 * (workers or os.cpu_count() or 1)
+    pending = set()
+    stop = False
+    try:
+        while True:
+            while not stop and len(pending) < num_pending:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                pending.add(pool.submit(_evaluate_chunk, key, shipped, *chunk))
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stop |= update(*future.result())
+            if stop:
+                pending = set(f for f in pending if not f.cancel())
+    finally:
+        if executor is None:
+            pool.shutdown(cancel_futures=True)
+
+    return results
+
+
+def _get_graph(strategy: DEM | stim.DetectorErrorModel) -> tuple:
+    """Returns the data to build the MWPM decoder of the given strategy
+    in another process."""
+    if isinstance(strategy, stim.DetectorErrorModel):
+        return ("stim", str(strategy))
+    if isinstance(strategy, DEM):
+        arrays = strategy._get_arrays()
+        rows = arrays["prim_order"]
+        return (
+            "dem",
+            strategy.get_decomposed_probs(),
+            *_gather_csr(arrays["det_ptr"], arrays["det_ind"], rows),
+            *_gather_csr(arrays["log_ptr"], arrays["log_ind"], rows),
+        )
+    raise TypeError(
+        "Each strategy must be a DEM, a stim.DetectorErrorModel or a function "
+        f"returning one of them, but {type(strategy)} was given."
+    )
+
+
+def _init_worker(key: str, payload: tuple[str, list[tuple]]) -> None:
+    """Builds the circuit and the MWPM decoders of the strategies
+    in a worker process."""
+    _WORKER_EVALUATORS[key] = _build_evaluator(payload)
+    return
+
+
+def _build_evaluator(
+    payload: tuple[str, list[tuple]]
+) -> tuple[stim.Circuit, list[Matching]]:
+    """Returns the circuit and the MWPM decoders of the strategies."""
+    # imported here because pymatching is slow to import
+    from pymatching import Matching
+
+    circuit_str, graphs = payload
+    circuit = stim.Circuit(circuit_str)
+    matchings = []
+    for graph in graphs:
+        if graph[0] == "stim":
+            matchings.append(Matching(stim.DetectorErrorModel(graph[1])))
+            continue
+        matchings.append(
+            _get_matching(
+                *graph[1:],
+                num_detectors=circuit.num_detectors,
+                num_observables=circuit.num_observables,
+            )
+        )
+
+    return circuit, matchings
+
+
+def _evaluate_chunk(
+    key: str, payload: tuple[str, list[tuple]] | None, seed: int, num_shots: int
+) -> tuple[int, list[int]]:
+    """Returns the number of shots and the number of logical errors
+    of each strategy for a chunk sampled with the given seed. The circuit
+    and decoders are built from ``payload`` if it is given."""
+    if payload is not None:
+        evaluator = _build_evaluator(payload)
+    else:
+        evaluator = _WORKER_EVALUATORS[key]
+    return _count_errors(evaluator, seed, num_shots)
+
+
+def _count_errors(
+    evaluator: tuple[stim.Circuit, list[Matching]], seed: int, num_shots: int
+) -> tuple[int, list[int]]:
+    """Returns the number of shots and the number of logical errors
+    of each strategy for a chunk sampled with the given seed."""
+    circuit, matchings = evaluator
+
+    sampler = circuit.compile_detector_sampler(seed=seed)
+    dets, obs = sampler.sample(num_shots, separate_observables=True, bit_packed=True)
+    num_errors = []
+    for matching in matchings:
+        predictions = matching.decode_batch(
+            dets, bit_packed_shots=True, bit_packed_predictions=True
+        )
+        num_errors.append(int((predictions != obs).any(axis=1).sum()))
+    return num_shots, num_errors
+
+
+def _wilson_interval(num_errors: int, num_shots: int, z: float) -> tuple[float, float]:
+    """Returns the Wilson score interval of a binomial proportion."""
+    rate = num_errors / num_shots
+    denominator = 1 + z**2 / num_shots
+    center = (rate + z**2 / (2 * num_shots)) / denominator
+    half_width = (
+        z
+        * math.sqrt(rate * (1 - rate) / num_shots + z**2 / (4 * num_shots**2))
+        / denominator
+    )
+    return (max(center - half_width, 0.0), min(center + half_width, 1.0))
@@ -0,0 +1,175 @@
+from collections.abc import Iterable
+import heapq
+
+import numpy as np
+
+from .detector_error_model import DEM
+from .util import probs_to_weights
+
+
+class LocalDecomposer:
+    """Decomposes hyperedges into primitive faults by solving a small
+    minimum-weight pairing problem around their detectors.
+
+    The shortest paths from each detector of the hyperedge are found with
+    Dijkstra in the primitive graph, limited to a radius (in units of
+    the MWPM weights ``log((1-p)/p)``). The detectors are then paired between
+    them or with the boundary such that the total weight is minimal.
+    A local solution is only returned if its weight is at most the radius,
+    because then all the paths of the global minimum-weight matching lie
+    within the radius and the local solution is also a global one.
+
+    The number of hyperedges solved locally and the ones for which
+    the global MWPM is needed are stored in ``num_local`` and ``num_global``.
+    """
+
+    def __init__(
+        self, primitive_dem: DEM, radius: float, max_detectors: int = 10
+    ) -> None:
+        """Initializes the decomposer.
+
+        Parameters
+        ----------
+        primitive_dem
+            DEM of the primitive faults, e.g. ``DEM.get_primitive_graph``.
+        radius
+            Maximum weight of the local searches and of the local solutions.
+        max_detectors
+            Hyperedges triggering more detectors are not solved locally,
+            because the pairing problem grows exponentially with them.
+        """
+        if not isinstance(primitive_dem, DEM):
+            raise TypeError(
+                f"'primitive_dem' must be a DEM, but {type(primitive_dem)} was given."
+            )
+        if not isinstance(radius, (int, float)) or not radius > 0:
+            raise ValueError(f"'radius' must be a positive number, not {radius}.")
+        if not isinstance(max_detectors, int) or max_detectors < 1:
+            raise ValueError(
+                f"'max_detectors' must be a positive int, not {max_detectors}."
+            )
+
+        self.radius = float(radius)
+        self.max_detectors = max_detectors
+        self.num_local = 0
+        self.num_global = 0
+
+        self._boundary = -1
+        self._adjacency = _get_adjacency(primitive_dem)
+        self._trees = {}
+        # Dijkstra is not valid with negative weights (i.e. p > 0.5)
+        self._valid = all(
+            w >= 0 for edges in self._adjacency.values() for _, w, _ in edges
+        )
+        return
+
+    def decompose(self, detectors: Iterable[int]) -> list[int] | None:
+        """Returns the primitive faults (ids in the primitive DEM) that
+        decompose the given detectors, or ``None`` if no local solution
+        is found and the global MWPM is needed."""
+        matching = self._match(sorted(set(detectors)))
+        if matching is None:
+            self.num_global += 1
+        else:
+            self.num_local += 1
+        return matching
+
+    def get_stats(self) -> dict[str, int]:
+        """Returns the number of hyperedges solved locally and globally."""
+        return {"num_local": self.num_local, "num_global": self.num_global}
+
+    def _match(self, detectors: list[int]) -> list[int] | None:
+        num_dets = len(detectors)
+        if (not self._valid) or num_dets == 0 or num_dets > self.max_detectors:
+            return None
+
+        trees = [self._search(d) for d in detectors]
+        inf = float("inf")
+        to_boundary = [t.get(self._boundary, (inf,))[0] for t in trees]
+        pairs = [[t.get(d, (inf,))[0] for d in detectors] for t in trees]
+
+        # dynamic programming over the subsets of matched detectors,
+        # always matching the first unmatched detector
+        full = (1 << num_dets) - 1
+        costs = [inf] * (full + 1)
+        choices = [None] * (full + 1)
+        costs[0] = 0.0
+        for mask in range(full):
+            if costs[mask] > self.radius:
+                continue
+            i = (~mask & (mask + 1)).bit_length() - 1
+            options = [(to_boundary[i], i, None)]
+            options += [
+                (pairs[i][j], i, j)
+                for j in range(i + 1, num_dets)
+                if not mask & (1 << j)
+            ]
+            for cost, i, j in options:
+                new_mask = mask | (1 << i) | (0 if j is None else 1 << j)
+                if costs[mask] + cost < costs[new_mask]:
+                    costs[new_mask] = costs[mask] + cost
+                    choices[new_mask] = (mask, i, j)
+
+        if costs[full] > self.radius:
+            return None
+
+        # faults used twice cancel out
+        faults = set()
+        mask = full
+        while mask:
+            mask, i, j = choices[mask]
+            target = self._boundary if j is None else detectors[j]
+            faults.symmetric_difference_update(_get_path(trees[i], target))
+        return sorted(faults)
+
+    def _search(self, source: int) -> dict[int, tuple]:
+        """Returns the shortest-path tree from the given detector limited to
+        the radius, as ``{node: (distance, previous node, fault id)}``."""
+        if (tree := self._trees.get(source)) is not None:
+            return tree
+
+        tree = {}
+        queue = [(0.0, source, source, -1)]
+        while queue:
+            dist, node, prev, fault = heapq.heappop(queue)
+            if node in tree:
+                continue
+            tree[node] = (dist, prev, fault)
+            if node == self._boundary:
+                continue  # the boundary does not connect detectors
+            for neigh, weight, neigh_fault in self._adjacency.get(node, ()):
+                new_dist = dist + weight
+                if new_dist <= self.radius and neigh not in tree:
+                    heapq.heappush(queue, (new_dist, neigh, node, neigh_fault))
+
+        self._trees[source] = tree
+        return tree
+
+
+def _get_adjacency(primitive_dem: DEM) -> dict[int, list[tuple[int, float, int]]]:
+    """Returns the adjacency lists of the primitive graph as
+    ``{node: [(neighbour, weight, fault id), ...]}``, with the boundary
+    given by node ``-1``. Faults with zero probability are skipped."""
+    arrays = primitive_dem._get_arrays()
+    weights = probs_to_weights(arrays["probs"]).tolist()
+    det_ptr, det_ind = arrays["det_ptr"].tolist(), arrays["det_ind"].tolist()
+    adjacency = {}
+    for id_, weight in enumerate(weights):
+        dets = det_ind[det_ptr[id_] : det_ptr[id_ + 1]]
+        if not np.isfinite(weight) or len(dets) not in (1, 2):
+            continue
+        d1, d2 = (dets[0], -1) if len(dets) == 1 else dets
+        adjacency.setdefault(d1, []).append((d2, weight, id_))
+        adjacency.setdefault(d2, []).append((d1, weight, id_))
+    return adjacency
+
+
+def _get_path(tree: dict[int, tuple], target: int) -> list[int]:
+    """Returns the fault ids of the path from the source of the tree
+    to the target."""
+    faults = []
+    _, prev, fault = tree[target]
+    while fault != -1:
+        faults.append(fault)
+        _, prev, fault = tree[prev]
+    return faults
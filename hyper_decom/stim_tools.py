@@ -1,30 +1,56 @@
+import re
+
+import numpy as np
 import stim
 
-from .detector_error_model import DEM, xor_lists
+from .detector_error_model import DEM, _gather_csr, _sort_csr_rows, _csr_to_tuples
+from .util import DetectorSet, xor_csr_rows
+
+# regular expression and translation tables to parse the error instructions
+# in bulk, see '_parse_errors'. The tag of the instruction is ignored,
+# e.g. 'error[tag](0.1) D0 D1 ^ D2 L0'
+_ERROR_REGEX = re.compile(r"^error(?:\[.*?\])?\((.*?)\)(.*)$", re.MULTILINE)
+_TARGET_KINDS = str.maketrans("", "", "0123456789 ")
+_TARGET_VALUES = str.maketrans({"D": " ", "L": " ", "^": " 0", "|": " 0"})
 
 
 def get_detectors(dem_instr: stim.DemInstruction) -> tuple[int, ...]:
     if dem_instr.type != "error":
         raise ValueError(f"DemInstruction is not an error, it is {dem_instr.type}.")
 
-    if has_separator(dem_instr):
-        return xor_lists(*decomposed_detectors(dem_instr))
+    comp_dets, _ = _get_components(dem_instr)
+    if len(comp_dets) > 1:
+        return DetectorSet.xor_many(comp_dets).to_tuple()
     else:
-        return tuple(
-            i.val for i in dem_instr.targets_copy() if i.is_relative_detector_id()
-        )
+        return tuple(comp_dets[0])
 
 
 def get_logicals(dem_instr: stim.DemInstruction) -> tuple[int, ...]:
     if dem_instr.type != "error":
         raise ValueError(f"DemInstruction is not an error, it is {dem_instr.type}.")
 
-    if has_separator(dem_instr):
-        return xor_lists(*decomposed_logicals(dem_instr))
+    _, comp_logs = _get_components(dem_instr)
+    if len(comp_logs) > 1:
+        return DetectorSet.xor_many(comp_logs).to_tuple()
     else:
-        return tuple(
-            i.val for i in dem_instr.targets_copy() if i.is_logical_observable_id()
-        )
+        return tuple(comp_logs[0])
+
+
+def _get_components(
+    dem_instr: stim.DemInstruction,
+) -> tuple[list[list[int]], list[list[int]]]:
+    """Returns the detectors and the logicals of each component (i.e. targets
+    between separators) of the error instruction, in the order of the targets."""
+    comp_dets, comp_logs = [[]], [[]]
+    for target in dem_instr.targets_copy():
+        if target.is_separator():
+            comp_dets.append([])
+            comp_logs.append([])
+        elif target.is_relative_detector_id():
+            comp_dets[-1].append(target.val)
+        elif target.is_logical_observable_id():
+            comp_logs[-1].append(target.val)
+    return comp_dets, comp_logs
 
 
 def has_separator(dem_instr: stim.DemInstruction) -> bool:
@@ -102,14 +128,19 @@ def from_stim_to_dem(
         if dem_instr.type != "error":
             continue
 
-        detectors = get_detectors(dem_instr)
-        logicals = get_logicals(dem_instr)
+        # the targets are read once, see 'get_detectors' and 'get_logicals'
+        comp_dets, comp_logs = _get_components(dem_instr)
+        if len(comp_dets) > 1:
+            detectors = DetectorSet.xor_many(comp_dets).to_tuple()
+            logicals = DetectorSet.xor_many(comp_logs).to_tuple()
+        else:
+            detectors, logicals = tuple(comp_dets[0]), tuple(comp_logs[0])
         prob = dem_instr.args_copy()[0]
         id_ = dem.add_fault(prob, detectors, logicals)
 
-        if has_separator(dem_instr):
+        if len(comp_dets) > 1:
             # needs to be processed once all the faults have been added to DEM
-            decomposed[id_] = dem_instr
+            decomposed[id_] = (dem_instr, comp_dets)
         else:
             if len(detectors) <= 2:
                 dem.set_as_primitive(id_)
@@ -117,8 +148,8 @@ def from_stim_to_dem(
     if not load_decompositions:
         return dem
 
-    for id_, dem_instr in decomposed.items():
-        list_dets = decomposed_detectors(dem_instr)
+    for id_, (dem_instr, comp_dets) in decomposed.items():
+        list_dets = [tuple(sorted(dets)) for dets in comp_dets]
         decom_ids = [dem.det_to_id.get(dets) for dets in list_dets]
 
         if None in decom_ids:
@@ -131,32 +162,186 @@ def from_stim_to_dem(
     return dem
 
 
-def from_dem_to_stim(dem: DEM) -> stim.DetectorErrorModel:
-    """Returns a ``stim.DetectorErrorModel`` from a ``DEM``."""
-    if not isinstance(dem, DEM):
-        raise TypeError(f"'dem' is not a DEM, but a {type(dem)}.")
+def from_stim_to_dem_fast(
+    stim_dem: stim.DetectorErrorModel, load_decompositions: bool = True
+) -> DEM:
+    """Returns the ``DEM`` object corresponding to the given
+    ``stim.DetectorErrorModel`` with error decompositions.
 
-    stim_dem = stim.DetectorErrorModel()
-    for id_ in dem.ids:
-        prob = dem.probs[id_]
+    It gives the same ``DEM`` as ``from_stim_to_dem``, but the error
+    instructions are parsed from the text of ``stim_dem`` in a single pass
+    and the faults are added to ``DEM`` in bulk.
 
-        if id_ in dem.decompositions:
-            decomposition = dem.decompositions[id_]
-            dets = [dem.detectors[i] for i in decomposition]
-            logs = [dem.logicals[i] for i in decomposition]
-        else:
-            dets = [dem.detectors[id_]]
-            logs = [dem.logicals[id_]]
+    Parameters
+    ----------
+    stim_dem
+        Stim's detector error model.
+    load_decompositions
+        If True, loads the stim decompositions to ``DEM``.
 
-        targets = []
-        for k, (d, l) in enumerate(zip(dets, logs)):
-            targets += [stim.target_relative_detector_id(i) for i in d]
-            targets += [stim.target_logical_observable_id(i) for i in l]
-            # add "^" separator except for the last element
-            if k != len(dets) - 1:
-                targets.append(stim.target_separator())
+    Returns
+    -------
+    dem
+        ``DEM`` corresponding to ``stim_dem``.
+    """
+    if not isinstance(stim_dem, stim.DetectorErrorModel):
+        raise TypeError(f"'stim_dem' is not a stim DEM, but a {type(stim_dem)}.")
+
+    dem, _ = _from_stim_to_dem_with_ids(stim_dem, load_decompositions)
+    return dem
 
-        dem_instr = stim.DemInstruction("error", args=[prob], targets=targets)
-        stim_dem.append(dem_instr)
 
-    return stim_dem
+def _from_stim_to_dem_with_ids(
+    stim_dem: stim.DetectorErrorModel, load_decompositions: bool = True
+) -> tuple[DEM, np.ndarray]:
+    """Returns the ``DEM`` given by ``from_stim_to_dem_fast`` and the fault id
+    of each error instruction in the flattened ``stim_dem``."""
+    probs, comp_line, comp_dets, comp_logs = _parse_errors(stim_dem)
+    num_lines = len(probs)
+    has_sep = np.bincount(comp_line, minlength=num_lines) > 1
+
+    # the targets of instructions without separators are used as they are
+    # (stim does not remove repeated targets), the ones with separators are
+    # the symmetric difference of the components (as in 'get_detectors')
+    line_ptr = np.zeros(num_lines + 1, dtype=np.int64)
+    np.cumsum(np.bincount(comp_line, minlength=num_lines), out=line_ptr[1:])
+    sep_lines = np.flatnonzero(has_sep)
+    sep_comps = np.flatnonzero(has_sep[comp_line])
+    sep_groups = np.searchsorted(sep_lines, comp_line[sep_comps])
+    rows = np.arange(num_lines)
+    rows[sep_lines] = num_lines + np.arange(len(sep_lines))
+
+    faults_csr = []
+    for ptr, ind in [comp_dets, comp_logs]:
+        raw_ptr, raw_ind = _gather_csr(ptr, ind, line_ptr[:-1])
+        sep_ptr, sep_ind = _gather_csr(ptr, ind, sep_comps)
+        xor_ptr, xor_ind = xor_csr_rows(sep_ptr, sep_ind, sep_groups, len(sep_lines))
+        all_ptr = np.concatenate([raw_ptr, raw_ptr[-1] + xor_ptr[1:]])
+        all_ind = np.concatenate([raw_ind, xor_ind])
+        faults_csr += _gather_csr(all_ptr, all_ind, rows)
+
+    dem = DEM()
+    ids = dem._add_faults_csr(probs, *faults_csr)
+
+    weights = np.diff(faults_csr[0])
+    dem.set_as_primitives(ids[~has_sep & (weights <= 2)])
+
+    if not load_decompositions:
+        return dem, ids
+
+    # needs to be processed once all the faults have been added to DEM,
+    # the last instruction of each fault sets its decomposition
+    decomposed = {}
+    for line in np.flatnonzero(has_sep).tolist():
+        decomposed[int(ids[line])] = line
+
+    comp_keys = _csr_to_tuples(comp_dets[0], _sort_csr_rows(*comp_dets))
+    for id_, line in decomposed.items():
+        list_dets = comp_keys[line_ptr[line] : line_ptr[line + 1]]
+        decom_ids = [dem.det_to_id.get(dets) for dets in list_dets]
+
+        if None in decom_ids:
+            dem_instr = _get_error(stim_dem, line)
+            raise ValueError(f"Decomposition uses unkown faults:\n{dem_instr}")
+        if any([not dem.is_primitive(i) for i in decom_ids]):
+            dem_instr = _get_error(stim_dem, line)
+            raise ValueError(f"Found wrong decomposition:\n{dem_instr}")
+
+        dem.add_decomposition(id_, decom_ids)
+
+    return dem, ids
+
+
+def _parse_errors(stim_dem: stim.DetectorErrorModel) -> tuple:
+    """Returns the probabilities of the error instructions in the flattened
+    ``stim_dem`` and the instruction, detectors and logicals (in CSR format)
+    of each of their components (i.e. targets between separators)."""
+    errors = _ERROR_REGEX.findall(str(stim_dem.flattened()))
+    probs = [prob for prob, _ in errors]
+    targets = [target_str for _, target_str in errors]
+
+    probs = np.array(probs, dtype=np.float64)
+    # the character '|' marks the end of each instruction
+    target_str = " | ".join(targets)
+    kinds = np.frombuffer(
+        target_str.translate(_TARGET_KINDS).encode("ascii"), dtype=np.uint8
+    )
+    values = np.array(target_str.translate(_TARGET_VALUES).split(), dtype=np.int64)
+
+    is_end = kinds == ord("|")
+    is_sep = is_end | (kinds == ord("^"))
+    line = np.cumsum(is_end)
+    comp = np.cumsum(is_sep)
+    num_comps = int(comp[-1]) + 1 if len(comp) else len(probs)
+    comp_line = np.zeros(num_comps, dtype=np.int64)
+    comp_line[1:] = line[is_sep]
+
+    csrs = []
+    for kind in "DL":
+        mask = kinds == ord(kind)
+        ptr = np.zeros(num_comps + 1, dtype=np.int64)
+        np.cumsum(np.bincount(comp[mask], minlength=num_comps), out=ptr[1:])
+        csrs.append((ptr, values[mask]))
+
+    return probs, comp_line, csrs[0], csrs[1]
+
+
+def _get_error(stim_dem: stim.DetectorErrorModel, k: int) -> stim.DemInstruction:
+    """Returns the ``k``-th error instruction of the flattened ``stim_dem``."""
+    errors = [i for i in stim_dem.flattened() if i.type == "error"]
+    return errors[k]
+
+
+def from_dem_to_stim(dem: DEM) -> stim.DetectorErrorModel:
+    """Returns a ``stim.DetectorErrorModel`` from a ``DEM``."""
+    if not isinstance(dem, DEM):
+        raise TypeError(f"'dem' is not a DEM, but a {type(dem)}.")
+    if dem.num_faults == 0:
+        return stim.DetectorErrorModel()
+
+    # the stim DEM is built from its text representation in one shot, which is
+    # much faster than appending a 'stim.DemInstruction' for each fault.
+    # The text is generated as an array of tokens joined by spaces.
+    arrays = dem._get_arrays()
+    num_faults = dem.num_faults
+    det_ptr, det_ind = arrays["det_ptr"], arrays["det_ind"]
+    log_ptr, log_ind = arrays["log_ptr"], arrays["log_ind"]
+
+    # targets of each fault in CSR format, i.e. its detectors followed by its logicals
+    det_names = np.array([f"D{d}" for d in range(dem.num_detectors)], dtype=object)
+    log_names = np.array([f"L{l}" for l in range(dem.num_observables)], dtype=object)
+    rows = np.concatenate(
+        [
+            np.repeat(np.arange(num_faults), np.diff(det_ptr)),
+            np.repeat(np.arange(num_faults), np.diff(log_ptr)),
+        ]
+    )
+    order = np.argsort(rows, kind="stable")
+    fault_ptr = det_ptr + log_ptr
+    fault_ind = np.concatenate([det_names[det_ind], log_names[log_ind]])[order]
+
+    # components of each instruction, i.e. the elements of its decomposition
+    # or the fault itself if it does not have a decomposition
+    decom, decom_len = arrays["decom"].copy(), arrays["decom_len"]
+    no_decom = np.flatnonzero(decom_len < 0)
+    decom[no_decom, 0] = no_decom
+    num_comps = np.where(decom_len < 0, 1, decom_len)
+    comps = decom[np.arange(decom.shape[1]) < num_comps[:, None]]
+    is_first = np.zeros(len(comps), dtype=bool)
+    is_first[np.cumsum(num_comps) - num_comps] = True
+    comp_ptr, comp_ind = _gather_csr(fault_ptr, fault_ind, comps)
+
+    # each instruction is 'error(prob)', the targets of the components
+    # separated by '^' and a line break. Note that 'repr' gives the shortest
+    # string that recovers the same float.
+    lengths = np.diff(comp_ptr) + 1 + is_first
+    out_ptr = np.zeros(len(comps) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=out_ptr[1:])
+    tokens = np.empty(out_ptr[-1], dtype=object)
+    tokens[out_ptr[:-1][is_first]] = [f"error({p!r})" for p in arrays["probs"].tolist()]
+    positions = np.repeat(out_ptr[:-1] + is_first - comp_ptr[:-1], np.diff(comp_ptr))
+    tokens[positions + np.arange(len(comp_ind))] = comp_ind
+    is_last = np.append(is_first[1:], True)
+    tokens[out_ptr[1:] - 1] = np.where(is_last, "\n", "^")
+
+    return stim.DetectorErrorModel(" ".join(tokens.tolist()))
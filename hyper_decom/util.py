@@ -1,16 +1,201 @@
-from collections.abc import Iterable
+from collections.abc import Iterable, Iterator
+
+import numpy as np
+
+
+class DetectorSet:
+    """Immutable set of non-negative integers (e.g. detector or logical ids)
+    stored as the bits of a Python ``int``.
+
+    The bits are relative to the smallest element, so the size of the ``int``
+    depends on the spread of the elements and not on their values. Equal sets
+    have the same representation, thus the same hash.
+    """
+
+    __slots__ = ("_offset", "_bits")
+
+    def __init__(self, elements: Iterable[int] = ()) -> None:
+        self._offset, self._bits = _to_bits(elements)
+        return
+
+    @classmethod
+    def _from_bits(cls, offset: int, bits: int) -> "DetectorSet":
+        new = object.__new__(cls)
+        if bits == 0:
+            new._offset, new._bits = 0, 0
+            return new
+        shift = (bits & -bits).bit_length() - 1
+        new._offset, new._bits = offset + shift, bits >> shift
+        return new
+
+    @classmethod
+    def xor_many(cls, sets: Iterable["DetectorSet | Iterable[int]"]) -> "DetectorSet":
+        """Returns the symmetric difference of all the given sets, which can be
+        ``DetectorSet`` or iterables of integers."""
+        offset, bits = 0, 0
+        for elements in sets:
+            if type(elements) is DetectorSet:
+                new_offset, new_bits = elements._offset, elements._bits
+            else:
+                new_offset, new_bits = _to_bits(elements)
+            if not new_bits:
+                continue
+            if not bits:
+                offset, bits = new_offset, new_bits
+            elif new_offset >= offset:
+                bits ^= new_bits << (new_offset - offset)
+            else:
+                bits = (bits << (offset - new_offset)) ^ new_bits
+                offset = new_offset
+        return cls._from_bits(offset, bits)
+
+    def __xor__(self, other: "DetectorSet") -> "DetectorSet":
+        if not isinstance(other, DetectorSet):
+            return NotImplemented
+        return DetectorSet.xor_many([self, other])
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, DetectorSet):
+            return NotImplemented
+        return self._bits == other._bits and self._offset == other._offset
+
+    def __hash__(self) -> int:
+        return hash((self._offset, self._bits))
+
+    def __len__(self) -> int:
+        return bin(self._bits).count("1")
+
+    def __bool__(self) -> bool:
+        return self._bits != 0
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.to_tuple())
+
+    def __repr__(self) -> str:
+        return f"DetectorSet({self.to_tuple()})"
+
+    def to_tuple(self) -> tuple[int, ...]:
+        """Returns the elements of the set sorted in increasing order."""
+        elements = []
+        bits, offset = self._bits, self._offset - 1
+        while bits:
+            lowest = bits & -bits
+            elements.append(offset + lowest.bit_length())
+            bits ^= lowest
+        return tuple(elements)
+
+
+def _to_bits(elements: Iterable[int]) -> tuple[int, int]:
+    """Returns the smallest element and the bits of the elements
+    relative to it."""
+    if type(elements) is not list and type(elements) is not tuple:
+        if isinstance(elements, np.ndarray):
+            elements = elements.tolist()
+        else:
+            elements = tuple(elements)
+    if not elements:
+        return 0, 0
+
+    offset = min(elements)
+    if type(offset) is not int:
+        # e.g. numpy integers, whose shifts would overflow
+        elements = [int(element) for element in elements]
+        offset = min(elements)
+    if offset < 0:
+        raise ValueError(f"Elements must be non-negative, but {offset} was given.")
+
+    bits = 0
+    for element in elements:
+        bits |= 1 << (element - offset)
+    return offset, bits
 
 
 def xor_two_lists(list1: Iterable, list2: Iterable) -> tuple:
-    return tuple(sorted(list(set(list1).symmetric_difference(list2))))
+    return xor_lists(list1, list2)
 
 
 def xor_lists(*elements: Iterable) -> tuple:
-    output = []
-    for element in elements:
-        output = xor_two_lists(output, element)
-    return tuple(sorted(output))
+    return DetectorSet.xor_many(elements).to_tuple()
+
+
+def xor_csr_rows(
+    ptr: np.ndarray, ind: np.ndarray, groups: np.ndarray, num_groups: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Returns the symmetric difference of the rows of the CSR arrays
+    (``ptr``, ``ind``) belonging to the same group, for all groups at once.
+
+    Parameters
+    ----------
+    ptr, ind
+        Sets in CSR format, i.e. set ``i`` is ``ind[ptr[i]:ptr[i+1]]``.
+    groups
+        Group of each set, with values in ``[0, num_groups)``.
+    num_groups
+        Number of groups.
+
+    Returns
+    -------
+    out_ptr, out_ind
+        Symmetric difference of each group in CSR format, with sorted elements.
+    """
+    ptr, ind, groups = np.asarray(ptr), np.asarray(ind), np.asarray(groups)
+    lengths = np.diff(ptr)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    ind = ind[: ptr[-1]].astype(np.int64)
+
+    # remove repeated elements inside a set, then count the parity per group.
+    # The (set, element) pairs are encoded as single integers for faster sorting.
+    base = int(ind.max(initial=0)) + 1
+    keys = np.unique(rows * base + ind)
+    keys = groups[keys // base] * base + keys % base
+    keys, counts = np.unique(keys, return_counts=True)
+    keys = keys[counts % 2 == 1]
+
+    out_ptr = np.zeros(num_groups + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys // base, minlength=num_groups), out=out_ptr[1:])
+    return out_ptr, keys % base
 
 
 def xor_two_probs(p: float | int, q: float | int) -> float | int:
     return p * (1 - q) + (1 - p) * q
+
+
+def scatter_xor_probs(
+    probs: np.ndarray, targets: np.ndarray, values: np.ndarray
+) -> np.ndarray:
+    """Returns a copy of ``probs`` in which every ``values[..., k]`` has been
+    combined into ``probs[..., targets[k]]`` using ``xor_two_probs``.
+
+    The result is the same (bit by bit) as running the loop over ``k``
+    sequentially, but the operations are vectorized: the ``r``-th value
+    of every target is combined in the ``r``-th step. Leading dimensions
+    in ``probs`` and ``values`` are broadcasted, e.g. to combine several
+    probability vectors at once.
+    """
+    probs, values = np.asarray(probs, dtype=np.float64), np.asarray(values)
+    targets = np.asarray(targets)
+    shape = np.broadcast_shapes(probs.shape[:-1], values.shape[:-1])
+    probs = np.array(np.broadcast_to(probs, shape + probs.shape[-1:]))
+    if len(targets) == 0:
+        return probs
+
+    order = np.argsort(targets, kind="stable")
+    starts = np.flatnonzero(np.diff(targets[order], prepend=-1))
+    rank = np.arange(len(targets)) - np.repeat(
+        starts, np.diff(starts, append=len(targets))
+    )
+    order = order[np.argsort(rank, kind="stable")]
+    for step in np.split(order, np.cumsum(np.bincount(rank))[:-1]):
+        probs[..., targets[step]] = xor_two_probs(
+            probs[..., targets[step]], values[..., step]
+        )
+
+    return probs
+
+
+def probs_to_weights(probs: np.ndarray) -> np.ndarray:
+    """Returns the weights used in matching graphs, ``log((1-p)/p)``,
+    for the given probabilities."""
+    probs = np.asarray(probs, dtype=np.float64)
+    with np.errstate(divide="ignore"):
+        return np.log((1 - probs) / probs)
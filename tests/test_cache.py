@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from hyper_decom import DEM, DecompositionCache, decompose_dem
+
+
+def test_DecompositionCache():
+    cache = DecompositionCache(max_size=2)
+    cache.put("a", ((0,),))
+    cache.put("b", ((1,),))
+
+    assert cache.get("a") == ((0,),)
+    cache.put("c", ((2,),))
+
+    assert "b" not in cache  # least recently used
+    assert "a" in cache
+    assert cache.get("b") is None
+    assert cache.get_stats() == {
+        "num_hits": 0,
+        "num_misses": 0,
+        "num_evictions": 1,
+        "size": 2,
+    }
+
+    cache.clear()
+    assert len(cache) == 0
+
+    with pytest.raises(ValueError):
+        DecompositionCache(max_size=0)
+    with pytest.raises(ValueError):
+        DecompositionCache(depth=0)
+
+    return
+
+
+def test_DecompositionCache_other_weights():
+    cache = DecompositionCache()
+    # the hyperedge (0, 1, 2) is decomposed into (0, 1) + (2) or (0) + (1, 2)
+    for weights, expected in [((1, 2, 3, 3.5), (0, 3)), ((1, 2, 3, 10), (1, 2))]:
+        my_dem = DEM()
+        probs = [float(1 / (1 + np.exp(w))) for w in weights] + [0.01]
+        my_dem.add_faults(
+            probs, [[0, 1], [0], [1, 2], [2], [0, 1, 2]], [[], [], [], [], []]
+        )
+        my_dem.set_as_primitives([0, 1, 2, 3])
+        decompose_dem(my_dem, cache=cache)
+        assert my_dem.decompositions[4] == expected
+
+    # a pattern with different weights is not a hit
+    assert cache.num_hits == 0
+    assert len(cache) == 2
+
+    return
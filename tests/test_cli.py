@@ -0,0 +1,48 @@
+import subprocess
+import sys
+
+import stim
+
+from hyper_decom import DEM, decompose_dem, from_stim_to_dem
+from hyper_decom.cli import main
+
+
+def test_main(tmp_path):
+    circuit = stim.Circuit.generated(
+        "surface_code:rotated_memory_z",
+        distance=3,
+        rounds=3,
+        after_clifford_depolarization=0.01,
+    )
+    dem = circuit.detector_error_model()
+    dem.to_file(tmp_path / "input.dem")
+
+    status = main([str(tmp_path / "input.dem"), "--mode", "logical-aware", "-q"])
+    assert status == 0
+    decom_dem = stim.DetectorErrorModel.from_file(tmp_path / "input_decomposed.dem")
+    assert decom_dem == decompose_dem(dem, mode="logical-aware")
+
+    output_dir = tmp_path / "outputs"
+    inputs = [str(tmp_path / "input.dem"), str(tmp_path / "input_decomposed.dem")]
+    status = main(
+        [*inputs, "-o", str(output_dir), "-f", "bin", "--mode", "logical-aware"]
+    )
+    assert status == 0
+    decom_dem = DEM.load(output_dir / "input.bin")
+    expected_dem = from_stim_to_dem(decompose_dem(dem, mode="logical-aware"))
+    assert decom_dem.decompositions == expected_dem.decompositions
+
+    return
+
+
+def test_lazy_imports():
+    code = (
+        "import sys, hyper_decom.cli; "
+        "print(any(m in sys.modules for m in ['pymatching', 'ldpc', 'scipy']))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert output.stdout.strip() == "False"
+
+    return
@@ -1,7 +1,25 @@
+from concurrent.futures import ThreadPoolExecutor
+import sys
+
 import pytest
 import stim
 
-from hyper_decom import decompose_dem, find_valid_decomposition
+import numpy as np
+
+from hyper_decom import (
+    DEM,
+    DecompositionCache,
+    DiskCache,
+    decompose_dem,
+    decompose_dem_stream,
+    decompose_dem_sweep,
+    decompose_repeated_dem,
+    find_valid_decomposition,
+    find_valid_decompositions,
+    from_stim_to_dem,
+)
+from hyper_decom import decomposition
+from hyper_decom.util import probs_to_weights, xor_lists
 
 
 def test_decompose_dem():
@@ -28,6 +46,43 @@ def test_decompose_dem():
     return
 
 
+def test_decompose_dem_stats():
+    dem = stim.DetectorErrorModel(
+        """
+        error(0.1) D0 D1 L0
+        error(0.1) D0 D1 D2 D3
+        error(0.1) D2 D3 L0
+        error(0.1) D2
+        """
+    )
+    stats, calls = {}, []
+
+    decompose_dem(dem, stats=stats, progress=lambda *args: calls.append(args))
+
+    assert stats["num_hyperedges"] == 1
+    assert stats["num_global"] == 1
+    assert stats["num_failures"] == 0
+    assert set(stats["timings"]) == set(
+        [
+            "convert_in",
+            "split",
+            "weight_2",
+            "matching",
+            "mwpm",
+            "add_decomposition",
+            "convert_out",
+        ]
+    )
+    assert calls[0] == ("convert_in", 1, 1)
+    assert ("mwpm", 1, 1) in calls
+    assert calls[-1] == ("convert_out", 1, 1)
+
+    with pytest.raises(TypeError):
+        decompose_dem(dem, progress=1)
+
+    return
+
+
 def test_decompose_dem_mwpm_fail():
     dem = stim.DetectorErrorModel("error(0.1) D0 D1 D2 D3")
 
@@ -49,6 +104,527 @@ def test_decompose_dem_mwpm_fail():
     return
 
 
+def test_match_hyperedges_no_perfect_matching(monkeypatch):
+    # D4, D5 and D6 are not connected to the boundary, thus the batch
+    # with the last hyperedge has no perfect matching
+    dem = from_stim_to_dem(
+        stim.DetectorErrorModel(
+            """
+            error(0.1) D0
+            error(0.1) D0 D1
+            error(0.1) D1 D2
+            error(0.1) D2 D3
+            error(0.1) D3
+            error(0.1) D4 D5
+            error(0.1) D5 D6
+            error(0.1) D0 D1 D2 D3
+            error(0.1) D1 D3
+            error(0.1) D0 D2 D3
+            error(0.1) D4 D5 D6
+            """
+        )
+    )
+    dem.set_as_primitives(range(7))
+    MWPM_prim, primitive_dem = decomposition._get_primitive_matching(dem)
+    hyperedges = np.array([7, 8, 9, 10])
+    det_ptr, det_ind = decomposition._gather_csr(dem._det_ptr, dem._det_ind, hyperedges)
+
+    calls = []
+    match_syndrome = decomposition._match_syndrome
+    monkeypatch.setattr(
+        decomposition,
+        "_match_syndrome",
+        lambda *args: calls.append(args) or match_syndrome(*args),
+    )
+    matchings = decomposition._match_hyperedges(
+        MWPM_prim, primitive_dem, det_ptr, det_ind
+    )
+    assert len(calls) == len(hyperedges)
+    assert matchings[-1] is None
+
+    # same decompositions as when decoding the hyperedges one by one
+    decompositions = decomposition._get_decompositions(
+        dem, hyperedges[:-1].tolist(), matchings[:-1]
+    )
+    for hyper, decom in zip(hyperedges[:-1], decompositions):
+        expected = decomposition._decompose_with_mwpm(
+            MWPM_prim, primitive_dem, dem, [hyper]
+        )
+        assert [decom] == expected
+    assert decompositions[0] == [1, 3]
+
+    return
+
+
+def test_match_hyperedges_max_bytes():
+    circuit = stim.Circuit.generated(
+        "surface_code:rotated_memory_z",
+        distance=7,
+        rounds=7,
+        after_clifford_depolarization=0.01,
+        before_measure_flip_probability=0.01,
+    )
+    dem = from_stim_to_dem(circuit.detector_error_model())
+    weight_2_edges, hyperedges = decomposition._get_undecomposed_faults(dem)
+    decomposition._decompose_weight_2_edges(dem, weight_2_edges, False)
+    MWPM_prim, primitive_dem = decomposition._get_primitive_matching(dem)
+    det_ptr, det_ind = decomposition._gather_csr(
+        dem._det_ptr, dem._det_ind, np.array(hyperedges)
+    )
+    # one observable per primitive fault, more than the 64 of the fast path
+    assert MWPM_prim.num_fault_ids == primitive_dem.num_faults > 64
+
+    expected = decomposition._match_hyperedges(
+        MWPM_prim, primitive_dem, det_ptr, det_ind
+    )
+    shot_bytes = (dem.num_detectors + 7) // 8 + (primitive_dem.num_faults + 7) // 8
+    calls = []
+    matchings = decomposition._match_hyperedges(
+        MWPM_prim,
+        primitive_dem,
+        det_ptr,
+        det_ind,
+        progress=lambda done, total: calls.append(done),
+        max_bytes=10 * shot_bytes,
+    )
+    assert max(np.diff([0] + calls)) == 10
+    assert all(
+        np.array_equal(matching, other) for matching, other in zip(matchings, expected)
+    )
+
+    return
+
+
+def test_decompose_dem_parallel():
+    circuit = stim.Circuit.generated(
+        "surface_code:rotated_memory_z",
+        distance=3,
+        rounds=3,
+        after_clifford_depolarization=0.01,
+        before_measure_flip_probability=0.01,
+    )
+    dem = circuit.detector_error_model()
+
+    with pytest.warns(UserWarning):
+        decom_dem = decompose_dem(dem, ignore_logical_error=True)
+    with pytest.warns(UserWarning):
+        parallel_dem = decompose_dem(dem, ignore_logical_error=True, workers=2)
+    assert parallel_dem == decom_dem
+
+    with ThreadPoolExecutor(2) as executor, pytest.warns(UserWarning):
+        parallel_dem = decompose_dem(dem, ignore_logical_error=True, executor=executor)
+    assert parallel_dem == decom_dem
+
+    dem = stim.DetectorErrorModel("error(0.1) D0 D1 D2 D3\nerror(0.1) D0 D1")
+    with pytest.raises(ValueError):
+        _ = decompose_dem(dem, workers=2)
+
+    return
+
+
+def test_decompose_dem_concurrent():
+    dems = [
+        stim.Circuit.generated(
+            "surface_code:rotated_memory_z",
+            distance=distance,
+            rounds=distance,
+            after_clifford_depolarization=0.01,
+            before_measure_flip_probability=0.01,
+        ).detector_error_model()
+        for distance in [5, 7]
+    ]
+    expected = [decompose_dem(dem) for dem in dems]
+
+    # two calls sharing the same executor do not interfere
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(4) as executor, ThreadPoolExecutor(2) as calls:
+            for _ in range(3):
+                futures = [
+                    calls.submit(decompose_dem, dem, executor=executor) for dem in dems
+                ]
+                assert [f.result() for f in futures] == expected
+    finally:
+        sys.setswitchinterval(switch_interval)
+    # no decoder is kept in this process
+    assert len(decomposition._WORKER_MATCHING) == 0
+
+    return
+
+
+def test_decompose_dem_local():
+    circuit = stim.Circuit.generated(
+        "surface_code:rotated_memory_z",
+        distance=3,
+        rounds=3,
+        after_clifford_depolarization=0.01,
+        before_measure_flip_probability=0.01,
+    )
+    dem = circuit.detector_error_model()
+
+    stats = {}
+    with pytest.warns(UserWarning):
+        decom_dem = decompose_dem(dem, ignore_logical_error=True, stats=stats)
+    num_hyperedges = stats["num_global"]
+    assert stats["num_local"] == 0
+
+    for radius in [1.0, 100.0]:
+        stats = {}
+        with pytest.warns(UserWarning):
+            local_dem = decompose_dem(
+                dem, ignore_logical_error=True, local_radius=radius, stats=stats
+            )
+        assert local_dem == decom_dem
+        assert stats["num_local"] + stats["num_global"] == num_hyperedges
+        assert (stats["num_local"] == 0) == (radius == 1.0)
+
+    return
+
+
+def test_decompose_dem_cache():
+    circuit = stim.Circuit.generated(
+        "surface_code:rotated_memory_z",
+        distance=3,
+        rounds=5,
+        after_clifford_depolarization=0.01,
+        before_measure_flip_probability=0.01,
+    )
+    dem = circuit.detector_error_model()
+
+    with pytest.warns(UserWarning):
+        decom_dem = decompose_dem(dem, ignore_logical_error=True)
+
+    cache = DecompositionCache()
+    with pytest.warns(UserWarning):
+        cached_dem = decompose_dem(dem, ignore_logical_error=True, cache=cache)
+    assert cached_dem == decom_dem
+    assert cache.num_hits > 0
+    num_misses = cache.num_misses
+
+    # all patterns are already in the cache
+    with pytest.warns(UserWarning):
+        cached_dem = decompose_dem(dem, ignore_logical_error=True, cache=cache)
+    assert cached_dem == decom_dem
+    assert cache.num_misses == num_misses
+
+    # without coordinates, the patterns are given by the detector indices
+    errors = [i for i in dem.flattened() if i.type == "error"]
+    dem = stim.DetectorErrorModel("\n".join(map(str, errors)))
+    cache = DecompositionCache()
+    with pytest.warns(UserWarning):
+        decom_dem = decompose_dem(dem, ignore_logical_error=True)
+    with pytest.warns(UserWarning):
+        cached_dem = decompose_dem(dem, ignore_logical_error=True, cache=cache)
+    assert cached_dem == decom_dem
+    assert cache.num_hits > 0
+
+    with pytest.raises(TypeError):
+        decompose_dem(dem, cache={})
+
+    return
+
+
+def test_decompose_dem_disk_cache(tmp_path):
+    dem = stim.DetectorErrorModel(
+        """
+        error(0.1) D0 D1 L0
+        error(0.1) D0 D1 D2 D3
+        error(0.1) D2 D3 L0
+        """
+    )
+    cache = DiskCache(tmp_path)
+
+    decom_dem = decompose_dem(dem, disk_cache=cache)
+    assert cache.num_misses == 1
+    assert decompose_dem(dem, disk_cache=cache) == decom_dem
+    assert cache.num_hits == 1
+
+    decompose_dem(dem, disk_cache=cache, ignore_logical_error=True)
+    assert cache.num_misses == 2
+
+    # the DEMs are decomposed in place for both hits and misses
+    for num_hits in [1, 2]:
+        my_dem = from_stim_to_dem(dem)
+        assert decompose_dem(my_dem, disk_cache=cache) is my_dem
+        assert cache.num_hits == num_hits
+        assert my_dem.decompositions == {1: (0, 2)}
+        assert my_dem.dirty_faults == []
+
+    # the results with a decomposition cache are not stored
+    decompose_dem(dem, disk_cache=cache, cache=DecompositionCache())
+    assert cache.num_hits + cache.num_misses == 5
+
+    return
+
+
+def test_decompose_dem_logical_aware():
+    circuit = stim.Circuit.generated(
+        "surface_code:rotated_memory_z",
+        distance=3,
+        rounds=3,
+        after_clifford_depolarization=0.01,
+        before_measure_flip_probability=0.01,
+    )
+    dem = circuit.detector_error_model()
+
+    with pytest.raises(ValueError):
+        decompose_dem(dem)
+
+    stats = {}
+    decom_dem = decompose_dem(dem, mode="logical-aware", stats=stats)
+    assert stats["num_bposd"] > 0
+    assert stats["num_failures"] == 0
+    assert decom_dem.num_errors == dem.num_errors
+
+    # the hyperedges with a wrong logical effect with MWPM are fixed by BP-OSD
+    with pytest.warns(UserWarning):
+        mwpm_dem = decompose_dem(from_stim_to_dem(dem), ignore_logical_error=True)
+    decom_dem = decompose_dem(from_stim_to_dem(dem), mode="logical-aware")
+    num_fixed = 0
+    for hyper, decom in decom_dem.decompositions.items():
+        logicals = [decom_dem.logicals[i] for i in decom]
+        assert xor_lists(*logicals) == decom_dem.logicals[hyper]
+        detectors = [decom_dem.detectors[i] for i in decom]
+        assert xor_lists(*detectors) == decom_dem.detectors[hyper]
+        if mwpm_dem.decompositions.get(hyper) != decom:
+            num_fixed += 1
+    assert num_fixed == stats["num_bposd"]
+
+    with pytest.raises(ValueError):
+        decompose_dem(dem, mode="other")
+
+    return
+
+
+def test_decompose_repeated_dem():
+    circuit = stim.Circuit.generated(
+        "surface_code:rotated_memory_z",
+        distance=3,
+        rounds=15,
+        after_clifford_depolarization=0.01,
+        before_measure_flip_probability=0.01,
+    )
+    dem = circuit.detector_error_model()
+
+    with pytest.warns(UserWarning):
+        decom_dem = decompose_repeated_dem(
+            dem, ignore_logical_error=True, num_boundary_periods=2
+        )
+
+    blocks = [i for i in dem if isinstance(i, stim.DemRepeatBlock)]
+    decom_blocks = [i for i in decom_dem if isinstance(i, stim.DemRepeatBlock)]
+    assert len(decom_blocks) == 1
+    assert decom_blocks[0].repeat_count == blocks[0].repeat_count - 4
+
+    with pytest.warns(UserWarning):
+        expected_dem = decompose_dem(dem.flattened(), ignore_logical_error=True)
+    expected_dem = from_stim_to_dem(expected_dem)
+    flat_dem = from_stim_to_dem(decom_dem.flattened())
+    assert flat_dem.detectors == expected_dem.detectors
+    for id_, decomposition in expected_dem.decompositions.items():
+        assert set(flat_dem.decompositions[id_]) == set(decomposition)
+
+    return
+
+
+def test_decompose_dem_stream():
+    stats = {}
+    for rounds in [10, 30]:
+        circuit = stim.Circuit.generated(
+            "surface_code:rotated_memory_z",
+            distance=3,
+            rounds=rounds,
+            after_clifford_depolarization=0.01,
+            before_measure_flip_probability=0.01,
+        )
+        dem = circuit.detector_error_model()
+
+        with pytest.warns(UserWarning):
+            faults = list(
+                decompose_dem_stream(
+                    dem, window=2, ignore_logical_error=True, stats=stats
+                )
+            )
+            expected_dem = decompose_dem(dem, ignore_logical_error=True)
+        expected_dem = from_stim_to_dem(expected_dem)
+
+        assert len(faults) == dem.num_errors
+        for prob, dets, logs, decomposition in faults:
+            id_ = expected_dem.det_to_id[dets]
+            expected = expected_dem.decompositions.get(id_)
+            if expected is None:
+                assert decomposition is None
+                continue
+            expected = set(
+                (expected_dem.detectors[i], expected_dem.logicals[i]) for i in expected
+            )
+            assert set(decomposition) == expected
+
+        if rounds == 10:
+            max_faults = stats["max_faults_in_memory"]
+    # the memory does not depend on the number of rounds
+    assert stats["max_faults_in_memory"] <= 1.1 * max_faults
+
+    faults = [(0.1, [0, 1, 2], []), (0.1, [0, 1], []), (0.1, [2], [])]
+    faults = list(decompose_dem_stream(faults, window=1, detectors_per_round=3))
+    assert faults[0][3] == (((0, 1), ()), ((2,), ()))
+
+    with pytest.raises(ValueError):
+        list(decompose_dem_stream([(0.1, [9], []), (0.1, [0], [])], 1, 1))
+
+    return
+
+
+def test_decompose_dem_incremental():
+    circuit = stim.Circuit.generated(
+        "surface_code:rotated_memory_z",
+        distance=5,
+        rounds=5,
+        after_clifford_depolarization=0.01,
+        before_measure_flip_probability=0.01,
+    )
+    dem = from_stim_to_dem(circuit.detector_error_model())
+    decompose_dem(dem, mode="logical-aware")
+    assert dem.dirty_faults == []
+
+    hyperedges = [i for i in dem.ids if len(dem.detectors[i]) > 2]
+    dem.set_probs(dem.primitives[10:12], [0.2, 0.001])
+    dem.remove_faults([hyperedges[0], dem.primitives[50]])
+    stats = {}
+    decompose_dem(dem, mode="logical-aware", incremental=True, stats=stats)
+    assert dem.dirty_faults == []
+    assert 0 < stats["num_hyperedges"] < len(hyperedges) / 2
+
+    # same weights as decomposing all the hyperedges again
+    expected_dem = DEM()
+    expected_dem.add_faults(
+        [dem.probs[i] for i in dem.ids],
+        [dem.detectors[i] for i in dem.ids],
+        [dem.logicals[i] for i in dem.ids],
+    )
+    expected_dem.set_as_primitives(dem.primitives)
+    decompose_dem(expected_dem, mode="logical-aware")
+    weights = probs_to_weights([dem.probs[i] for i in dem.ids])
+    for id_, decomposition in expected_dem.decompositions.items():
+        assert weights[list(dem.decompositions[id_])].sum() == pytest.approx(
+            weights[list(decomposition)].sum()
+        )
+
+    return
+
+
+def test_decompose_dem_regions():
+    circuit = stim.Circuit.generated(
+        "surface_code:rotated_memory_z",
+        distance=5,
+        rounds=5,
+        after_clifford_depolarization=0.01,
+        before_measure_flip_probability=0.01,
+    )
+    dem = circuit.detector_error_model()
+
+    stats = {}
+    expected_dem = decompose_dem(dem)
+    decom_dem = decompose_dem(dem, region_size=(6, 6, 3), stats=stats)
+    with ThreadPoolExecutor(2) as executor:
+        parallel_dem = decompose_dem(dem, region_size=(6, 6, 3), executor=executor)
+    assert decom_dem == expected_dem
+    assert parallel_dem == expected_dem
+    assert stats["num_regions"] > 1
+    assert stats["num_in_regions"] == stats["num_hyperedges"]
+
+    # hyperedges farther than the margin from their cell use the global graph
+    decompose_dem(dem, region_size=(6, 6, 3), region_margin=0, stats=stats)
+    assert stats["num_global"] > 0
+    assert stats["num_in_regions"] + stats["num_global"] == stats["num_hyperedges"]
+
+    with pytest.raises(ValueError):
+        decompose_dem(from_stim_to_dem(dem), region_size=3)
+    with pytest.raises(ValueError):
+        decompose_dem(dem, region_size=3, local_radius=2)
+
+    # regions without primitive faults use the global graph
+    dem = stim.DetectorErrorModel(
+        """
+        detector(0, 0) D0
+        detector(1, 0) D1
+        detector(0, 1) D2
+        detector(10, 10) D3
+        error(0.1) D0 D3
+        error(0.1) D1 D3
+        error(0.1) D2 D3
+        error(0.1) D3
+        error(0.01) D0 D1 D2
+        """
+    )
+    stats = {}
+    decom_dem = decompose_dem(dem, region_size=2, region_margin=0, stats=stats)
+    assert decom_dem == decompose_dem(dem)
+    assert stats["num_regions"] == 0
+    assert stats["num_global"] == 1
+
+    return
+
+
+def test_decompose_dem_sweep(monkeypatch):
+    component = """
+        error(0.1) D0 D1 D2 D3
+        error(0.1) D0 D1
+        error(0.1) D2 D3
+        error(0.01) D0 D2
+        error(0.01) D1 D3
+        error(0.01) D0
+        error(0.01) D3
+        """
+    # the probabilities of the second component do not change
+    dem = stim.DetectorErrorModel(component + "shift_detectors 4" + component)
+    probs = np.array(
+        [
+            [0.1, 0.1, 0.1, 0.01, 0.01, 0.01, 0.01],
+            [0.2, 0.2, 0.2, 0.01, 0.01, 0.01, 0.01],
+            [0.2, 0.01, 0.01, 0.1, 0.1, 0.01, 0.01],
+        ]
+    )
+    probs = np.concatenate([probs, np.tile(probs[0], (3, 1))], axis=1)
+
+    decom_dem, decom_probs = decompose_dem_sweep(dem, probs)
+
+    assert decom_probs.shape == (3, 12)
+    assert set(decom_dem.decompositions[0]) == set([1, 2])
+    for k in range(2):
+        new_dem = decompose_dem(from_stim_to_dem(dem).with_probs(probs[k]))
+        expected = new_dem.get_decomposed_dem()
+        assert (decom_probs[k] == expected.get_decomposed_probs()).all()
+
+    # the affected hyperedges are searched even if most faults change
+    monkeypatch.setattr(decomposition, "_SWEEP_MAX_MODIFIED", 10)
+    stats = {}
+    _, stable_probs = decompose_dem_sweep(dem, probs, check_stability=True, stats=stats)
+    monkeypatch.undo()
+
+    new_dem = decompose_dem(from_stim_to_dem(dem).with_probs(probs[2]))
+    assert set(new_dem.decompositions[0]) == set([3, 4])
+    assert (stable_probs[2] == new_dem.get_decomposed_probs()).all()
+    assert (stable_probs[2] != decom_probs[2]).any()
+    assert (stable_probs[:2] == decom_probs[:2]).all()
+    # only the hyperedge close to the modified faults is decomposed again
+    assert stats["num_affected"] == [0, 1, 1]
+    assert stats["unstable_hyperedges"] == [[], [], [0]]
+
+    # the new choice has a different logical effect
+    dem = stim.DetectorErrorModel(component.replace("D0 D2", "D0 D2 L0"))
+    with pytest.raises(ValueError, match="point 2"):
+        decompose_dem_sweep(dem, probs[:, :7], check_stability=True)
+    with pytest.warns(UserWarning, match="point 2"):
+        _, stable_probs = decompose_dem_sweep(
+            dem, probs[:, :7], ignore_logical_error=True, check_stability=True
+        )
+    assert (stable_probs == decompose_dem_sweep(dem, probs[:, :7])[1]).all()
+
+    return
+
+
 def test_find_valid_decomposition():
     primitive_dem = stim.DetectorErrorModel(
         """
@@ -75,4 +651,69 @@ def test_find_valid_decomposition():
     assert valid_decom is not None
     assert set(valid_decom) == set([1, 2])
 
+    primitive_dem = from_stim_to_dem(
+        stim.DetectorErrorModel(
+            """
+            error(0.1) D0 D1 L0
+            error(0.1) D2 D3
+            error(0.1) D1
+            """
+        )
+    )
+
+    valid_decom = find_valid_decomposition(primitive_dem, hyperfault)
+
+    assert valid_decom is None
+
+    return
+
+
+def test_find_valid_decompositions():
+    primitive_dem = stim.DetectorErrorModel(
+        """
+        error(0.1) D0 D1 L0
+        error(0.1) D2 D3
+        error(0.1) D0 D1
+        """
+    )
+    hyperfaults = stim.DetectorErrorModel(
+        """
+        error(0.1) D0 D1 D2 D3
+        error(0.1) D0 D1 D2 D3 L0
+        error(0.1) D0 D2
+        error(0.1) D0 D1 D2 D3
+        error(0.1) D0 D5
+        """
+    )
+
+    valid_decoms = find_valid_decompositions(primitive_dem, hyperfaults)
+
+    assert len(valid_decoms) == 5
+    assert set(valid_decoms[0]) == set([1, 2])
+    assert set(valid_decoms[1]) == set([0, 1])
+    assert valid_decoms[2] is None
+    assert valid_decoms[3] == valid_decoms[0]
+    assert valid_decoms[4] is None
+    for hyperfault, valid_decom in zip(hyperfaults, valid_decoms):
+        assert find_valid_decomposition(primitive_dem, hyperfault) == valid_decom
+
+    assert find_valid_decompositions(primitive_dem, []) == []
+
+    # the indices refer to the instructions even if some are repeated
+    primitive_dem = stim.DetectorErrorModel(
+        """
+        error(0.1) D0 D1
+        error(0.1) D0 D1
+        error(0.1) D2 D3 L0
+        """
+    )
+    hyperfaults = stim.DetectorErrorModel(
+        """
+        error(0.1) D0 D1 D2 D3 L0
+        error(0.1) D2 D3 L0
+        """
+    )
+    valid_decoms = find_valid_decompositions(primitive_dem, hyperfaults)
+    assert valid_decoms == [(0, 2), (2,)]
+
     return
@@ -1,3 +1,4 @@
+import numpy as np
 import pytest
 
 from hyper_decom import DEM
@@ -56,3 +57,220 @@ def test_DEM_add_decomposition_failure():
         my_dem.add_decomposition(0, (1, 2))
 
     return
+
+
+def test_DEM_views():
+    my_dem = DEM()
+    for k in range(100):
+        my_dem.add_fault(0.1, [k, k + 1], [])
+    my_dem.add_fault(0.1, [1, 0], [])
+
+    assert my_dem.num_faults == 100
+    assert len(my_dem.ids) == 100
+    assert my_dem.probs[0] == pytest.approx(0.18)
+    assert my_dem.detectors[99] == (99, 100)
+    assert dict(my_dem.detectors.items())[5] == (5, 6)
+    assert 100 not in my_dem.ids
+    assert 100 not in my_dem.detectors
+    assert not my_dem.is_primitive(100)
+    assert len(my_dem.decompositions) == 0
+    assert my_dem.get_undecomposed_faults() == list(range(100))
+
+    with pytest.raises(ValueError):
+        my_dem.set_as_primitive(100)
+
+    return
+
+
+def test_DEM_add_faults():
+    probs = [0.1, 0.2, 0.3, 0.1, 0.4]
+    dets = [[2, 1], [0], [1, 2], [3, 0, 1], []]
+    logs = [[0], [], [0], [1], [0]]
+
+    my_dem = DEM()
+    for p, d, l in zip(probs, dets, logs):
+        my_dem.add_fault(p, d, l)
+
+    bulk_dem = DEM()
+    ids = bulk_dem.add_faults(probs, dets, logs)
+
+    assert list(ids) == [0, 1, 0, 2, 3]
+    assert bulk_dem.num_faults == my_dem.num_faults
+    for id_ in my_dem.ids:
+        assert bulk_dem.get_info_fault(id_) == my_dem.get_info_fault(id_)
+    assert bulk_dem.det_to_id == my_dem.det_to_id
+
+    ids = bulk_dem.add_faults([0.1, 0.1], [[0], [5]], [[], []])
+    assert list(ids) == [1, 4]
+    assert bulk_dem.probs[1] == pytest.approx(0.26)
+
+    with pytest.raises(ValueError):
+        bulk_dem.add_faults([0.1], [[1, 2]], [[]])
+    with pytest.raises(ValueError):
+        bulk_dem.add_faults([0.1, 0.1], [[7], [7]], [[], [1]])
+    with pytest.raises(ValueError):
+        bulk_dem.add_faults([1.1], [[7]], [[]])
+
+    bulk_dem.set_as_primitive(3)
+    bulk_dem.set_as_primitives([4, 1, 3, 4])
+    assert bulk_dem.primitives == [3, 4, 1]
+    assert bulk_dem.prim_det_to_id[(5,)] == 4
+    with pytest.raises(ValueError):
+        bulk_dem.set_as_primitives([2])
+
+    return
+
+
+def test_DEM_from_arrays():
+    my_dem = DEM.from_arrays(
+        probs=np.array([0.1, 0.2, 0.1]),
+        det_ptr=np.array([0, 2, 3, 5]),
+        det_ind=np.array([1, 0, 2, 0, 1]),
+        log_ptr=np.array([0, 1, 1, 2]),
+        log_ind=np.array([0, 0]),
+    )
+
+    assert my_dem.num_faults == 2
+    assert my_dem.detectors[0] == (0, 1)
+    assert my_dem.logicals[0] == (0,)
+    assert my_dem.probs[0] == pytest.approx(0.18)
+    assert my_dem.det_to_id == {(0, 1): 0, (2,): 1}
+
+    with pytest.raises(ValueError):
+        DEM.from_arrays(
+            probs=np.array([0.1]),
+            det_ptr=np.array([0, 2]),
+            det_ind=np.array([0]),
+            log_ptr=np.array([0, 0]),
+            log_ind=np.array([]),
+        )
+
+    return
+
+
+def test_DEM_matrices():
+    my_dem = DEM()
+    my_dem.add_faults([0.1, 0.2, 0.3], [[0, 1], [1], [3]], [[1], [], [0]])
+
+    check_matrix = my_dem.check_matrix()
+    assert (
+        check_matrix.toarray() == [[1, 0, 0], [1, 1, 0], [0, 0, 0], [0, 0, 1]]
+    ).all()
+    assert (my_dem.observables_matrix().toarray() == [[0, 0, 1], [1, 0, 0]]).all()
+    assert (my_dem.priors() == [0.1, 0.2, 0.3]).all()
+    assert my_dem.check_matrix() is check_matrix
+
+    my_dem.add_fault(0.1, [4], [])
+    assert my_dem.check_matrix().shape == (5, 4)
+
+    aug_dem = my_dem.get_logical_augmented_dem()
+    assert aug_dem.detectors[0] == (0, 1, 6)
+    assert aug_dem.logicals[0] == tuple()
+    assert aug_dem.check_matrix().shape == (7, 4)
+
+    return
+
+
+def test_DEM_matching():
+    my_dem = DEM()
+    my_dem.add_faults(
+        [0.1, 0.2, 0.1, 0.05, 0.01],
+        [[0], [0, 1], [1], [1, 2], [0, 1, 2]],
+        [[0], [], [], [1], [0, 1]],
+    )
+    my_dem.set_as_primitives([0, 1, 2, 3])
+    assert my_dem.primitives_cover_detectors()
+
+    # the observables are the positions of the primitive faults
+    matching = my_dem.primitive_matching(label_faults=True)
+    assert matching.num_detectors == 3
+    assert (matching.decode([1, 0, 1]) == [0, 1, 0, 1]).all()
+    assert (my_dem.primitive_matching().decode([1, 0, 1]) == [0, 1]).all()
+
+    my_dem.add_decomposition(4, [0, 3])
+    matching = my_dem.to_matching()
+    assert matching.num_edges == 4
+    assert (matching.decode([1, 0, 1]) == [0, 1]).all()
+
+    my_dem.add_fault(0.1, [3, 4, 5], [])
+    assert not my_dem.primitives_cover_detectors()
+
+    return
+
+
+def test_DEM_edit():
+    my_dem = DEM()
+    my_dem.add_faults(
+        [0.1, 0.2, 0.1, 0.05, 0.01],
+        [[0], [0, 1], [1], [1, 2], [0, 1, 2]],
+        [[0], [], [], [1], [0, 1]],
+    )
+    my_dem.set_as_primitives([0, 1, 2, 3])
+    my_dem.add_decomposition(4, [0, 3])
+    assert my_dem.dirty_faults is None
+
+    my_dem.mark_clean()
+    my_dem.set_probs([1], [0.3])
+    my_dem.add_fault(0.1, [2], [])
+    assert my_dem.dirty_faults == [1, 5]
+    assert my_dem.probs[1] == 0.3
+    assert my_dem.get_faults_of_detectors([2, 7]).tolist() == [3, 4, 5]
+
+    new_ids = my_dem.remove_faults([0, 2])
+    assert new_ids.tolist() == [-1, 0, -1, 1, 2, 3]
+    assert my_dem.num_faults == 4
+    assert my_dem.detectors[3] == (2,)
+    assert my_dem.primitives == [0, 1]
+    # the decomposition of the hyperedge contained a removed fault
+    assert not my_dem.decomposed[2]
+    assert my_dem.dirty_faults == [0, 2, 3]
+    assert my_dem.get_faults_of_detectors([2]).tolist() == [1, 2, 3]
+
+    with pytest.raises(ValueError):
+        my_dem.set_probs([0], [1.5])
+    with pytest.raises(ValueError):
+        my_dem.remove_faults([4])
+
+    return
+
+
+def test_DEM_save_load(tmp_path):
+    my_dem = DEM()
+    my_dem.add_fault(0.1, [0, 1, 2], [10, 1])
+    my_dem.add_fault(0.2, [0], [1, 10])
+    my_dem.add_fault(0.3, [1], [1])
+    my_dem.add_fault(0.4, [2], [1])
+    my_dem.add_fault(0.4, [3], [])
+    my_dem.set_as_primitive(3)
+    my_dem.set_as_primitive(1)
+    my_dem.set_as_primitive(2)
+    my_dem.add_decomposition(0, (1, 2, 3))
+
+    my_dem.save(tmp_path / "dem.bin")
+
+    for mmap_mode in ["r", "c", None]:
+        loaded_dem = DEM.load(tmp_path / "dem.bin", mmap_mode=mmap_mode)
+        assert loaded_dem.num_faults == my_dem.num_faults
+        assert loaded_dem.primitives == my_dem.primitives
+        assert loaded_dem.det_to_id == my_dem.det_to_id
+        assert loaded_dem.prim_det_to_id == my_dem.prim_det_to_id
+        for id_ in my_dem.ids:
+            assert loaded_dem.get_info_fault(id_) == my_dem.get_info_fault(id_)
+        assert loaded_dem.get_undecomposed_faults() == [4]
+
+    loaded_dem = DEM.load(tmp_path / "dem.bin", mmap_mode="r")
+    with pytest.raises(ValueError):
+        loaded_dem.set_as_primitive(4)
+
+    loaded_dem = DEM.load(tmp_path / "dem.bin", mmap_mode="c")
+    loaded_dem.set_as_primitive(4)
+    loaded_dem.add_fault(0.1, [5], [])
+    assert loaded_dem.num_faults == 6
+    assert DEM.load(tmp_path / "dem.bin").get_undecomposed_faults() == [4]
+
+    with open(tmp_path / "other.bin", "wb") as file:
+        file.write(b"other format")
+    with pytest.raises(ValueError):
+        DEM.load(tmp_path / "other.bin")
+
+    return
@@ -0,0 +1,50 @@
+import os
+
+import pytest
+import stim
+
+from hyper_decom import DEM, DiskCache
+
+
+def test_DiskCache(tmp_path):
+    cache = DiskCache(tmp_path / "cache", max_bytes=10**6)
+
+    dem = DEM()
+    dem.add_faults([0.1, 0.2], [[0, 1], [1]], [[0], []])
+    stim_dem = stim.DetectorErrorModel("error(0.1) D0 D1 L0\nerror(0.2) D1")
+
+    key = cache.get_key(dem, ignore_logical_error=False)
+    assert key == cache.get_key(dem, ignore_logical_error=False)
+    assert key != cache.get_key(dem, ignore_logical_error=True)
+    assert key != cache.get_key(stim_dem, ignore_logical_error=False)
+    assert cache.get(key) is None
+
+    cache.put(key, dem)
+    loaded_dem = cache.get(key)
+    assert loaded_dem.get_info_fault(0) == dem.get_info_fault(0)
+
+    stim_key = cache.get_key(stim_dem)
+    cache.put(stim_key, stim_dem)
+    assert cache.get(stim_key) == stim_dem
+    assert cache.get_stats()["size"] == 2
+
+    # least recently used results are evicted
+    os.utime(cache.directory / (key + ".bin"), (0, 0))
+    cache.max_bytes = 1
+    cache.put(stim_key, stim_dem)
+    assert cache.get(key) is None
+    assert cache.get(stim_key) == stim_dem
+    assert cache.num_evictions == 1
+
+    # the cache can be shared between instances
+    assert DiskCache(tmp_path / "cache").get(stim_key) == stim_dem
+
+    cache.clear()
+    assert cache.get_stats()["size"] == 0
+
+    with pytest.raises(TypeError):
+        cache.get_key("dem")
+    with pytest.raises(ValueError):
+        DiskCache(tmp_path, max_bytes=0)
+
+    return
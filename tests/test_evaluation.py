@@ -0,0 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import pytest
+import stim
+
+from hyper_decom import decompose_dem, estimate_logical_error_rates, from_stim_to_dem
+
+
+def test_estimate_logical_error_rates():
+    circuit = stim.Circuit.generated(
+        "surface_code:rotated_memory_z",
+        distance=3,
+        rounds=3,
+        after_clifford_depolarization=0.01,
+        before_measure_flip_probability=0.01,
+    )
+    dem = circuit.detector_error_model()
+    strategies = {
+        "hyper_decom": decompose_dem(from_stim_to_dem(dem), mode="logical-aware"),
+        "function": partial(decompose_dem, mode="logical-aware"),
+        "stim": circuit.detector_error_model(decompose_errors=True),
+    }
+
+    partial_results = []
+    results = estimate_logical_error_rates(
+        circuit,
+        strategies,
+        max_shots=4_000,
+        chunk_size=1_000,
+        seed=1,
+        progress=partial_results.append,
+    )
+    assert len(partial_results) == 4
+    for result in results.values():
+        assert result["num_shots"] == 4_000
+        assert 0 < result["logical_error_rate"] < 0.5
+        low, high = result["confidence_interval"]
+        assert low < result["logical_error_rate"] < high
+    assert results["hyper_decom"] == results["function"]
+
+    with ThreadPoolExecutor(2) as executor:
+        parallel_results = estimate_logical_error_rates(
+            circuit,
+            strategies,
+            max_shots=4_000,
+            chunk_size=1_000,
+            seed=1,
+            executor=executor,
+        )
+    assert parallel_results == results
+
+    results = estimate_logical_error_rates(
+        circuit, strategies, max_shots=10**6, chunk_size=1_000, max_errors=10, seed=1
+    )
+    assert results["stim"]["num_shots"] < 10**6
+    assert min(r["num_errors"] for r in results.values()) >= 10
+
+    with pytest.raises(TypeError):
+        estimate_logical_error_rates(circuit, {"wrong": 1})
+
+    return
@@ -0,0 +1,34 @@
+import pytest
+
+from hyper_decom import DEM
+from hyper_decom.local_decomposition import LocalDecomposer
+
+
+def test_LocalDecomposer():
+    dem = DEM()
+    dem.add_faults(
+        [0.1, 0.1, 0.1, 0.01, 0.1],
+        [[0, 1], [1, 2], [2, 3], [3], [0]],
+        [[], [], [], [0], [0]],
+    )
+    dem.set_as_primitives(list(dem.ids))
+    prim_dem = dem.get_primitive_graph()
+
+    decomposer = LocalDecomposer(prim_dem, radius=10)
+    assert decomposer.decompose([0, 1, 2, 3]) == [0, 2]
+    assert decomposer.decompose([0, 2]) == [0, 1]
+    assert decomposer.decompose([0, 3]) == [0, 1, 2]
+    assert decomposer.decompose([1]) == [0, 4]
+    assert decomposer.get_stats() == {"num_local": 4, "num_global": 0}
+
+    decomposer = LocalDecomposer(prim_dem, radius=3)
+    assert decomposer.decompose([0, 1]) == [0]
+    assert decomposer.decompose([1]) is None  # weight larger than the radius
+    assert decomposer.get_stats() == {"num_local": 1, "num_global": 1}
+
+    with pytest.raises(ValueError):
+        LocalDecomposer(prim_dem, radius=0)
+    with pytest.raises(TypeError):
+        LocalDecomposer("dem", radius=1)
+
+    return
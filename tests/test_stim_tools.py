@@ -2,7 +2,11 @@ import pytest
 import stim
 
 from hyper_decom import DEM
-from hyper_decom.stim_tools import from_stim_to_dem, from_dem_to_stim
+from hyper_decom.stim_tools import (
+    from_stim_to_dem,
+    from_stim_to_dem_fast,
+    from_dem_to_stim,
+)
 
 
 def test_from_stim_to_dem():
@@ -45,6 +49,45 @@ def test_from_stim_to_dem():
     return
 
 
+def test_from_stim_to_dem_fast():
+    stim_dem = stim.DetectorErrorModel(
+        """
+        error(0.1) D1 D2 ^ D2 L0
+        error[tag](0.2) D7
+        error(0.3) D3 L0 ^ D4 L0
+        error(0.1) D1 D2
+        error(0.1) D2 L0
+        error(0.1) D3 L0
+        error(0.1) D4 L0
+        error(0.1) D5 D5 L1 L1
+        error(0.05) D2 D1 ^ D2 L0 L0
+        repeat 2 {
+            error(0.01) D8 D9
+            shift_detectors 1
+        }
+        """
+    )
+
+    for load_decompositions in [True, False]:
+        dem = from_stim_to_dem(stim_dem, load_decompositions)
+        fast_dem = from_stim_to_dem_fast(stim_dem, load_decompositions)
+
+        assert fast_dem.ids == dem.ids
+        assert fast_dem.probs == dem.probs
+        assert fast_dem.detectors == dem.detectors
+        assert fast_dem.logicals == dem.logicals
+        assert fast_dem.primitives == dem.primitives
+        assert fast_dem.decompositions == dem.decompositions
+        assert fast_dem.decomposed == dem.decomposed
+
+    stim_dem = stim.DetectorErrorModel("error(0.1) D1 ^ D2")
+    with pytest.raises(ValueError) as e:
+        _ = from_stim_to_dem_fast(stim_dem)
+    assert "error(0.1) D1 ^ D2" in str(e.value)
+
+    return
+
+
 def test_from_dem_to_stim():
     dem = DEM()
     dem.add_fault(0.1, [0, 1], [])
@@ -66,5 +109,6 @@ def test_from_dem_to_stim():
         """
     )
     assert stim_dem == expected_dem
+    assert from_dem_to_stim(DEM()) == stim.DetectorErrorModel()
 
     return
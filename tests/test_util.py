@@ -1,4 +1,12 @@
-from hyper_decom.util import xor_lists, xor_two_probs
+import numpy as np
+
+from hyper_decom.util import (
+    DetectorSet,
+    xor_lists,
+    xor_two_probs,
+    xor_csr_rows,
+    scatter_xor_probs,
+)
 
 
 def test_xor_lists():
@@ -10,6 +18,46 @@ def test_xor_lists():
 
     assert output == (1, 5)
 
+    output = xor_lists([1, 1, 2], [2])
+    assert output == (1,)
+
+    return
+
+
+def test_DetectorSet():
+    a = DetectorSet([1000, 1002, 1001])
+    b = DetectorSet((1001, 7))
+    c = DetectorSet()
+
+    assert a.to_tuple() == (1000, 1001, 1002)
+    assert (a ^ b).to_tuple() == (7, 1000, 1002)
+    assert a ^ b == DetectorSet([1002, 1000, 7])
+    assert hash(a ^ b) == hash(DetectorSet(np.array([7, 1000, 1002])))
+    assert a ^ a == c
+    assert len(a) == 3
+    assert not c
+    assert list(b) == [7, 1001]
+
+    output = DetectorSet.xor_many([a, [1000], b, (7, 5), np.array([], dtype=int)])
+    assert output.to_tuple() == xor_lists(a, [1000], b, (7, 5))
+    assert output.to_tuple() == (5, 1002)
+
+    # numpy integers are not shifted with overflow
+    assert DetectorSet([np.int64(0), np.int64(100)]).to_tuple() == (0, 100)
+
+    return
+
+
+def test_xor_csr_rows():
+    ptr = np.array([0, 2, 3, 5, 5])
+    ind = np.array([0, 1, 1, 2, 3])
+    groups = np.array([0, 0, 2, 1])
+
+    out_ptr, out_ind = xor_csr_rows(ptr, ind, groups, num_groups=3)
+
+    assert out_ptr.tolist() == [0, 1, 1, 3]
+    assert out_ind.tolist() == [0, 2, 3]
+
     return
 
 
@@ -20,3 +68,23 @@ def test_xor_two_probs():
     output = xor_two_probs(0.5, 0.5)
     assert output == 0.5
     return
+
+
+def test_scatter_xor_probs():
+    probs = np.array([0.1, 0.2, 0.3])
+    targets = np.array([2, 0, 2, 2])
+    values = np.array([0.01, 0.02, 0.03, 0.04])
+
+    output = scatter_xor_probs(probs, targets, values)
+
+    expected = probs.copy()
+    for t, v in zip(targets, values):
+        expected[t] = xor_two_probs(expected[t], v)
+    assert (output == expected).all()
+    assert (probs == [0.1, 0.2, 0.3]).all()
+
+    output = scatter_xor_probs(probs, targets, np.stack([values, values]))
+    assert output.shape == (2, 3)
+    assert (output == expected).all()
+
+    return